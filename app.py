@@ -5,6 +5,7 @@ from flask_jwt_extended import JWTManager
 from flask_migrate import Migrate
 from flask_restful import Api
 
+from core import dataset_access
 from db import db
 from resources.audit.dataset_action_history import DatasetActionHistoryCollection
 from resources.auth.api_key import APIKeyCollection, APIKeyRevokeCollection
@@ -44,6 +45,7 @@ def create_app(config):
     
     api = Api(app)
     JWTManager(app)
+    app.cli.add_command(dataset_access.rebuild_command)
     
     api.add_resource(DatasetActionHistoryCollection, "/audit/dataset")
     api.add_resource(APIKeyCollection, "/auth/api_key")
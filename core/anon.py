@@ -1,86 +1,276 @@
+import io
+import math
 import os
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from itertools import islice, repeat
+
 import img2pdf
 
+from core import redaction
 from core.constants import AnonymizationType, SupportedFiles
 from loguru import logger
 from pdf2image import convert_from_path
 from PIL import Image
+from PyPDF2 import PdfFileReader, PdfFileWriter
+
+MARKER_DPI: int = 600  # Resolution of the pixel space PDF image markers are given in
+MAX_DPI: int = int(os.getenv("PDF_MAX_DPI") or MARKER_DPI)  # Highest resolution PDF pages are rasterized at
+MIN_DPI: int = int(os.getenv("PDF_MIN_DPI") or 150)  # Lowest resolution PDF pages are rasterized at
+MIN_MARKER_PIXELS: int = int(os.getenv("PDF_MIN_MARKER_PIXELS") or 8)  # Smallest rasterized side of a marker box
+PAGE_WINDOW: int = int(os.getenv("PDF_RASTER_WINDOW") or 1)  # PDF pages rasterized at a time
+PAGE_FORMAT: str = (os.getenv("IMAGE_REDACTION_FORMAT") or "PNG").upper()  # Encoding of redacted PDF pages
+PAGE_QUALITY: int = int(os.getenv("IMAGE_REDACTION_QUALITY") or 85)  # JPEG quality of redacted PDF pages
+# Bytes of rasterized PDF output a request keeps in memory, later windows of pages are spilled to temporary files
+RASTER_SPOOL_SIZE: int = int(os.getenv("PDF_RASTER_SPOOL_SIZE") or 32 * 1024 * 1024)
+
+
+def source_dpi(page) -> float:
+    """
+    Estimates the resolution of the images drawn on a PDF page, assuming they span the page as scans do.
+    :param page: PyPDF2 page
+    :return: Highest horizontal resolution of the page's images, 0 if the page has no images
+    """
+    page_width = float(page.mediaBox.getWidth()) / 72  # Inches
+    resources = page.get("/Resources")
+    xobjects = resources.getObject().get("/XObject") if resources else None
+    if not xobjects or page_width <= 0:
+        return 0
+
+    widths = [
+        xobject.getObject().get("/Width", 0) for xobject in xobjects.getObject().values()
+        if xobject.getObject().get("/Subtype") == "/Image"
+    ]
+    return max(widths, default=0) / page_width
+
 
+def plan_dpi(page, markers: list) -> int:
+    """
+    Picks the lowest resolution a PDF page can be rasterized at without losing detail of its images or the precision
+    of its markers, between MIN_DPI and MAX_DPI.
+    :param page: PyPDF2 page
+    :param markers: Image markers on the page, in pixels at MARKER_DPI
+    :return: Resolution in dots per inch
+    """
+    dpi = source_dpi(page)
+
+    # Every marker box must still span MIN_MARKER_PIXELS in each direction once scaled down
+    sides = [min(marker.x2 - marker.x1, marker.y2 - marker.y1) for marker in markers]
+    smallest_side = min((side for side in sides if side > 0), default=0)
+    if smallest_side:
+        dpi = max(dpi, MARKER_DPI * MIN_MARKER_PIXELS / smallest_side)
+
+    return int(min(max(math.ceil(dpi), MIN_DPI), MAX_DPI))
 
-REDACTION_CHAR_STR: str = "<REDACTED>"
 
 class ImageRedactor:
-    def __init__(self, filepath):
+    def __init__(self, filepath, window: int = None, workers: int = None, page_format: str = None,
+                 quality: int = None):
+        """
+        :param filepath: Path of the PDF or image to redact
+        :param window: Number of PDF pages rasterized at a time, defaults to PDF_RASTER_WINDOW or 1. Memory use grows
+        with the window, not with the number of pages or workers, and pages of a window are redacted in parallel.
+        :param workers: Number of threads pages are redacted in, defaults to IMAGE_REDACTION_WORKERS or the CPU count
+        :param page_format: PNG (lossless) or JPEG (smaller output) encoding of redacted PDF pages, defaults to
+        IMAGE_REDACTION_FORMAT or PNG
+        :param quality: JPEG quality from 1 to 95, defaults to IMAGE_REDACTION_QUALITY or 85
+        """
         self.filepath = filepath
+        self.workers = workers or int(os.getenv("IMAGE_REDACTION_WORKERS") or os.cpu_count() or 1)
+        self.window = window or PAGE_WINDOW
+        self.page_format = (page_format or PAGE_FORMAT).upper()
+        self.quality = quality or PAGE_QUALITY
+        if self.page_format not in ("PNG", "JPEG"):
+            raise ValueError(f"Page format {self.page_format} not supported.")
         _, ext = os.path.splitext(filepath)
         self.is_pdf = False
         if ext == ".pdf":
-            self.imgs = self.convert_pdf_to_images(filepath)
+            # Pages are only rasterized as they are redacted, see iter_windows()
+            self.imgs = []
+            with open(filepath, "rb") as f:
+                self.page_count = PdfFileReader(f, strict=False).getNumPages()
             self.is_pdf = True
         elif ext in SupportedFiles.IMAGE_BASED:
             self.imgs = [Image.open(filepath)]
+            self.page_count = 1
 
     @staticmethod
-    def convert_pdf_to_images(pdf_path: str) -> list:
+    def convert_pdf_to_images(pdf_path: str, first_page: int = None, last_page: int = None,
+                              thread_count: int = 1, dpi: int = MAX_DPI) -> list:
         """ 
-        converts each page of the pdf into an image
+        converts each page of the pdf, or of the range of pages from first_page to last_page (1-based, inclusive),
+        into an image
 
         returns a list of Images
         """
-        pages = convert_from_path(pdf_path, dpi=600)
-        img_name, _ = os.path.splitext(os.path.basename(pdf_path))
-        for i, page in enumerate(pages):
-            page.filename = f"{img_name}_{i}.png"
-        return pages
-
-    def _redact_images(self, markers: list):
-        masked_imgs = []
-        for img in self.imgs:
-            if type(img) == str:
-                img = Image.open(img)
-            masked_imgs.append(img)
+        return convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page,
+                                 thread_count=thread_count)
+
+    def iter_windows(self, plan: dict = None):
+        """
+        Yields the pages to redact as (list of page indices, resolution, list of pages). PDF pages are rasterized a
+        window at a time, so only the current window is held in memory. A window holds consecutive pages planned at the
+        same resolution.
+        :param plan: Dict of 0-based index => resolution of the PDF pages to rasterize
+        """
+        if not self.is_pdf:
+            yield list(range(len(self.imgs))), None, self.imgs
+            return
+
+        pages = sorted(plan)
+        i = 0
+        while i < len(pages):
+            j = i + 1
+            while j < len(pages) and j - i < self.window and pages[j] == pages[j - 1] + 1 \
+                    and plan[pages[j]] == plan[pages[i]]:
+                j += 1
+            window = pages[i:j]
+            thread_count = min(self.workers, len(window))
+            images = self.convert_pdf_to_images(self.filepath, window[0] + 1, window[-1] + 1, thread_count,
+                                                plan[window[0]])
+            yield window, plan[window[0]], images
+            i = j
+
+    def _redact_page(self, img, markers: list, dpi: int = None):
+        if type(img) == str:
+            img = Image.open(img)
+        width, height = img.size
+        scale = dpi / MARKER_DPI if dpi else 1
+        for marker in markers:
+            coord_tuple = self._convert_coordinates(marker, height, scale)
+            img.paste(0, coord_tuple[:4]) # draws the bbox on the page
+        return img
+
+    def encode_page(self, img, dpi: int = None) -> bytes:
+        """
+        Encodes a redacted page in the configured format and releases the page image. The resolution is stored with
+        the page so img2pdf keeps the size of the original page.
+        """
+        buffer = io.BytesIO()
+        options = {"dpi": (dpi, dpi)} if dpi else {}
+        if self.page_format == "JPEG":
+            page = img if img.mode in ("RGB", "L", "CMYK") else img.convert("RGB")
+            page.save(buffer, format="JPEG", quality=self.quality, optimize=True, **options)
+        else:
+            img.save(buffer, format="PNG", **options)
+        img.close()
+        return buffer.getvalue()
+
+    def _redact_and_encode(self, img, markers: list, dpi: int = None) -> bytes:
+        return self.encode_page(self._redact_page(img, markers, dpi), dpi)
+
+    @staticmethod
+    def _page_markers(markers: list) -> dict:
+        # Group the markers by page once, so each page only looks at its own markers
+        page_markers = defaultdict(list)
         for marker in markers:
-            pg_num = 0 # TODO: ADD SUPPORT FOR MULTI-PAGE PDF
-            width, height = masked_imgs[pg_num].size
-            coord_tuple = self._convert_coordinates(marker, height)
-            masked_imgs[pg_num].paste(0, coord_tuple[:4]) # draws the bbox on the page
-        return masked_imgs
+            page_markers[marker.page_number - 1].append(marker)
+        return page_markers
+
+    def _redact_images(self, markers: list, encode: bool = False, plan: dict = None):
+        """
+        Yields the redacted pages in order, as images, or as encoded pages if encode is set.
+        :param plan: Dict of 0-based index => resolution of the PDF pages to redact
+        """
+        redact_page = self._redact_and_encode if encode else self._redact_page
+        page_markers = self._page_markers(markers)
+
+        # PIL releases the GIL while painting and encoding, so the pages of a window are redacted in parallel
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for pages, dpi, window in self.iter_windows(plan):
+                window_markers = [page_markers.get(page, []) for page in pages]
+                yield from executor.map(redact_page, window, window_markers, repeat(dpi))
 
     def redact(self, output_location: str, markers: list):
-        masked_imgs = self._redact_images(markers)
         if self.is_pdf:
-            self.convert_masked_to_pdf(output_location, masked_imgs)
+            self.redact_pdf(output_location, markers)
         else:
+            masked_imgs = list(self._redact_images(markers))
             assert len(masked_imgs) == 1
             img = masked_imgs[0]
             img.save(output_location)
 
         logger.debug(f"Successfully redacted file {output_location}")
 
-    @staticmethod
-    def convert_masked_to_pdf(output_location: str, masked_imgs: list):
-        """ Converts the list of masked images into a pdf.  Intermediary step of saving
-            the masked images first, then giving the filepath to img2pdf.convert()
-            The PDF and masked images are saved into the directory either 
-            (1) specified in convert_pdf_to_images(), or
-            (2) the directory the non-masked image was uploaded from.
-            
-            Then deleting the intermediary masked image files
-            
+    def redact_pdf(self, output_location: str, markers: list):
+        """
+        Rasterizes and redacts only the pages of the PDF that have markers, each at the resolution picked by plan_dpi().
+        Every other page is copied into the output as it is, keeping its vector content.
         """
-        for i, img in enumerate(masked_imgs):
-            img.save(img.filename)
-        with open(output_location,"wb") as f:
-            f.write(img2pdf.convert([img.filename for img in masked_imgs]))
-        # removes the masked image
-        for img in masked_imgs:
-            os.remove(img.filename)
+        page_markers = self._page_markers(markers)
+
+        with open(self.filepath, "rb") as source, ExitStack() as outputs:
+            reader = PdfFileReader(source, strict=False)
+            plan = {
+                page: plan_dpi(reader.getPage(page), page_markers[page])
+                for page in page_markers if 0 <= page < self.page_count
+            }
+
+            raster_pages = {}
+            if plan:
+                masked_pages = self._redact_images(markers, encode=True, plan=plan)
+                raster_pages = dict(zip(sorted(plan), self.convert_masked_to_pdf(masked_pages, outputs)))
+
+            writer = PdfFileWriter()
+            for page in range(self.page_count):
+                writer.addPage(raster_pages[page] if page in raster_pages else reader.getPage(page))
+
+            # The output may replace the source, which is still being read from
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_location)), suffix=".pdf")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    writer.write(f)
+                os.replace(temp_path, output_location)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
 
         return output_location
 
+    def convert_masked_to_pdf(self, masked_pages, outputs: ExitStack) -> list:
+        """
+        Converts the encoded masked pages into PDF pages, a window of pages at a time. img2pdf writes each window through
+        its outputstream into a file of its own, kept in memory until the request has RASTER_SPOOL_SIZE bytes of them and
+        spilled to disk after that, so encoded pages do not pile up while the rest are redacted.
+
+        PyPDF2 still loads every page it copies when the output is written, so the raster pages of a document are held
+        once at that point.
+        :param masked_pages: Encoded pages, may be a generator that redacts pages lazily
+        :param outputs: Owns the files, which must stay open until the pages are written out
+        :return: List of the PDF pages, in order
+        """
+        masked_pages = iter(masked_pages)
+        pages: list = []
+        spooled: int = 0
+
+        while True:
+            window = list(islice(masked_pages, self.window))
+            if not window:
+                return pages
+
+            if spooled < RASTER_SPOOL_SIZE:
+                output = outputs.enter_context(tempfile.SpooledTemporaryFile(max_size=RASTER_SPOOL_SIZE - spooled))
+            else:
+                output = outputs.enter_context(tempfile.TemporaryFile())
+
+            img2pdf.convert(*window, outputstream=output)
+            spooled += output.tell()
+            del window
+
+            output.seek(0)
+            raster = PdfFileReader(output, strict=False)
+            pages.extend(raster.getPage(i) for i in range(raster.getNumPages()))
+
     @staticmethod
-    def _convert_coordinates(marker, height):
+    def _convert_coordinates(marker, height, scale=1):
         left, bottom, right, top = marker.x1, marker.y1, marker.x2, marker.y2
+        if scale != 1:
+            # Round outwards, so a scaled box never covers less than the marker
+            left, bottom = math.floor(left * scale), math.floor(bottom * scale)
+            right, top = math.ceil(right * scale), math.ceil(top * scale)
 
         return (left, height - top, right, height - bottom) 
 
@@ -90,45 +280,15 @@ def anonymize_file(filepath: str, markers: list, perms: list,
                    anon_method: AnonymizationType = AnonymizationType.REDACT) -> list:
     _, ext = os.path.splitext(filepath)
     if ext in SupportedFiles.CHARACTER_BASED:
-        file = open(filepath, mode="r+").read()
-        
-        # Sort marker list by start location
-        sorted_markers: list = sorted(markers, key=lambda x: (x.start_location, -x.end_location))
-        
-        current_file_pos: int = 0
-        current_offset: int = 0
-        
-        new_markers: list = []
-        
-        for marker in sorted_markers:
-            start: int = marker.start_location
-            
-            if start < current_file_pos:
-                continue
-            
-            start += current_offset
-            end: int = marker.end_location + current_offset
-            type: str = marker.pii_type
-            length: int = end - start
-            
-            if type not in perms:
-                previous_text = file[:start]
-                next_text = file[end:]
-                file = REDACTION_CHAR_STR.join([previous_text, next_text])
-                current_offset += len(REDACTION_CHAR_STR) - length
-                current_file_pos = end
-            else:
-                marker.start = start
-                marker.end = end
-                new_markers.append(marker)
-        
-        open(filepath, "w").write(file)
+        # Large files are streamed so that memory use does not grow with the file size
+        locations: list = redaction.redact_file(filepath, redaction.marker_spans(markers), perms, anon_method)
+        new_markers: list = redaction.apply_locations(markers, locations)
     elif ext in SupportedFiles.IMAGE_BASED:
         new_markers = []
         redacted_markers = []
         for marker in markers:
             if marker.pii_type in perms:
-                new_markers.append(markers)
+                new_markers.append(marker)
             else:
                 redacted_markers.append(marker)
         img_redactor = ImageRedactor(filepath)
@@ -136,3 +296,20 @@ def anonymize_file(filepath: str, markers: list, perms: list,
         img_redactor.redact(filepath, redacted_markers)
     
     return new_markers
+
+
+def anonymize_stream(reader, writer, markers: list, perms: list,
+                     anon_method: AnonymizationType = AnonymizationType.REDACT) -> list:
+    """
+    Anonymizes a character-based file as it is read, writing the output as it is produced. Nothing is held in memory
+    beyond a chunk of the file and nothing is written to disk.
+    :param reader: Binary stream of the raw file, e.g. the body of an S3 object
+    :param writer: Text stream the anonymized file is written to
+    :param markers: Character markers of the file
+    :param perms: PII types the requester is permitted to see
+    :param anon_method: Anonymization method
+    :return: Permitted markers, moved to their locations in the output
+    """
+    locations: list = redaction.redact_stream(redaction.DecodingReader(reader), writer,
+                                              redaction.marker_spans(markers), perms, anon_method)
+    return redaction.apply_locations(markers, locations)
@@ -0,0 +1,281 @@
+"""
+Index of the anonymized copies of files kept in S3.
+
+A copy is looked up by file, the digest of the file's markers, the normalized set of permitted PII types and the
+anonymization method. Lookups go through an in-process LRU in front of the anonymized_copy table, so serving a cached
+copy needs no S3 call. As the markers digest is part of the key, a copy is never served for markers it was not made
+from, and the rows of a file are removed when its markers change. A copy read from the table may be validated, e.g.
+against the current version of its source object, before it is cached.
+
+Copies are built single-flight: the requests missing the index for the same copy at once queue on a build lock, one of
+them builds the copy and the others find it indexed once they get the lock.
+"""
+import datetime
+import hashlib
+import os
+import threading
+import time
+import typing
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from loguru import logger
+from sqlalchemy import inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+from core.cache import LRUCache
+from core.constants import AnonymizationType
+from db import db
+from models.datasets.anonymized_copy import AnonymizedCopyModel
+
+# Entries of other processes are not dropped on invalidation, the TTL bounds how long they can outlive it
+index_cache: LRUCache = LRUCache(
+    int(os.getenv("ANONYMIZED_COPY_CACHE_SIZE") or 4096), ttl=float(os.getenv("ANONYMIZED_COPY_CACHE_TTL") or 300)
+)
+
+# Seconds a request waits for a copy being built by another request before it is answered as pending
+BUILD_WAIT: float = float(os.getenv("ANONYMIZATION_BUILD_WAIT") or 30)
+BUILD_POLL_INTERVAL: float = 0.1
+
+
+class CopyPending(Exception):
+    """
+    Raised when an anonymized copy is still being built by another request after the build wait.
+    """
+
+
+MARKER_FIELDS: tuple = ("pii_type", "start_location", "end_location", "page_number", "x1", "y1", "x2", "y2")
+
+
+def normalize_permissions(permissions: list) -> str:
+    """
+    :param permissions: Permitted PII types, in any order and possibly repeated
+    :return: Canonical string for the set of permitted PII types
+    """
+    return ",".join(sorted(set(permissions)))
+
+
+def markers_digest(markers: list) -> str:
+    """
+    :param markers: Character or image markers of a file
+    :return: Digest that changes whenever a marker is added, removed or moved
+    """
+    rows: list = sorted(
+        (marker.pii_id,) + tuple(getattr(marker, field, None) for field in MARKER_FIELDS) for marker in markers
+    )
+    return hashlib.sha1(repr(rows).encode()).hexdigest()
+
+
+def marker_locations(markers: list) -> list:
+    """
+    :param markers: Markers left in an anonymized copy, at their locations in the copy
+    :return: List of [pii_id, start, end] (start and end are None for image markers)
+    """
+    return [[marker.pii_id, getattr(marker, "start_location", None), getattr(marker, "end_location", None)]
+            for marker in markers]
+
+
+def detach_markers(markers: list) -> list:
+    """
+    Copies markers out of the database session. Anonymization moves the markers it is given to their locations in the
+    copy, and those moves must never be flushed back to the marker tables.
+    :param markers: Marker rows, or any objects with the marker attributes
+    :return: Plain copies of the markers
+    """
+    copies: list = []
+
+    for marker in markers:
+        state = inspect(marker, raiseerr=False)
+        if state is not None:
+            fields: dict = {attribute.key: getattr(marker, attribute.key) for attribute in state.mapper.column_attrs}
+        else:
+            fields: dict = dict(vars(marker))
+        copies.append(SimpleNamespace(**fields))
+
+    return copies
+
+
+def apply_marker_locations(markers: list, locations: list) -> list:
+    """
+    Moves markers to the locations recorded for an anonymized copy.
+    :param markers: Markers of the file the copy was made from
+    :param locations: Recorded marker locations
+    :return: Markers left in the copy, in the recorded order
+    """
+    markers_by_id: dict = {marker.pii_id: marker for marker in markers}
+    permitted: list = []
+
+    for pii_id, start, end in locations:
+        marker = markers_by_id.get(pii_id)
+        if marker is None:
+            continue
+        if start is not None:
+            marker.start_location = start
+            marker.end_location = end
+        permitted.append(marker)
+
+    return permitted
+
+
+def _cache_key(file_id: int, digest: str, permissions: str, anon_method: AnonymizationType) -> tuple:
+    return file_id, digest, permissions, anon_method.name
+
+
+def lookup(file_id: int, digest: str, permissions: str, anon_method: AnonymizationType,
+           validate: typing.Optional[typing.Callable] = None) -> typing.Optional[dict]:
+    """
+    Finds an anonymized copy, first in the in-process cache and then in the index table.
+    :param file_id: File the copy was made from
+    :param digest: Digest of the file's markers
+    :param permissions: Normalized permissions
+    :param anon_method: Anonymization method
+    :param validate: Called with a copy read from the index table before it is cached, a copy it rejects is missing
+    :return: Dict with the location, marker_locations and source_version of the copy, None if there is no copy
+    """
+    key: tuple = _cache_key(file_id, digest, permissions, anon_method)
+    entry: typing.Optional[dict] = index_cache.get(key)
+
+    if entry is None:
+        row: typing.Optional[AnonymizedCopyModel] = AnonymizedCopyModel.query.filter_by(
+            file_id=file_id, markers_digest=digest, permissions=permissions, anon_method=anon_method.name
+        ).first()
+
+        if row is not None:
+            entry = {
+                "location": row.location, "marker_locations": row.marker_locations,
+                "source_version": row.source_version,
+            }
+            if validate is not None and not validate(entry):
+                return None
+            index_cache.put(key, entry)
+
+    return entry
+
+
+def record(file_id: int, digest: str, permissions: str, anon_method: AnonymizationType, source_version: str,
+           location: str, locations: list) -> dict:
+    """
+    Adds an anonymized copy to the index.
+    :param file_id: File the copy was made from
+    :param digest: Digest of the file's markers
+    :param permissions: Normalized permissions
+    :param anon_method: Anonymization method
+    :param source_version: ETag or version ID of the source object the copy was made from
+    :param location: Key of the copy in the anonymized copy bucket
+    :param locations: Marker locations in the copy, see marker_locations()
+    :return: Dict with the location, marker_locations and source_version of the copy
+    """
+    entry: dict = {"location": location, "marker_locations": locations, "source_version": source_version}
+
+    try:
+        # Written on a connection of its own, committing the request session would flush whatever the request changed
+        with db.session.get_bind().begin() as connection:
+            connection.execute(AnonymizedCopyModel.__table__.insert().values(
+                file_id=file_id, source_version=source_version, markers_digest=digest, permissions=permissions,
+                anon_method=anon_method.name, location=location, marker_locations=locations,
+                created_ts=datetime.datetime.utcnow(),
+            ))
+    except IntegrityError:
+        # Another request indexed the same copy first
+        pass
+
+    index_cache.put(_cache_key(file_id, digest, permissions, anon_method), entry)
+    return entry
+
+
+def invalidate(file_ids: list) -> list:
+    """
+    Removes the anonymized copies of files from the index, e.g. after their markers or source objects change. The rows
+    are deleted on a connection of their own, whatever the request session holds is left for the caller to commit.
+    :param file_ids: Files whose copies are stale
+    :return: Keys of the removed copies in the anonymized copy bucket, for the caller to purge
+    """
+    file_ids = set(file_ids)
+    if not file_ids:
+        return []
+
+    logger.info(f"Invalidating anonymized copies of files {sorted(file_ids)}")
+    table = AnonymizedCopyModel.__table__
+    with db.session.get_bind().begin() as connection:
+        keys: list = [location for location, in connection.execute(
+            select([table.c.location]).where(table.c.file_id.in_(file_ids))
+        )]
+        connection.execute(table.delete().where(table.c.file_id.in_(file_ids)))
+    index_cache.invalidate_matching(lambda key: key[0] in file_ids)
+
+    return keys
+
+
+# Build locks of this process, used where the database has no advisory locks. key => [lock, number of holders/waiters]
+_local_locks: dict = {}
+_local_locks_guard: threading.Lock = threading.Lock()
+
+
+def _advisory_lock_id(key: str) -> int:
+    # Advisory locks are identified by a signed 64-bit integer
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big", signed=True)
+
+
+@contextmanager
+def _advisory_lock(key: str, timeout: float):
+    # Session-level lock on a connection of its own, so the commits made while building do not release it
+    lock_id: int = _advisory_lock_id(key)
+    deadline: float = time.monotonic() + timeout
+
+    while True:
+        connection = db.engine.connect()
+        try:
+            acquired: bool = connection.execute(text("SELECT pg_try_advisory_lock(:id)"), id=lock_id).scalar()
+        except BaseException:
+            connection.close()
+            raise
+        if acquired:
+            break
+
+        # Waiters hand their connection back to the pool between attempts, so that a burst of them cannot take the
+        # connections the builder needs to look up and record the copy
+        connection.close()
+        if time.monotonic() >= deadline:
+            raise CopyPending(key)
+        time.sleep(BUILD_POLL_INTERVAL)
+
+    try:
+        yield
+    finally:
+        try:
+            connection.execute(text("SELECT pg_advisory_unlock(:id)"), id=lock_id)
+        finally:
+            connection.close()
+
+
+@contextmanager
+def _local_lock(key: str, timeout: float):
+    with _local_locks_guard:
+        entry: list = _local_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        if not entry[0].acquire(timeout=timeout):
+            raise CopyPending(key)
+        try:
+            yield
+        finally:
+            entry[0].release()
+    finally:
+        with _local_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _local_locks[key]
+
+
+def build_lock(key: str, timeout: float = None):
+    """
+    Lock held while an anonymized copy is built, so that one request builds it while the others wait. A Postgres
+    advisory lock is shared by every worker, other databases fall back to a lock table local to the process.
+    :param key: Key of the copy, e.g. its anonymized filepath
+    :param timeout: Seconds to wait for the lock, defaults to ANONYMIZATION_BUILD_WAIT
+    :return: Context manager raising CopyPending if the copy is still being built by another request after timeout
+    """
+    timeout = BUILD_WAIT if timeout is None else timeout
+    if db.engine.dialect.name == "postgresql":
+        return _advisory_lock(key, timeout)
+    return _local_lock(key, timeout)
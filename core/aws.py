@@ -1,57 +1,342 @@
+import functools
 import hashlib
 import os
+import tempfile
+import threading
+import typing
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from copy import deepcopy
 from urllib.parse import urlparse
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore import client
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from loguru import logger
 
-from core.anon import anonymize_file
-from core.constants import AnonymizationType
+from core import anonymized_copies
+from core.cache import LRUCache
+from core.anon import anonymize_file, anonymize_stream
+from core.constants import AnonymizationType, SupportedFiles
 
+MB: int = 1024 * 1024
+MIN_PART_SIZE: int = 5 * MB  # Smallest part S3 accepts in a multipart upload, except for the last one
+DELETE_BATCH_SIZE: int = 1000  # Most keys S3 accepts in a single delete_objects request
 
-def generate_anonymized_filepath(filepath: str, anon_method: AnonymizationType, permissions: list) -> str:
+# Configurable S3 paths for raw files and ephemeral copies
+RAW_FILE_BUCKET: str = "temp-test-datasets"
+ANONYMIZED_COPY_BUCKET: str = "spotlight-anonymized-copies"
+
+# Connection pool of the shared client, sized for the threads of a worker plus concurrent transfer threads
+S3_MAX_POOL_CONNECTIONS: int = int(os.getenv("S3_MAX_POOL_CONNECTIONS") or 50)
+S3_CONNECT_TIMEOUT: float = float(os.getenv("S3_CONNECT_TIMEOUT") or 5)
+S3_READ_TIMEOUT: float = float(os.getenv("S3_READ_TIMEOUT") or 60)
+S3_MAX_ATTEMPTS: int = int(os.getenv("S3_MAX_ATTEMPTS") or 3)
+
+# Shared settings for managed uploads and downloads
+transfer_config: TransferConfig = TransferConfig(
+    multipart_threshold=int(os.getenv("S3_MULTIPART_THRESHOLD") or 16 * MB),
+    multipart_chunksize=int(os.getenv("S3_MULTIPART_CHUNKSIZE") or 16 * MB),
+    max_concurrency=int(os.getenv("S3_TRANSFER_CONCURRENCY") or 8),
+    use_threads=True,
+)
+
+_s3_client: client = None
+_s3_client_pid: int = None
+_s3_client_lock: threading.Lock = threading.Lock()
+
+# Presigned URLs are reused until PRESIGNED_URL_REUSE_FRACTION of their lifetime is spent, so every URL handed out
+# stays valid for at least the rest of the requested lifetime. (bucket, key, operation, expiration) => URL
+PRESIGNED_URL_REUSE_FRACTION: float = float(os.getenv("PRESIGNED_URL_REUSE_FRACTION") or 0.5)
+url_cache: LRUCache = LRUCache(int(os.getenv("PRESIGNED_URL_CACHE_SIZE") or 4096))
+
+_purge_executor: ThreadPoolExecutor = None
+_purge_executor_pid: int = None
+_purge_executor_lock: threading.Lock = threading.Lock()
+
+
+def get_s3_client() -> client:
+    """
+    Returns the process-wide S3 client, creating it on first use. boto3 clients are thread-safe, so credentials,
+    endpoints and the connection pool are resolved once and shared by every request of the process. A forked worker
+    creates its own client rather than sharing the sockets of its parent.
+    :return: S3 client
+    """
+    global _s3_client, _s3_client_pid
+
+    if _s3_client is None or _s3_client_pid != os.getpid():
+        with _s3_client_lock:
+            if _s3_client is None or _s3_client_pid != os.getpid():
+                config: Config = Config(
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                    connect_timeout=S3_CONNECT_TIMEOUT,
+                    read_timeout=S3_READ_TIMEOUT,
+                    retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "standard"},
+                )
+                # A session of its own keeps client creation off boto3's global default session, which is not
+                # thread-safe
+                _s3_client = boto3.session.Session().client(
+                    "s3",
+                    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+                    config=config,
+                )
+                _s3_client_pid = os.getpid()
+
+    return _s3_client
+
+
+def reset_s3_client() -> None:
+    """
+    Drops the shared S3 client, so that the next call to get_s3_client() creates a new one (e.g. after credentials
+    change). The URLs it presigned are dropped with it.
+    :return: None
     """
-    Utility method to generate a hashed filepath for anonymized files to reduce duplication.
+    global _s3_client
+
+    with _s3_client_lock:
+        _s3_client = None
+    url_cache.clear()
+
+
+class MultipartUploadWriter:
+    """
+    Text stream that uploads what is written to it to S3. Output is buffered a part at a time and sent as the parts of
+    a multipart upload, so memory use is bounded by the part size whatever the size of the object. An object smaller
+    than a part is sent with a single put_object call instead.
+    """
+
+    def __init__(self, s3_client: client, bucket: str, key: str, part_size: int = None, encoding: str = "utf-8"):
+        """
+        :param s3_client: S3 client
+        :param bucket: Bucket to upload to
+        :param key: Key of the object
+        :param part_size: Size of the parts in bytes, defaults to the multipart chunk size of transfer_config
+        :param encoding: Text encoding of the object
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size or transfer_config.multipart_chunksize, MIN_PART_SIZE)
+        self.encoding = encoding
+        self.upload_id: typing.Optional[str] = None
+        self.parts: list = []
+        self._buffer: bytearray = bytearray()
+
+    def write(self, text: str) -> int:
+        self._buffer += text.encode(self.encoding)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(text)
+
+    def _upload_part(self, data: bytes) -> None:
+        if self.upload_id is None:
+            self.upload_id = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+
+        part_number: int = len(self.parts) + 1
+        response: dict = self.s3_client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                    PartNumber=part_number, Body=data)
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    def close(self) -> None:
+        """
+        Uploads what is left in the buffer and completes the upload.
+        :return: None
+        """
+        if self.upload_id is None:
+            self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+        else:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                     MultipartUpload={"Parts": self.parts})
+        self._buffer = bytearray()
+
+    def abort(self) -> None:
+        """
+        Discards the parts uploaded so far, so that no incomplete upload is left billed in the bucket.
+        :return: None
+        """
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        self._buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def cached_presigned_url(bucket: str, key: str, operation, expiration: int, sign: typing.Callable):
+    """
+    Returns a presigned URL from the cache while it has enough lifetime left, signing a new one otherwise.
+    :param bucket: Bucket of the object
+    :param key: Key of the object
+    :param operation: Hashable description of the operation the URL is signed for, e.g. "get_object"
+    :param expiration: Lifetime of a newly signed URL in seconds
+    :param sign: Function called without arguments to sign a new URL
+    :return: Presigned URL
+    """
+    return url_cache.get_or_create((bucket, key, operation, expiration), sign,
+                                   ttl=expiration * PRESIGNED_URL_REUSE_FRACTION)
+
+
+def presigned_url_stats() -> dict:
+    """
+    :return: Dict with the size, hits, misses, evictions and hit rate of the presigned URL cache
+    """
+    return url_cache.stats()
+
+
+def generate_anonymized_filepath(filepath: str, anon_method: AnonymizationType, permissions: list,
+                                 source_version: str = "", markers_digest: str = "") -> str:
+    """
+    Utility method to generate a content-addressed filepath for anonymized files to reduce duplication.
     :param filepath: Original filepath of the raw file.
     :param anon_method: Anonymization method used.
-    :param permissions: List of permissions requested in the file.
+    :param permissions: List of permissions requested in the file, in any order.
+    :param source_version: ETag or version ID of the raw file.
+    :param markers_digest: Digest of the markers the file is anonymized with.
     :return: Hashed filepath
     """
-    return hashlib.sha1((filepath + str(permissions) + anon_method.name).encode()).hexdigest()
+    key: str = "|".join([
+        filepath, anonymized_copies.normalize_permissions(permissions), anon_method.name, source_version,
+        markers_digest,
+    ])
+    return hashlib.sha1(key.encode()).hexdigest()
 
 
-def generate_presigned_download_link(filepath: str, markers: list, permissions: list, expiration: int = 3600,
-                                     anon_method: AnonymizationType = AnonymizationType.REDACT):
-    s3_client: client = boto3.client("s3", aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-                                     aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"))
-    
-    # Configurable S3 paths for raw files and ephemeral copies
-    raw_file_bucket: str = "temp-test-datasets"
-    anonymized_copy_bucket: str = "spotlight-anonymized-copies"
-    anonymized_filepath = generate_anonymized_filepath(filepath, anon_method, permissions)
-    
-    try:  # Check to see if this anonymized file has already been created
-        s3_client.head_object(Bucket=anonymized_copy_bucket, Key=anonymized_filepath)
+def source_version(head: dict) -> str:
+    """
+    :param head: Response of head_object or get_object
+    :return: Version ID of the object if the bucket is versioned, its ETag otherwise
+    """
+    return head.get("VersionId") or head["ETag"].strip('"')
+
+
+def build_anonymized_copy(file_id: int, filepath: str, markers: list, permissions: list, digest: str,
+                          anon_method: AnonymizationType) -> dict:
+    """
+    Anonymizes a raw file into the anonymized copy bucket and indexes the copy.
+    :param file_id: File identifier
+    :param filepath: Key of the raw file
+    :param markers: Markers of the file, moved to their locations in the copy
+    :param permissions: PII types the requester is permitted to see
+    :param digest: Digest of the markers
+    :param anon_method: Anonymization method
+    :return: Dict with the location and marker_locations of the copy
+    """
+    s3_client: client = get_s3_client()
+
+    if os.path.splitext(filepath)[1] in SupportedFiles.CHARACTER_BASED:
+        # Text is redacted as it is read from S3 and uploaded as it is redacted, without touching the disk
+        raw_file: dict = s3_client.get_object(Bucket=RAW_FILE_BUCKET, Key=filepath)
+        version: str = source_version(raw_file)
+        anonymized_filepath: str = generate_anonymized_filepath(filepath, anon_method, permissions, version, digest)
 
-        response = s3_client.generate_presigned_url("get_object", Params={"Bucket": anonymized_copy_bucket, "Key": anonymized_filepath}, ExpiresIn=expiration)
-    except ClientError as e:  # Generate the anonymized file
-        if e.response["ResponseMetadata"]["HTTPStatusCode"] == 404:
-            output_location: str = filepath.replace("/", "_")
+        try:
+            with MultipartUploadWriter(s3_client, ANONYMIZED_COPY_BUCKET, anonymized_filepath) as writer:
+                markers = anonymize_stream(raw_file["Body"], writer, markers, permissions, anon_method=anon_method)
+        finally:
+            raw_file["Body"].close()
+    else:  # Image-based files are rasterized from disk
+        version: str = source_version(s3_client.head_object(Bucket=RAW_FILE_BUCKET, Key=filepath))
+        anonymized_filepath: str = generate_anonymized_filepath(filepath, anon_method, permissions, version, digest)
 
-            s3_client.download_file(raw_file_bucket, filepath, output_location)
+        # Each build works in a directory of its own, builds of the same file for other permissions run concurrently
+        with tempfile.TemporaryDirectory(prefix="anonymized_copy_") as build_dir:
+            output_location: str = os.path.join(build_dir, os.path.basename(filepath))
+
+            s3_client.download_file(RAW_FILE_BUCKET, filepath, output_location, Config=transfer_config)
 
             # Anonymizes the file and updates the marker positions
             markers: list = anonymize_file(output_location, markers, permissions, anon_method=anon_method)
 
-            s3_client.upload_file(output_location, anonymized_copy_bucket, anonymized_filepath)
-            os.remove(output_location)
+            s3_client.upload_file(output_location, ANONYMIZED_COPY_BUCKET, anonymized_filepath,
+                                  Config=transfer_config)
+
+    return anonymized_copies.record(file_id, digest, anonymized_copies.normalize_permissions(permissions), anon_method,
+                                    version, anonymized_filepath, anonymized_copies.marker_locations(markers))
+
+
+def check_source_version(file_id: int, filepath: str, copy: dict) -> bool:
+    """
+    Checks that an indexed copy was made from the current version of its raw file. If the raw file was replaced, the
+    copies of the file are invalidated and purged.
+    :param file_id: File identifier
+    :param filepath: Key of the raw file
+    :param copy: Indexed copy, see anonymized_copies.lookup()
+    :return: True if the copy is current, False if it is stale or the raw file could not be checked
+    """
+    try:
+        version: str = source_version(get_s3_client().head_object(Bucket=RAW_FILE_BUCKET, Key=filepath))
+    except ClientError as e:
+        logger.warning(f"Could not check the raw file of file {file_id}: {e}")
+        if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey"):
+            return False  # Treated as a miss, the copies are kept until the raw file can be checked again
+        version = None
+
+    if version == copy["source_version"]:
+        return True
+
+    logger.info(f"Raw file of file {file_id} changed since its anonymized copies were made")
+    invalidate_anonymized_copies([file_id])
+    return False
+
+
+def generate_presigned_download_link(file_id: int, filepath: str, markers: list, permissions: list,
+                                     expiration: int = 3600,
+                                     anon_method: AnonymizationType = AnonymizationType.REDACT):
+    """
+    Generates a pre-signed link to an anonymized copy of a file, creating the copy if it is not indexed yet. Serving
+    a copy cached in the process makes no call to S3, a copy read from the index table is checked against the version
+    of the raw file first. Concurrent requests for a copy that is not indexed yet build it once, the
+    others wait up to ANONYMIZATION_BUILD_WAIT seconds for it.
+    :param file_id: File identifier
+    :param filepath: Key of the raw file
+    :param markers: Markers of the file, left untouched
+    :param permissions: PII types the requester is permitted to see
+    :param expiration: Time for link to remain valid
+    :param anon_method: Anonymization method
+    :return: Tuple of the pre-signed link and copies of the markers left in the anonymized copy, at their locations in
+        the copy
+    :raises CopyPending: If the copy is still being built by another request
+    """
+    # Anonymization moves the markers, the rows of the request session are left where they are
+    markers = anonymized_copies.detach_markers(markers)
+
+    normalized_permissions: str = anonymized_copies.normalize_permissions(permissions)
+    digest: str = anonymized_copies.markers_digest(markers)
+    validate: typing.Callable = functools.partial(check_source_version, file_id, filepath)
+    copy: typing.Optional[dict] = anonymized_copies.lookup(file_id, digest, normalized_permissions, anon_method,
+                                                           validate)
 
-        response = s3_client.generate_presigned_url(
+    if copy is None:
+        # Concurrent misses on the same copy queue here, so that it is built once
+        flight_key: str = generate_anonymized_filepath(filepath, anon_method, permissions, markers_digest=digest)
+        with anonymized_copies.build_lock(flight_key):
+            # Another request may have built the copy while this one waited
+            copy = anonymized_copies.lookup(file_id, digest, normalized_permissions, anon_method, validate)
+            if copy is None:
+                copy = build_anonymized_copy(file_id, filepath, markers, permissions, digest, anon_method)
+
+    markers = anonymized_copies.apply_marker_locations(markers, copy["marker_locations"])
+
+    response = cached_presigned_url(
+        ANONYMIZED_COPY_BUCKET, copy["location"], "get_object", expiration,
+        lambda: get_s3_client().generate_presigned_url(
             "get_object",
-            Params={"Bucket": anonymized_copy_bucket, "Key": anonymized_filepath},
+            Params={"Bucket": ANONYMIZED_COPY_BUCKET, "Key": copy["location"]},
             ExpiresIn=expiration,
-        )
+        ),
+    )
 
     return response, markers
 
@@ -71,43 +356,124 @@ def generate_presigned_link(
         fields: Dictionary of form fields and values to submit with the POST
     :return: None if error
     """
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    )
+    s3_client = get_s3_client()
     try:
-        response = s3_client.generate_presigned_post(
-            bucket_name,
-            object_name,
-            Fields=fields,
-            Conditions=conditions,
-            ExpiresIn=expiration,
+        response = cached_presigned_url(
+            bucket_name, object_name, ("post_object", repr(fields), repr(conditions)), expiration,
+            lambda: s3_client.generate_presigned_post(
+                bucket_name,
+                object_name,
+                Fields=fields,
+                Conditions=conditions,
+                ExpiresIn=expiration,
+            ),
         )
     except ClientError as e:
         return None
     
-    return response
+    # Callers add their own keys to the response and its fields, the cached one is left as it is
+    return deepcopy(response)
+
+
+def split_location(location: str) -> tuple:
+    """
+    :param location: Location of an object, e.g. s3://bucket.s3.amazonaws.com/key
+    :return: Tuple of the bucket and the key of the object
+    """
+    parsed_url = urlparse(location)
+    return parsed_url.netloc.split(".")[0], parsed_url.path[1:]
 
 
-def dataset_cleanup(filepath):
+def delete_objects(bucket: str, keys: list) -> list:
     """
-    Removes all traces of dataset from S3 location.
-    :param: filepath: Filepath of dataset to delete from S3
+    Deletes objects from a bucket, DELETE_BATCH_SIZE keys per request.
+    :param bucket: Bucket to delete from
+    :param keys: Keys of the objects to delete
+    :return: List of the errors reported by S3 for the keys that could not be deleted
+    """
+    s3_client: client = get_s3_client()
+    errors: list = []
+
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch: list = [{"Key": key} for key in keys[i:i + DELETE_BATCH_SIZE]]
+        response: dict = s3_client.delete_objects(Bucket=bucket, Delete={"Objects": batch, "Quiet": True})
+        errors.extend(response.get("Errors", []))
+
+    return errors
+
+
+def purge_objects(objects: dict) -> None:
+    """
+    Deletes objects from S3, logging the keys that could not be deleted rather than raising.
+    :param objects: Dict of bucket => list of keys
     :return: None
     """
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    )
-    
-    parsed_url = urlparse(filepath)
-    
-    bucket = parsed_url.netloc.split(".")[0]
-    key = parsed_url.path[1:]
-    
-    try:
-        s3_client.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": key}]})
-    except ClientError:
-        return None
+    for bucket, keys in objects.items():
+        if not keys:
+            continue
+
+        try:
+            errors: list = delete_objects(bucket, keys)
+        except Exception as e:  # Connection errors are not ClientErrors, and the future of the purge is never read
+            logger.error(f"Could not purge {len(keys)} objects from {bucket}: {e}")
+            continue
+
+        for error in errors:
+            logger.error(f"Could not purge {bucket}/{error.get('Key')}: {error.get('Message')}")
+        logger.info(f"Purged {len(keys) - len(errors)} objects from {bucket}")
+
+
+def get_purge_executor() -> ThreadPoolExecutor:
+    """
+    Returns the background worker of the process that S3 purges run on, creating it on first use. A single thread
+    keeps purges from competing with requests for the connections of the shared client.
+    :return: Executor
+    """
+    global _purge_executor, _purge_executor_pid
+
+    if _purge_executor is None or _purge_executor_pid != os.getpid():
+        with _purge_executor_lock:
+            if _purge_executor is None or _purge_executor_pid != os.getpid():
+                _purge_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="s3-purge")
+                _purge_executor_pid = os.getpid()
+
+    return _purge_executor
+
+
+def purge_in_background(objects: dict) -> Future:
+    """
+    Deletes objects from S3 on the background worker, dropping their cached presigned URLs first.
+    :param objects: Dict of bucket => list of keys
+    :return: Future of the purge
+    """
+    purged: set = {(bucket, key) for bucket, keys in objects.items() for key in keys}
+    url_cache.invalidate_matching(lambda url_key: url_key[:2] in purged)
+
+    return get_purge_executor().submit(purge_objects, dict(objects))
+
+
+def dataset_cleanup(file_locations: list, anonymized_copy_keys: list = ()) -> Future:
+    """
+    Removes all traces of datasets from S3 in the background: their raw files and the anonymized copies made from them.
+    :param file_locations: Locations of the raw files, e.g. s3://bucket.s3.amazonaws.com/key
+    :param anonymized_copy_keys: Keys of the anonymized copies of the files
+    :return: Future of the purge
+    """
+    objects: dict = defaultdict(list)
+    for location in file_locations:
+        bucket, key = split_location(location)
+        objects[bucket].append(key)
+    if anonymized_copy_keys:
+        objects[ANONYMIZED_COPY_BUCKET].extend(anonymized_copy_keys)
+
+    return purge_in_background(objects)
+
+
+def invalidate_anonymized_copies(file_ids: list) -> Future:
+    """
+    Removes the anonymized copies of files from the index and purges them from S3 in the background, e.g. after the
+    markers or the raw objects of the files change.
+    :param file_ids: Files whose copies are stale
+    :return: Future of the purge
+    """
+    return purge_in_background({ANONYMIZED_COPY_BUCKET: anonymized_copies.invalidate(file_ids)})
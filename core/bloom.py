@@ -0,0 +1,43 @@
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+    """
+    Thread-safe Bloom filter over strings. Membership tests may return false positives at about the configured error
+    rate, but never false negatives. Items cannot be removed, the filter is rebuilt instead.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        """
+        :param capacity: Number of items the filter is sized for, the error rate grows beyond it
+        :param error_rate: Expected rate of false positives at capacity
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size: int = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))  # In bits
+        self.hash_count: int = max(1, int(round(self.size / capacity * math.log(2))))
+        self.count: int = 0
+        self._bits: bytearray = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, item: str):
+        # Double hashing: the k positions are derived from two halves of one digest
+        digest: bytes = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first: int = int.from_bytes(digest[:8], "big")
+        second: int = int.from_bytes(digest[8:], "big") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item: str) -> None:
+        positions: list = self._positions(item)
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def __len__(self) -> int:
+        return self.count
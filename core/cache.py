@@ -0,0 +1,124 @@
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe, bounded least-recently-used cache with optional expiry. Hits, misses and evictions are counted so the
+    cache can be sized from its stats.
+    """
+
+    def __init__(self, maxsize: int, ttl: typing.Optional[float] = None, clock: typing.Callable = time.monotonic):
+        """
+        :param maxsize: Maximum number of entries, the least recently used entry is evicted beyond it
+        :param ttl: Default number of seconds an entry stays valid, None to keep entries until they are evicted
+        :param clock: Function returning the current time in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._entries: OrderedDict = OrderedDict()  # key => (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        :param key: Cache key
+        :param default: Value returned on a miss
+        :return: Cached value, or default if the key is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > self.clock()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, ttl: typing.Optional[float] = None) -> None:
+        """
+        :param key: Cache key
+        :param value: Value to cache
+        :param ttl: Number of seconds the entry stays valid, defaults to the ttl of the cache
+        :return: None
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[key] = (None if ttl is None else self.clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_create(self, key, factory: typing.Callable, ttl: typing.Optional[float] = None):
+        """
+        Returns the cached value of a key, creating and caching it on a miss. The factory runs outside the lock, so two
+        threads missing on the same key at once may both create it.
+        :param key: Cache key
+        :param factory: Function called without arguments to create the value
+        :param ttl: Number of seconds a created entry stays valid, defaults to the ttl of the cache
+        :return: Cached or created value
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = factory()
+            self.put(key, value, ttl)
+        return value
+
+    def invalidate(self, key) -> bool:
+        """
+        :param key: Cache key
+        :return: True if the key was cached
+        """
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def invalidate_matching(self, predicate: typing.Callable) -> int:
+        """
+        :param predicate: Function called with each key, returning True for the keys to drop
+        :return: Number of entries dropped
+        """
+        with self._lock:
+            keys: list = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def values(self) -> list:
+        with self._lock:
+            return [value for _, value in self._entries.values()]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[0] is None or entry[0] > self.clock())
+
+    def stats(self) -> dict:
+        """
+        :return: Dict with the size, hits, misses, evictions and hit rate of the cache
+        """
+        lookups: int = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -11,6 +11,11 @@ class AuditConstants:
     DATASET_SHARED = "DATASET_SHARED"
 
 
+class DatasetAccessKinds:
+    OWNED = "owned"
+    SHARED = "shared"
+
+
 class NotificationConstants:
     DATASET_SHARED_TITLE = "A dataset has been shared with you"
     DATASET_SHARED_DETAIL = "You have been granted access to Dataset(s):"
@@ -0,0 +1,197 @@
+"""
+Maintenance of the dataset_access table, the materialized index of the datasets each user can see.
+
+Access is derived from dataset_owner, role_member, role_dataset and role_permissions. Rather than joining those tables
+on every authorization check, the derived rows are stored once per user and dataset and recomputed incrementally: after
+each flush, the users and datasets touched by the flushed owners, role members, role datasets and role permissions are
+collected and only their rows are rebuilt, in the same transaction. Bulk query deletes bypass the flush, the code issuing
+them calls refresh() for the datasets involved.
+"""
+import itertools
+import typing
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, inspect, or_, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+from core.constants import DatasetAccessKinds
+from db import db
+from models.associations import DatasetOwner, RoleDataset, RolePermission
+from models.auth.user import UserModel
+from models.datasets.access import DatasetAccessModel
+from models.datasets.base import DatasetModel
+from models.pii.pii import PIIModel
+from models.roles.role import RoleModel
+from models.roles.role_member import RoleMemberModel
+
+access_table = DatasetAccessModel.__table__
+role_member_table = RoleMemberModel.__table__
+pii_table = PIIModel.__table__
+
+
+def _scope(user_column, dataset_column, user_ids: set, dataset_ids: set):
+    clauses: list = []
+    if user_ids:
+        clauses.append(user_column.in_(user_ids))
+    if dataset_ids:
+        clauses.append(dataset_column.in_(dataset_ids))
+    return or_(*clauses)
+
+
+def _shared(user_ids: typing.Optional[set] = None, dataset_ids: typing.Optional[set] = None):
+    # Roles permitting the same PII type collapse into one row. When scoped by user or dataset, the joins are index
+    # probes on role_member(user_id, role_id) and role_dataset(dataset_id, role_id). rebuild() runs it unscoped, as
+    # full scans of both tables.
+    shared = select([role_member_table.c.user_id, RoleDataset.c.dataset_id, pii_table.c.description]).select_from(
+        role_member_table.join(RoleDataset, RoleDataset.c.role_id == role_member_table.c.role_id)
+        .outerjoin(RolePermission, RolePermission.c.role_id == role_member_table.c.role_id)
+        .outerjoin(pii_table, pii_table.c.pii_id == RolePermission.c.pii_id)
+    ).distinct()
+
+    if user_ids or dataset_ids:
+        shared = shared.where(_scope(role_member_table.c.user_id, RoleDataset.c.dataset_id, user_ids, dataset_ids))
+    return shared
+
+
+def compute(connection, user_ids: typing.Optional[set] = None, dataset_ids: typing.Optional[set] = None) -> list:
+    """
+    Derives access rows from the ownership and role tables.
+    :param connection: Connection to query on
+    :param user_ids: Users to derive the rows of
+    :param dataset_ids: Datasets to derive the rows of, every row is derived if neither users nor datasets are given
+    :return: List of dicts with the user_id, dataset_id, access_kind and permissions of each row
+    """
+    owned = select([DatasetOwner.c.owner_id, DatasetOwner.c.dataset_id])
+    shared = _shared(user_ids, dataset_ids)
+
+    if user_ids or dataset_ids:
+        owned = owned.where(_scope(DatasetOwner.c.owner_id, DatasetOwner.c.dataset_id, user_ids, dataset_ids))
+
+    access: dict = {}  # (user_id, dataset_id) => [access kind, permitted PII descriptions]
+
+    for user_id, dataset_id, description in connection.execute(shared):
+        entry: list = access.setdefault((user_id, dataset_id), [DatasetAccessKinds.SHARED, set()])
+        if description is not None:
+            entry[1].add(description)
+
+    for user_id, dataset_id in connection.execute(owned):
+        if user_id is not None and dataset_id is not None:
+            access.setdefault((user_id, dataset_id), [None, set()])[0] = DatasetAccessKinds.OWNED
+
+    return [
+        {"user_id": user_id, "dataset_id": dataset_id, "access_kind": kind, "permissions": sorted(permissions)}
+        for (user_id, dataset_id), (kind, permissions) in access.items()
+    ]
+
+
+def _insert(dialect_name: str):
+    if dialect_name != "postgresql":
+        # SQLite holds a database-wide write lock for the transaction, so concurrent refreshes cannot interleave
+        return access_table.insert()
+
+    # Two transactions refreshing overlapping scopes can each delete the rows before either inserts. The later insert
+    # then finds the rows committed by the other transaction and overwrites them rather than failing on the constraint.
+    statement = postgresql.insert(access_table)
+    return statement.on_conflict_do_update(constraint="_dataset_access_uc", set_={
+        "access_kind": statement.excluded.access_kind,
+        "permissions": statement.excluded.permissions,
+    })
+
+
+def _refresh(connection, user_ids: set, dataset_ids: set) -> None:
+    if not user_ids and not dataset_ids:
+        return
+
+    connection.execute(access_table.delete().where(
+        _scope(access_table.c.user_id, access_table.c.dataset_id, user_ids, dataset_ids)
+    ))
+
+    rows: list = compute(connection, user_ids, dataset_ids)
+    if rows:
+        connection.execute(_insert(connection.dialect.name), rows)
+
+
+def refresh(user_ids: typing.Iterable = (), dataset_ids: typing.Iterable = ()) -> None:
+    """
+    Recomputes and commits the access rows of users and datasets, e.g. after a bulk delete that skipped the flush.
+    :param user_ids: Users whose rows are stale
+    :param dataset_ids: Datasets whose rows are stale
+    :return: None
+    """
+    user_ids, dataset_ids = set(filter(None, user_ids)), set(filter(None, dataset_ids))
+    if not user_ids and not dataset_ids:
+        return
+
+    _refresh(db.session.connection(), user_ids, dataset_ids)
+    db.session.commit()
+
+
+def rebuild() -> int:
+    """
+    Recomputes the whole table, e.g. to backfill it after its migration.
+    :return: Number of access rows
+    """
+    connection = db.session.connection()
+    connection.execute(access_table.delete())
+
+    rows: list = compute(connection)
+    if rows:
+        connection.execute(_insert(connection.dialect.name), rows)
+
+    db.session.commit()
+    return len(rows)
+
+
+@click.command("rebuild-dataset-access")
+@with_appcontext
+def rebuild_command() -> None:
+    """Backfill the dataset_access table from the ownership and role tables."""
+    click.echo(f"Rebuilt dataset_access with {rebuild()} rows")
+
+
+def _history(obj, attribute: str) -> list:
+    # Values before and after the flush, so that both the old and the new rows are recomputed
+    return [value for value in inspect(obj).attrs[attribute].history.sum() if value is not None]
+
+
+def _changed(obj, attribute: str) -> bool:
+    return inspect(obj).attrs[attribute].history.has_changes()
+
+
+@event.listens_for(Session, "after_flush")
+def _refresh_flushed(session: Session, flush_context) -> None:
+    user_ids: set = set()
+    dataset_ids: set = set()
+    role_ids: set = set()  # Roles whose permissions changed
+
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, RoleMemberModel):
+            user_ids.update(_history(obj, "user_id"))
+        elif isinstance(obj, RoleModel):
+            if obj in session.deleted or _changed(obj, "datasets"):
+                dataset_ids.update(dataset.dataset_id for dataset in _history(obj, "datasets"))
+            if _changed(obj, "permissions"):
+                role_ids.add(obj.role_id)
+        elif isinstance(obj, DatasetModel):
+            if obj in session.new or obj in session.deleted or _changed(obj, "owners") or _changed(obj, "roles"):
+                dataset_ids.add(obj.dataset_id)
+        elif isinstance(obj, UserModel):
+            if _changed(obj, "owned_datasets"):
+                dataset_ids.update(dataset.dataset_id for dataset in _history(obj, "owned_datasets"))
+        elif isinstance(obj, PIIModel):
+            if _changed(obj, "roles"):
+                role_ids.update(role.role_id for role in _history(obj, "roles"))
+
+    if not user_ids and not dataset_ids and not role_ids:
+        return
+
+    connection = session.connection()
+
+    if role_ids:
+        dataset_ids.update(dataset_id for dataset_id, in connection.execute(
+            select([RoleDataset.c.dataset_id]).where(RoleDataset.c.role_id.in_(role_ids))
+        ))
+
+    _refresh(connection, set(filter(None, user_ids)), set(filter(None, dataset_ids)))
@@ -1,7 +1,9 @@
 import os
+import time
 
 from flask import abort, request
 
+from core.cache import LRUCache
 from core.constants import UserConstants
 from core.errors import AuthenticationErrors
 from models.auth.api_key import APIKeyModel
@@ -9,6 +11,12 @@ from models.auth.user import UserModel
 from models.datasets.base import  DatasetModel
 from models.auth.util import hash_token
 
+# Credentials verified successfully, keyed by their digest. Bearer tokens are still checked against the revoked token
+# store on every request. The TTL bounds how long a revocation of an API key made in another worker can go unnoticed,
+# revocations made in this worker invalidate their entries right away. Failures are never cached.
+AUTH_CACHE_TTL: float = float(os.getenv("AUTH_CACHE_TTL") or 10)
+auth_cache: LRUCache = LRUCache(int(os.getenv("AUTH_CACHE_SIZE") or 10000), ttl=AUTH_CACHE_TTL)
+
 
 def is_dataset_owner(func):
     def wrapper(*args, **kwargs):
@@ -53,9 +61,9 @@ def authenticate_token(func):
 
         elif bearer_token:
             bearer_token = bearer_token.split(" ")[1]
-            is_authenticated, message = UserModel.verify_auth_token(bearer_token)
+            is_authenticated, message = _authenticate_bearer_token(bearer_token)
 
-        if bearer_token == os.getenv("MODEL_KEY"):
+        if bearer_token and bearer_token == os.getenv("MODEL_KEY"):
             return func(user_id=UserConstants.MODEL, *args, **kwargs)
 
         elif is_authenticated:
@@ -73,12 +81,65 @@ def _authenticate_api_key(api_key: str) -> tuple:
     :return: Boolean representing authentication status
     """
     hashed_key: str = hash_token(api_key)
-    key: APIKeyModel = APIKeyModel.query.filter_by(api_key=hashed_key).first()
+    result: tuple = auth_cache.get(("api_key", hashed_key))
+
+    if result is None:
+        key: APIKeyModel = APIKeyModel.query.filter_by(api_key=hashed_key).first()
 
-    try:
-        if key.revoked:
+        if key is None:
+            return False, AuthenticationErrors.INCORRECT_API_KEY
+        elif key.revoked:
             return False, AuthenticationErrors.UNAUTHORIZED_API_KEY
-        return True, key.user_id
 
-    except AttributeError:
-        return False, AuthenticationErrors.INCORRECT_API_KEY
+        result = True, key.user_id
+        auth_cache.put(("api_key", hashed_key), result)
+
+    return result
+
+
+def _authenticate_bearer_token(bearer_token: str) -> tuple:
+    """
+    Verifies a bearer token. The signature check is cached for at most the rest of the token's lifetime, whether the
+    token was revoked is checked every time, so a logout in any worker is honoured at its next revocation sync.
+    :param bearer_token: Raw bearer token
+    :return: Tuple of the authentication status and the user ID or an error message
+    """
+    key: tuple = ("bearer", hash_token(bearer_token))
+    user_id = auth_cache.get(key)
+
+    if user_id is None:
+        result: tuple = UserModel.verify_auth_token_signature(bearer_token)
+        if not result[0]:
+            return result
+
+        user_id = result[1]
+        ttl: float = min(AUTH_CACHE_TTL, UserModel.auth_token_expiry(bearer_token) - time.time())
+        if ttl > 0:
+            auth_cache.put(key, user_id, ttl)
+
+    return UserModel.check_auth_token_validity(bearer_token, user_id)
+
+
+def invalidate_api_key(hashed_key: str) -> None:
+    """
+    Drops the cached authentication of an API key, e.g. after it is revoked or regenerated.
+    :param hashed_key: Hashed API key, as stored in the database
+    :return: None
+    """
+    auth_cache.invalidate(("api_key", hashed_key))
+
+
+def invalidate_bearer_token(bearer_token: str) -> None:
+    """
+    Drops the cached authentication of a bearer token, e.g. after logout.
+    :param bearer_token: Raw bearer token
+    :return: None
+    """
+    auth_cache.invalidate(("bearer", hash_token(bearer_token)))
+
+
+def auth_cache_stats() -> dict:
+    """
+    :return: Dict with the size, hits, misses, evictions and hit rate of the authentication cache
+    """
+    return auth_cache.stats()
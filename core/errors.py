@@ -32,6 +32,7 @@ class DatasetErrors:
 class FileErrors:
     FILE_NOT_FOUND = "File was not found."
     DOES_NOT_HAVE_PERMISSION = "User does not have permission to view this file."
+    ANONYMIZATION_PENDING = "An anonymized copy of this file is being generated, retry shortly."
 
 
 class UserErrors:
@@ -70,6 +71,7 @@ class AuthenticationErrors:
     UNAUTHORIZED_API_KEY = "Unauthorized API key."
     INCORRECT_API_KEY = "Incorrect API key."
     INCORRECT_CREDS = "Incorrect credentials."
+    PASSWORD_HASHER_BUSY = "Too many password checks in progress, retry shortly."
 
 class WorkspaceErrors:
     MISSING_INIT_TOKEN = "Workspace creation token is missing."
@@ -0,0 +1,117 @@
+import bisect
+from operator import attrgetter
+
+
+class MarkerInterval:
+    """
+    A maximal run of overlapping markers. Indices refer to positions in the sorted marker list of the index the interval
+    belongs to.
+    """
+    __slots__ = ("first", "last", "start", "end", "closing")
+
+    def __init__(self, first: int, last: int, start: int, end: int, closing: int):
+        self.first = first
+        self.last = last
+        self.start = start
+        self.end = end
+        self.closing = closing  # Index of the marker that sets the end of the interval
+
+    @property
+    def covered(self) -> bool:
+        """
+        True if the first marker of the interval spans the entire interval.
+        """
+        return self.closing == self.first
+
+    def __repr__(self):
+        return f"MarkerInterval(start={self.start}, end={self.end}, markers={self.last - self.first})"
+
+
+class MarkerIntervalIndex:
+    """
+    Sorted index over character markers (PIIMarkerCharacterModel rows by default). Overlapping markers are merged into
+    disjoint MarkerIntervals once on construction, after which the markers touching any span can be found with a binary
+    search instead of a scan over every marker.
+    """
+
+    def __init__(self, markers: list, start_key=attrgetter("start_location"), end_key=attrgetter("end_location")):
+        """
+        :param markers: Markers to index
+        :param start_key: Function returning the start location of a marker
+        :param end_key: Function returning the end location of a marker
+        """
+        self.markers: list = sorted(markers, key=lambda m: (start_key(m), -end_key(m)))
+        self.starts: list = list(map(start_key, self.markers))
+        self.ends: list = list(map(end_key, self.markers))
+        self.intervals: list = self._merge()
+        self._interval_ends: list = [interval.end for interval in self.intervals]
+
+    def _merge(self) -> list:
+        starts, ends = self.starts, self.ends  # Local lookups keep the loop fast on large files
+        intervals: list = []
+        total_markers: int = len(self.markers)
+        i: int = 0
+
+        while i < total_markers:
+            interval_end: int = ends[i]
+            closing: int = i
+            j: int = i + 1
+
+            while j < total_markers and starts[j] < interval_end:
+                if ends[j] > interval_end:
+                    interval_end = ends[j]
+                    closing = j
+                j += 1
+
+            intervals.append(MarkerInterval(i, j, starts[i], interval_end, closing))
+            i = j
+
+        return intervals
+
+    def __len__(self) -> int:
+        return len(self.markers)
+
+    def __iter__(self):
+        return iter(self.markers)
+
+    def members(self, interval: MarkerInterval) -> list:
+        """
+        :param interval: Interval of this index
+        :return: Markers merged into the interval, in sorted order
+        """
+        return self.markers[interval.first:interval.last]
+
+    def overlapping(self, start: int, end: int) -> list:
+        """
+        Finds the markers that share at least one character with the span [start, end).
+        :param start: Start location of the span
+        :param end: End location of the span
+        :return: Markers in sorted order
+        """
+        found: list = []
+        position: int = bisect.bisect_right(self._interval_ends, start)
+
+        while position < len(self.intervals) and self.intervals[position].start < end:
+            interval: MarkerInterval = self.intervals[position]
+            upper: int = bisect.bisect_left(self.starts, end, interval.first, interval.last)
+            found.extend(self.markers[k] for k in range(interval.first, upper) if self.ends[k] > start)
+            position += 1
+
+        return found
+
+    def covering(self, start: int, end: int) -> list:
+        """
+        Finds the markers that contain the entire span [start, end).
+        :param start: Start location of the span
+        :param end: End location of the span
+        :return: Markers in sorted order
+        """
+        position: int = bisect.bisect_right(self._interval_ends, start)
+
+        if position == len(self.intervals) or self.intervals[position].start > start:
+            return []
+
+        interval: MarkerInterval = self.intervals[position]
+        upper: int = bisect.bisect_right(self.starts, start, interval.first, interval.last)
+
+        return [self.markers[k] for k in range(interval.first, upper) if self.ends[k] >= end]
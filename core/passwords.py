@@ -0,0 +1,94 @@
+"""
+Password hashing on a bounded pool of worker threads.
+
+bcrypt is deliberately slow, and a burst of logins hashing in the request threads would leave none to serve the rest of
+the API. Hashes are computed on a dedicated pool instead (bcrypt releases the GIL, so the pool hashes in parallel), and
+at most PASSWORD_HASH_QUEUE hashes may be running or waiting at once. Past that, requests are turned away with
+PasswordHasherBusy rather than queued without bound.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS") or 12)  # Cost of new hashes, older hashes are rehashed on login
+PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS") or os.cpu_count() or 1)
+PASSWORD_HASH_QUEUE: int = int(os.getenv("PASSWORD_HASH_QUEUE") or 4 * PASSWORD_HASH_WORKERS)
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when the password hashing pool already has as many hashes running or waiting as it accepts.
+    """
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_QUEUE,
+                 rounds: int = BCRYPT_ROUNDS):
+        """
+        :param workers: Number of threads hashing at once
+        :param max_pending: Number of hashes that may be running or waiting at once
+        :param rounds: bcrypt cost of new hashes
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor: ThreadPoolExecutor = None
+        self._executor_pid: int = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # A forked worker creates its own pool rather than sharing the threads of its parent
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def run(self, func, *args):
+        """
+        Runs a function on the pool and waits for its result.
+        :param func: Function to run
+        :param args: Arguments of the function
+        :return: Result of the function
+        :raises PasswordHasherBusy: If the pool is saturated
+        """
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password: str) -> str:
+        """
+        :param password: Plain text password
+        :return: bcrypt hash of the password at the configured cost
+        """
+        return self.run(bcrypt.hashpw, password.encode(), bcrypt.gensalt(self.rounds)).decode()
+
+    def check(self, password: str, hashed: str) -> bool:
+        """
+        :param password: Plain text password
+        :param hashed: bcrypt hash to check the password against
+        :return: True if the password matches
+        """
+        return self.run(bcrypt.checkpw, password.encode(), hashed.encode())
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """
+        :param hashed: bcrypt hash, e.g. $2b$12$...
+        :return: True if the hash was made at another cost than the configured one
+        """
+        return int(hashed.split("$")[2]) != self.rounds
+
+
+password_hasher: PasswordHasher = PasswordHasher()
@@ -0,0 +1,310 @@
+"""
+Redaction kernel shared by the text redaction paths (MaskText, TextFileRedactor and anonymize_file).
+
+The kernel works on plain (start, end, pii_type) spans. Overlapping spans are merged into intervals, and an interval is
+kept only if every span in it is of a permitted PII type. Any other interval is replaced as a unit: with a mask of the
+type of the span reaching furthest under AnonymizationType.MASK, and with REDACTION_TEXT otherwise.
+
+Each input span is mapped to a (start, end, permitted) location in the output. Spans in kept intervals are shifted to
+the same text in the output, spans in replaced intervals are shifted onto the replacement.
+"""
+import codecs
+import io
+import os
+import tempfile
+import typing
+from itertools import accumulate
+from operator import itemgetter
+
+from core.constants import AnonymizationType, Masks
+from core.intervals import MarkerIntervalIndex
+from core.util import one_way_hash_mask
+
+REDACTION_TEXT: str = "<REDACTED>"  # The PII's will be replaced with this text if not masked.
+
+DEFAULT_CHUNK_SIZE: int = 1024 * 1024  # Characters read from a stream at a time
+STREAMING_THRESHOLD: int = int(os.getenv("REDACTION_STREAMING_THRESHOLD") or 32 * 1024 * 1024)  # Bytes
+
+
+def replacement_text(text: str, pii_type: str, policy: AnonymizationType) -> str:
+    """
+    Chooses the text that replaces a redacted interval.
+    :param text: Original text covered by the interval
+    :param pii_type: PII type the interval is treated as
+    :param policy: Anonymization policy
+    :return: Replacement string
+    """
+    if policy == AnonymizationType.MASK and pii_type in Masks.HASH_PII_TYPES:
+        return one_way_hash_mask(text, pii_type)
+    return REDACTION_TEXT
+
+
+class TextSource:
+    """
+    In-memory source for the kernel. Output is collected as a list of untouched slices and replacement strings that is
+    joined once.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pieces: list = []
+        self.position: int = 0
+
+    def copy(self, end: int) -> None:
+        self.pieces.append(self.text[self.position:end])
+        self.position = end
+
+    def take(self, end: int, keep: bool) -> str:
+        taken: str = self.text[self.position:end] if keep else ""
+        self.position = end
+        return taken
+
+    def write(self, value: str) -> None:
+        self.pieces.append(value)
+
+    def finish(self) -> str:
+        self.pieces.append(self.text[self.position:])
+        return "".join(self.pieces)
+
+
+class ChunkedReader:
+    """
+    Reads a text stream in fixed-size chunks while tracking the absolute position of the next unread character, so
+    that marker offsets can be resolved no matter which chunk they fall in.
+    """
+
+    def __init__(self, reader, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.reader = reader
+        self.chunk_size = chunk_size
+        self.position: int = 0  # Offset in the stream of the next unread character
+        self._chunk: str = ""
+        self._index: int = 0  # Offset in the current chunk of the next unread character
+
+    def advance(self, end: typing.Optional[int] = None, sink: typing.Optional[typing.Callable] = None) -> None:
+        """
+        Consumes the stream up to an absolute offset, or to the end of the stream if no offset is given.
+        :param end: Offset to stop at
+        :param sink: Callable that receives every consumed slice, None to discard them
+        :return: None
+        """
+        while end is None or self.position < end:
+            if self._index == len(self._chunk):
+                self._chunk = self.reader.read(self.chunk_size)
+                self._index = 0
+                if not self._chunk:
+                    return
+
+            step: int = len(self._chunk) - self._index
+            if end is not None:
+                step = min(step, end - self.position)
+
+            if sink is not None:
+                sink(self._chunk[self._index:self._index + step])
+
+            self._index += step
+            self.position += step
+
+
+class DecodingReader:
+    """
+    Text view of a binary stream (e.g. the body of an S3 object). Bytes are decoded incrementally and newlines are
+    translated as open() does in text mode, so offsets into the stream match those of the file read from disk.
+    """
+
+    def __init__(self, raw, encoding: str = "utf-8"):
+        """
+        :param raw: Binary stream with a read(size) method
+        :param encoding: Text encoding of the stream
+        """
+        self.raw = raw
+        self._decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), translate=True)
+        self._eof: bool = False
+
+    def read(self, size: int = DEFAULT_CHUNK_SIZE) -> str:
+        """
+        :param size: Number of bytes to read from the stream
+        :return: Decoded text, empty only at the end of the stream
+        """
+        text: str = ""
+        # A chunk can end inside a multi-byte character or a \r\n pair and decode to nothing
+        while not text and not self._eof:
+            data: bytes = self.raw.read(size)
+            self._eof = not data
+            text = self._decoder.decode(data, final=self._eof)
+        return text
+
+
+class StreamSource:
+    """
+    Streaming source for the kernel. Output is written incrementally, so memory use is bounded by the chunk size and
+    the longest masked interval rather than the size of the stream.
+    """
+
+    def __init__(self, reader, writer, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.stream = ChunkedReader(reader, chunk_size)
+        self.writer = writer
+
+    def copy(self, end: int) -> None:
+        self.stream.advance(end, self.writer.write)
+
+    def take(self, end: int, keep: bool) -> str:
+        pieces: list = []
+        self.stream.advance(end, pieces.append if keep else None)
+        return "".join(pieces)
+
+    def write(self, value: str) -> None:
+        self.writer.write(value)
+
+    def finish(self) -> None:
+        self.stream.advance(sink=self.writer.write)
+
+
+def run_kernel(source, spans: list, permissions=frozenset(),
+               policy: AnonymizationType = AnonymizationType.REDACT) -> list:
+    """
+    Applies the redaction kernel to a source in a single pass over the merged intervals.
+    :param source: TextSource or StreamSource
+    :param spans: List of (start, end, pii_type) tuples
+    :param permissions: PII types the requester is permitted to see
+    :param policy: Anonymization policy for intervals that are not permitted
+    :return: List of (start, end, permitted) output locations, aligned with the input spans
+    """
+    permissions = frozenset(permissions)
+    keep_text: bool = policy == AnonymizationType.MASK
+
+    # Spans are tagged with their input position so that locations can be reported in input order
+    index: MarkerIntervalIndex = MarkerIntervalIndex(
+        [(start, end, pii_type, position) for position, (start, end, pii_type) in enumerate(spans)],
+        start_key=itemgetter(0), end_key=itemgetter(1),
+    )
+    sorted_spans: list = index.markers
+
+    # Running count of unpermitted spans, so an interval can be checked without visiting its members
+    blocked: list = [0]
+    blocked.extend(accumulate(span[2] not in permissions for span in sorted_spans))
+
+    locations: list = [None] * len(sorted_spans)
+    total_diff: int = 0  # Characters removed so far (negative when replacements are longer than the PII)
+
+    for interval in index.intervals:
+        if blocked[interval.last] == blocked[interval.first]:
+            for k in range(interval.first, interval.last):
+                start, end, _, position = sorted_spans[k]
+                locations[position] = (start - total_diff, end - total_diff, True)
+            continue
+
+        source.copy(interval.start)
+        masked_value: str = replacement_text(
+            source.take(interval.end, keep_text), sorted_spans[interval.closing][2], policy
+        )
+        source.write(masked_value)
+
+        diff_before: int = total_diff
+        total_diff += (interval.end - interval.start) - len(masked_value)
+
+        for k in range(interval.first, interval.last):
+            start, end, _, position = sorted_spans[k]
+            locations[position] = (start - diff_before, end - total_diff, False)
+
+    return locations
+
+
+def redact_text(text: str, spans: list, permissions=frozenset(),
+                policy: AnonymizationType = AnonymizationType.REDACT) -> tuple:
+    """
+    Runs the redaction kernel over a string. The cost is linear in the size of the text plus the number of spans.
+    :param text: Raw text
+    :param spans: List of (start, end, pii_type) tuples
+    :param permissions: PII types the requester is permitted to see
+    :param policy: Anonymization policy for intervals that are not permitted
+    :return: Tuple of the redacted text and the list of output locations
+    """
+    source: TextSource = TextSource(text)
+    locations: list = run_kernel(source, spans, permissions, policy)
+    return source.finish(), locations
+
+
+def redact_stream(reader, writer, spans: list, permissions=frozenset(),
+                  policy: AnonymizationType = AnonymizationType.REDACT, chunk_size: int = DEFAULT_CHUNK_SIZE) -> list:
+    """
+    Runs the redaction kernel over a text stream, reading fixed-size chunks and writing output incrementally.
+    :param reader: Text stream to redact
+    :param writer: Text stream to write the redacted output to
+    :param spans: List of (start, end, pii_type) tuples
+    :param permissions: PII types the requester is permitted to see
+    :param policy: Anonymization policy for intervals that are not permitted
+    :param chunk_size: Number of characters to read at a time
+    :return: List of output locations
+    """
+    source: StreamSource = StreamSource(reader, writer, chunk_size)
+    locations: list = run_kernel(source, spans, permissions, policy)
+    source.finish()
+    return locations
+
+
+def redact_file(filepath: str, spans: list, permissions=frozenset(),
+                policy: AnonymizationType = AnonymizationType.REDACT, streaming: typing.Optional[bool] = None,
+                chunk_size: int = DEFAULT_CHUNK_SIZE) -> list:
+    """
+    Redacts a text file in place. Files larger than STREAMING_THRESHOLD are streamed into a temporary file next to the
+    original, which then replaces it.
+    :param filepath: Path of the file to redact
+    :param spans: List of (start, end, pii_type) tuples
+    :param permissions: PII types the requester is permitted to see
+    :param policy: Anonymization policy for intervals that are not permitted
+    :param streaming: Force streaming on or off, by default it is chosen from the file size
+    :param chunk_size: Number of characters to read at a time when streaming
+    :return: List of output locations
+    """
+    if streaming is None:
+        streaming = os.path.getsize(filepath) > STREAMING_THRESHOLD
+
+    if not streaming:
+        with open(filepath, "r") as f:
+            text: str = f.read()
+
+        text, locations = redact_text(text, spans, permissions, policy)
+
+        with open(filepath, "w") as f:
+            f.write(text)
+
+        return locations
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filepath)), suffix=".redacted")
+
+    try:
+        with open(filepath, "r") as reader, os.fdopen(fd, "w") as writer:
+            locations = redact_stream(reader, writer, spans, permissions, policy, chunk_size)
+        os.replace(temp_path, filepath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return locations
+
+
+def marker_spans(markers: list) -> list:
+    """
+    :param markers: Character markers (e.g. PIIMarkerCharacterModel rows)
+    :return: List of (start, end, pii_type) tuples
+    """
+    return [(marker.start_location, marker.end_location, marker.pii_type) for marker in markers]
+
+
+def apply_locations(markers: list, locations: list) -> list:
+    """
+    Moves character markers to their output locations.
+    :param markers: Character markers the kernel was run on
+    :param locations: Output locations returned by the kernel
+    :return: Permitted markers, sorted by location
+    """
+    permitted: list = []
+
+    for marker, (start, end, is_permitted) in zip(markers, locations):
+        if is_permitted:
+            marker.start_location = start
+            marker.end_location = end
+            permitted.append(marker)
+
+    return sorted(permitted, key=lambda k: (k.start_location, -k.end_location))
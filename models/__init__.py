@@ -1,6 +1,9 @@
 import models.audit.dataset_action_history
 import models.auth.api_key
+import models.auth.revoked_token
 import models.auth.user
+import models.datasets.access
+import models.datasets.anonymized_copy
 import models.datasets.base
 import models.datasets.file
 import models.job
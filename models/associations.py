@@ -22,6 +22,7 @@ RoleDataset = db.Table(
         db.Integer,
         db.ForeignKey("dataset.dataset_id", ondelete="cascade"),
     ),
+    db.Index("ix_role_dataset_dataset_role", "dataset_id", "role_id"),  # Roles a dataset is shared with
 )
 
 # Table to store Dataset to Owner relationships (many-to-many relationships).
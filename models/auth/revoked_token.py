@@ -0,0 +1,23 @@
+import datetime
+
+from db import db
+
+
+class RevokedTokenModel(db.Model):
+    """
+    Authorization tokens revoked before their expiry (e.g. on logout), shared by every worker. Tokens are stored by
+    digest only, and rows are deleted once the token would have expired anyway.
+    """
+    __tablename__ = "revoked_token"
+
+    token_digest = db.Column(db.String, primary_key=True)
+    expiry = db.Column(db.DateTime, nullable=False, index=True)
+    created_ts = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __init__(self, token_digest, expiry):
+        self.token_digest = token_digest
+        self.expiry = expiry
+        self.created_ts = datetime.datetime.utcnow()
+
+    def __repr__(self):
+        return f"RevokedTokenModel(token_digest={self.token_digest}, expiry={self.expiry})"
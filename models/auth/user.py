@@ -1,13 +1,15 @@
 import datetime
+import json
 import os
 
-import bcrypt
 from itsdangerous import (
     BadSignature,
     SignatureExpired,
     TimedJSONWebSignatureSerializer as Serializer,
+    base64_decode,
 )
 
+from core.passwords import password_hasher
 from db import db
 from models.associations import DatasetOwner
 from models.auth.util import check_validity
@@ -59,11 +61,23 @@ class UserModel(db.Model):
         :param password: Hashed password entered by the user.
         :return: Boolean representing successful password match.
         """
-        return bcrypt.checkpw(password.encode(), self.password.encode())
+        return password_hasher.check(password, self.password)
+
+    def rehash_password(self, password):
+        """
+        Rehashes the password if its hash was made at another bcrypt cost than the configured one.
+        :param password: Plain text password, already checked with check_password.
+        :return: Boolean representing whether the password was rehashed.
+        """
+        if not password_hasher.needs_rehash(self.password):
+            return False
+
+        self.password = self.hash_password(password)
+        return True
 
     @staticmethod
     def hash_password(password):
-        return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+        return password_hasher.hash(password)
 
     @staticmethod
     def verify_auth_token(token):
@@ -72,6 +86,19 @@ class UserModel(db.Model):
         :param token: Authorization Token
         :return: Boolean representing successful login.
         """
+        result = UserModel.verify_auth_token_signature(token)
+        if not result[0]:
+            return result
+
+        return UserModel.check_auth_token_validity(token, result[1])
+
+    @staticmethod
+    def verify_auth_token_signature(token):
+        """
+        Verifies the signature and expiry of an authorization token, without checking whether it was revoked.
+        :param token: Authorization Token
+        :return: Tuple of the verification status and the user ID or an error message
+        """
         s = Serializer(os.environ.get("SECRET", "default_secret"))
 
         try:
@@ -80,13 +107,32 @@ class UserModel(db.Model):
             return False, "Token expired"  # Valid token, but TTL is passed
         except BadSignature:
             return False, "Bad token received"  # Invalid token
-        
-        # check if token is not being used after logout.
+
+        return True, data["id"]
+
+    @staticmethod
+    def check_auth_token_validity(token, user_id):
+        """
+        Checks that a verified authorization token is not being used after logout.
+        :param token: Authorization Token, already verified by verify_auth_token_signature
+        :param user_id: User the token was issued to
+        :return: Tuple of the authentication status and the user ID or an error message
+        """
         if check_validity(token):
-            return True, data["id"]
+            return True, user_id
         else:
             return False, "Invalid token received"
-            
+
+    @staticmethod
+    def auth_token_expiry(token):
+        """
+        Reads the expiry of an authorization token from its header, without verifying it.
+        :param token: Authorization token, already verified by verify_auth_token_signature
+        :return: Expiry in seconds since the epoch
+        """
+        header = json.loads(base64_decode(token.split(".")[0]))
+        return header["exp"]
+
     def __repr__(self):
         return (
             f"{self.__class__.__name__}({self.user_id}, {self.email}, {self.password}, {self.first_name}, "
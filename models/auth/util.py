@@ -1,27 +1,199 @@
-import hashlib
 import datetime
+import hashlib
+import heapq
+import os
+import threading
+
+from core.bloom import BloomFilter
+from db import db
+from models.auth.revoked_token import RevokedTokenModel
+
+REVOKED_TOKEN_CAPACITY: int = int(os.getenv("REVOKED_TOKEN_CAPACITY") or 1000000)  # Live revocations per filter
+REVOKED_TOKEN_SYNC_INTERVAL: float = float(os.getenv("REVOKED_TOKEN_SYNC_INTERVAL") or 1)  # Seconds
+SYNC_OVERLAP: datetime.timedelta = datetime.timedelta(seconds=5)  # Also picks up revocations committed late
+
+
+class RevokedTokenStore:
+    """
+    Revoked authorization tokens, kept by digest in the revoked_token table so that every worker agrees on them. Each
+    worker fronts the table with a Bloom filter of the digests, so a token that was never revoked, the common case, is
+    accepted without a query. Revocations made by other workers are pulled into the filter every sync_interval seconds.
+
+    The expiries of the tokens in the filter are kept in a min-heap. Every sync drops the expired tokens from the heap
+    and rebuilds the filter once most of the tokens in it have expired, so workers that only ever see the revocations
+    of other workers keep their filter small too. The new filter is built while the old one keeps answering, and
+    swapped in once it is complete. Expired rows are deleted by purge_expired() on logout.
+    """
+
+    def __init__(self, capacity: int = REVOKED_TOKEN_CAPACITY, sync_interval: float = REVOKED_TOKEN_SYNC_INTERVAL,
+                 clock=datetime.datetime.utcnow):
+        """
+        :param capacity: Number of live revocations the Bloom filter is sized for
+        :param sync_interval: Seconds between pulls of the revocations made by other workers
+        :param clock: Function returning the current UTC time
+        """
+        self.capacity = capacity
+        self.sync_interval = datetime.timedelta(seconds=sync_interval)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._filter: BloomFilter = BloomFilter(self.capacity)
+        self._expiries: list = []  # Min-heap of (expiry, digest) of the tokens in the filter
+        self._synced_until = None  # Revocations created before this time are in the filter
+        self._next_sync = None
+        self._remembered_during_rebuild = None  # Revocations to carry over into the filter being rebuilt
+        self._expired_since_purge = 0  # Tokens dropped from the heap whose rows purge_expired() has not deleted yet
+
+    def _remember(self, digest: str, expiry: datetime.datetime) -> None:
+        self._filter.add(digest)
+        heapq.heappush(self._expiries, (expiry, digest))
+        if self._remembered_during_rebuild is not None:
+            self._remembered_during_rebuild.append((expiry, digest))
+
+    def _live_revocations(self, now: datetime.datetime) -> list:
+        return db.session.query(RevokedTokenModel.expiry, RevokedTokenModel.token_digest).filter(
+            RevokedTokenModel.expiry > now
+        ).all()
+
+    def _rebuild(self) -> None:
+        now: datetime.datetime = self.clock()
+
+        with self._lock:
+            if self._remembered_during_rebuild is not None:
+                return  # Another thread is rebuilding
+            self._remembered_during_rebuild = []
+
+        try:
+            bloom_filter: BloomFilter = BloomFilter(self.capacity)
+            expiries: list = [(expiry, digest) for expiry, digest in self._live_revocations(now)]
+            for expiry, digest in expiries:
+                bloom_filter.add(digest)
+            heapq.heapify(expiries)
+
+            with self._lock:
+                # Revocations made or synced while the table was read may have been committed after it
+                for expiry, digest in self._remembered_during_rebuild:
+                    if digest not in bloom_filter:
+                        bloom_filter.add(digest)
+                        heapq.heappush(expiries, (expiry, digest))
+                self._filter, self._expiries = bloom_filter, expiries
+                self._synced_until = now
+                self._next_sync = now + self.sync_interval
+        finally:
+            with self._lock:
+                self._remembered_during_rebuild = None
+
+    def sync(self, force: bool = False) -> None:
+        """
+        Adds the revocations made since the last sync, by any worker, to the filter.
+        :param force: Sync even if the last sync is more recent than sync_interval
+        :return: None
+        """
+        now: datetime.datetime = self.clock()
+        if not force and self._next_sync is not None and now < self._next_sync:
+            return
+
+        query = db.session.query(RevokedTokenModel.token_digest, RevokedTokenModel.expiry).filter(
+            RevokedTokenModel.expiry > now
+        )
+        if self._synced_until is not None:
+            query = query.filter(RevokedTokenModel.created_ts >= self._synced_until - SYNC_OVERLAP)
+
+        rows: list = query.all()
+
+        with self._lock:
+            for digest, expiry in rows:
+                if digest not in self._filter:
+                    self._remember(digest, expiry)
+            self._synced_until = now
+            self._next_sync = now + self.sync_interval
+
+        self._prune(now)
+
+    def _prune(self, now: datetime.datetime) -> int:
+        # Drops the expired tokens from the heap, rebuilding the filter once most of the tokens in it have expired
+        with self._lock:
+            expired: int = 0
+            while self._expiries and self._expiries[0][0] <= now:
+                heapq.heappop(self._expiries)
+                expired += 1
+            self._expired_since_purge += expired
+            rebuild: bool = expired > 0 and 2 * len(self._expiries) < len(self._filter)
+
+        if rebuild:
+            self._rebuild()
+        return expired
+
+    def revoke(self, token: str, expiry: datetime.datetime) -> None:
+        """
+        :param token: Raw authorization token
+        :param expiry: Time (UTC) the token expires at, it needs no revocation after that
+        :return: None
+        """
+        if expiry <= self.clock():
+            return
+
+        digest: str = hash_token(token)
+        db.session.merge(RevokedTokenModel(digest, expiry))
+        db.session.commit()
+
+        with self._lock:
+            self._remember(digest, expiry)
+
+    def is_revoked(self, token: str) -> bool:
+        """
+        :param token: Raw authorization token
+        :return: True if the token was revoked and has not expired yet
+        """
+        self.sync()
+
+        digest: str = hash_token(token)
+        if digest not in self._filter:
+            return False
+
+        # The filter may give false positives, the table has the final say
+        row: RevokedTokenModel = RevokedTokenModel.query.get(digest)
+        return row is not None and row.expiry > self.clock()
+
+    def purge_expired(self) -> int:
+        """
+        Deletes the revocations of tokens that have expired since, rebuilding the filter once most of it is expired.
+        :return: Number of expired tokens dropped from the heap since the last purge
+        """
+        now: datetime.datetime = self.clock()
+        self._prune(now)
+
+        with self._lock:
+            expired: int = self._expired_since_purge
+            self._expired_since_purge = 0
+
+        if not expired:
+            return 0
+
+        RevokedTokenModel.query.filter(RevokedTokenModel.expiry <= now).delete(synchronize_session=False)
+        db.session.commit()
+
+        return expired
+
+
+revoked_tokens: RevokedTokenStore = RevokedTokenStore()
 
-invalid_tokens = []
 
 def delete_expired_tokens():
-    curr_time = datetime.datetime.utcnow()
-    for token in invalid_tokens:
-        if token["expiry"] < curr_time :
-            invalid_tokens.remove(token)
-    return
-        
+    return revoked_tokens.purge_expired()
+
+
 def add_invalid_token(token, expiry):
-    invalid_tokens.append({"token": hash_token(token), "expiry": expiry})
+    revoked_tokens.revoke(token, expiry)
     delete_expired_tokens()
     return "Token invalidated successfully"
 
+
 def check_validity(token):
-    token_hash = hash_token(token)
-    is_valid = True
-    for token in invalid_tokens:
-        if (token["token"] == token_hash):
-            is_valid = False
-    return is_valid
+    return not revoked_tokens.is_revoked(token)
+
 
 def hash_token(token):
     return hashlib.sha512(token.encode()).hexdigest()
@@ -0,0 +1,33 @@
+from db import db
+
+
+class DatasetAccessModel(db.Model):
+    """
+    Materialized index of the datasets each user can see: one row per user and dataset, either owned or shared through
+    roles, with the PII types the user's roles permit on the dataset. The rows are derived from dataset_owner,
+    role_member, role_dataset and role_permissions and kept up to date by core.dataset_access.
+    """
+    __tablename__ = "dataset_access"
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "dataset_id", name="_dataset_access_uc"),
+    )
+
+    access_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.user_id", ondelete="cascade"), nullable=False)
+    dataset_id = db.Column(
+        db.Integer, db.ForeignKey("dataset.dataset_id", ondelete="cascade"), nullable=False, index=True
+    )
+    access_kind = db.Column(db.String, nullable=False)  # DatasetAccessKinds, owners take precedence over roles
+    permissions = db.Column(db.JSON, nullable=False)  # Sorted PII descriptions permitted by the user's roles
+
+    def __init__(self, user_id, dataset_id, access_kind, permissions):
+        self.user_id = user_id
+        self.dataset_id = dataset_id
+        self.access_kind = access_kind
+        self.permissions = permissions
+
+    def __repr__(self):
+        return (
+            f"DatasetAccessModel(user_id={self.user_id}, dataset_id={self.dataset_id}, "
+            f"access_kind={self.access_kind}, permissions={self.permissions})"
+        )
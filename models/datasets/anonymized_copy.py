@@ -0,0 +1,40 @@
+import datetime
+
+from db import db
+
+
+class AnonymizedCopyModel(db.Model):
+    """
+    Index of the anonymized copies of a file stored in S3. A copy is identified by the markers it was anonymized
+    with, the normalized set of permitted PII types and the anonymization method. The version (ETag) of the source
+    object it was made from is kept with it.
+    """
+    __tablename__ = "anonymized_copy"
+    __table_args__ = (
+        db.UniqueConstraint(
+            "file_id", "markers_digest", "permissions", "anon_method", name="_anonymized_copy_uc"
+        ),
+    )
+
+    copy_id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey("file.file_id", ondelete="cascade"), nullable=False, index=True)
+    source_version = db.Column(db.String, nullable=False)
+    markers_digest = db.Column(db.String, nullable=False)
+    permissions = db.Column(db.String, nullable=False)
+    anon_method = db.Column(db.String, nullable=False)
+    location = db.Column(db.String, nullable=False)  # Key in the anonymized copy bucket
+    marker_locations = db.Column(db.JSON, nullable=False)  # [pii_id, start, end] of each marker left in the copy
+    created_ts = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, file_id, source_version, markers_digest, permissions, anon_method, location, marker_locations):
+        self.file_id = file_id
+        self.source_version = source_version
+        self.markers_digest = markers_digest
+        self.permissions = permissions
+        self.anon_method = anon_method
+        self.location = location
+        self.marker_locations = marker_locations
+        self.created_ts = datetime.datetime.utcnow()
+
+    def __repr__(self):
+        return f"<AnonymizedCopy(file_id={self.file_id}, permissions={self.permissions}, location={self.location})>"
@@ -8,20 +8,22 @@ class PIIMarkerImageModel(PIIMarkerBaseModel):
     y1 = db.Column(db.Integer, nullable=False)
     x2 = db.Column(db.Integer, nullable=False)
     y2 = db.Column(db.Integer, nullable=False)
+    page_number = db.Column(db.Integer, nullable=False, default=1, server_default="1")  # 1-based
 
     __mapperargs__ = {
         "polymorphic_identity": "IMAGE_FILE"
     }
 
-    def __init__(self, file_id, pii_type, confidence, marker_type, x1, y1, x2, y2):
+    def __init__(self, file_id, pii_type, confidence, marker_type, x1, y1, x2, y2, page_number=1):
         super().__init__(file_id, pii_type, confidence, marker_type)
         self.x1 = x1
         self.y1 = y1
         self.x2 = x2
         self.y2 = y2
+        self.page_number = page_number
 
     def __repr__(self):
-        return f"PIIMarkerImageModel(x1={self.x1}, y1={self.y1}, x2={self.x2}, y2={self.y2})"
+        return f"PIIMarkerImageModel(page_number={self.page_number}, x1={self.x1}, y1={self.y1}, x2={self.x2}, y2={self.y2})"
 
     def __str__(self):
         return f"PIIMarkerImageModel({self.x1, self.y1}), ({self.x2}, {self.y2})"
\ No newline at end of file
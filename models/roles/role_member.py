@@ -3,7 +3,10 @@ from db import db
 
 class RoleMemberModel(db.Model):
     __tablename__ = "role_member"
-    __table_args__ = (db.UniqueConstraint("role_id", "user_id", name="_role_user_uc"),)
+    __table_args__ = (
+        db.UniqueConstraint("role_id", "user_id", name="_role_user_uc"),
+        db.Index("ix_role_member_user_role", "user_id", "role_id"),  # Roles of a user, see core.dataset_access
+    )
 
     role_member_id = db.Column(db.Integer, primary_key=True)
     role_id = db.Column(
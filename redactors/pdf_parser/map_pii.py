@@ -1,10 +1,93 @@
+import bisect
+
 from loguru import logger
 
+RESYNC_LENGTH = 8  # Characters that must match to pick up the alignment again after a mismatch
+RESYNC_WINDOW = 256  # Characters searched ahead for a match after a mismatch
+
+
+class OffsetMap:
+    """
+    Alignment between the text pdfminer renders for a page and the text of the page's pdfrw text tokens. The two
+    differ where pdfminer adds layout characters or decodes glyphs differently, so the alignment is kept as blocks of
+    matching characters. It is built once per page, after which each offset is mapped with a binary search.
+    """
+
+    def __init__(self, text_content: str, text_tok: str):
+        """
+        :param text_content: Text rendered by pdfminer
+        :param text_tok: Concatenated values of the text tokens
+        """
+        self.text_starts = []
+        self.tok_starts = []
+        self.sizes = []
+        self.tok_length = len(text_tok)
+        self._align(text_content, text_tok)
+
+    def _add_block(self, i: int, j: int, size: int):
+        self.text_starts.append(i)
+        self.tok_starts.append(j)
+        self.sizes.append(size)
+
+    def _align(self, text: str, tok: str):
+        # Walks both strings once. Runs of equal characters become blocks, and after a mismatch the walk skips ahead in
+        # whichever string lets the next RESYNC_LENGTH characters match again.
+        i, j = 0, 0
+        text_length, tok_length = len(text), len(tok)
+
+        while i < text_length and j < tok_length:
+            if text[i] == tok[j]:
+                size = 1
+                while i + size < text_length and j + size < tok_length and text[i + size] == tok[j + size]:
+                    size += 1
+                self._add_block(i, j, size)
+                i += size
+                j += size
+                continue
+
+            tok_found = text.find(tok[j:j + RESYNC_LENGTH], i, i + RESYNC_WINDOW)
+            text_found = tok.find(text[i:i + RESYNC_LENGTH], j, j + RESYNC_WINDOW)
+
+            if tok_found != -1 and (text_found == -1 or tok_found - i <= text_found - j):
+                i = tok_found  # Characters only pdfminer rendered
+            elif text_found != -1:
+                j = text_found  # Characters only the text tokens hold
+            else:
+                i += 1  # A character decoded differently by the two parsers
+                j += 1
+
+    def start(self, offset: int) -> int:
+        """
+        :param offset: Start offset in the rendered text
+        :return: Offset in the token text of the first aligned character at or after offset
+        """
+        block = bisect.bisect_right(self.text_starts, offset) - 1
+        if block >= 0 and offset < self.text_starts[block] + self.sizes[block]:
+            return self.tok_starts[block] + offset - self.text_starts[block]
+        if block + 1 < len(self.tok_starts):
+            return self.tok_starts[block + 1]
+        return self.tok_length
+
+    def end(self, offset: int) -> int:
+        """
+        :param offset: End offset (exclusive) in the rendered text
+        :return: End offset in the token text of the last aligned character before offset
+        """
+        block = bisect.bisect_right(self.text_starts, offset - 1) - 1
+        if block < 0:
+            return 0
+        return self.tok_starts[block] + min(offset - self.text_starts[block], self.sizes[block])
+
+
 def mapper(text_content,text_tok,pii):
+    offsets = OffsetMap(text_content, text_tok)
 
     for item in pii :
-        dem_text = text_content[item.get('start_location'):item.get('end_location')]
-        if text_tok.find(dem_text) != -1 :
-            item['start_location'] = text_tok.find(dem_text)
-            item['end_location'] = text_tok.find(dem_text) + len(dem_text)
+        start = offsets.start(item.get('start_location'))
+        end = offsets.end(item.get('end_location'))
+        if start < end :
+            item['start_location'] = start
+            item['end_location'] = end
+        else :
+            logger.debug(f"Could not align marker {item} with the text tokens")
     return pii
@@ -1,9 +1,16 @@
 # A general-purpose PDF text-layer redaction tool.
 from loguru import logger
+import bisect
+import hashlib
+import os
 import sys
 import time
 from datetime import datetime
+from itertools import accumulate
+from operator import itemgetter
 from core import util
+from core.cache import LRUCache
+from core.intervals import MarkerIntervalIndex
 from pdfrw import PdfDict
 
 class RedactorOptions:
@@ -72,8 +79,9 @@ class RedactorOptions:
 	link_filters = []
 
 
-def redactor(options,file_name):
-	# This is the function that performs redaction.
+def redactor(options,file_name,text_content=None):
+	# This is the function that performs redaction. text_content is the
+	# rendered text of the PDF if the caller already has it (see render_text).
 
 	# if sys.version_info < (3,):
 	# 	if options.input_stream is None:
@@ -88,7 +96,9 @@ def redactor(options,file_name):
 
 	from pdfrw import PdfReader, PdfWriter
 
-	# Read the PDF.
+	# Read the PDF. file_name may also be a binary stream holding the PDF.
+	if hasattr(file_name, 'read'):
+		file_name.seek(0)
 	document = PdfReader(file_name)
 
 	# Modify its Document Information Dictionary metadata.
@@ -102,7 +112,7 @@ def redactor(options,file_name):
 		text_layer = build_text_layer(document, options)
 
 		# Apply filters to the text stream.
-		output,text_tok,document,text_layer = update_text_layer(options, *text_layer,document,text_layer,file_name)
+		output,text_tok,document,text_layer = update_text_layer(options, *text_layer,document,text_layer,file_name,text_content)
 		return output,text_tok,document,text_layer
 		# # Replace page content streams with updated tokens.
 		apply_updated_text(document, *text_layer)
@@ -112,6 +122,7 @@ def redactor(options,file_name):
 
 	# Write the PDF back out.
 def write_pdf(document,name):
+	# name may be a filename or a binary stream to write the PDF to.
 	from pdfrw import PdfReader, PdfWriter
 	writer = PdfWriter()
 	writer.trailer = document
@@ -605,25 +616,62 @@ class CMap(object):
 			else:
 				operand_stack.append(token)
 
+		self.build_lookup()
+
+	def build_lookup(self):
+		# Index the mappings by byte value so decode does not slice and probe
+		# the dict for every byte. single maps a byte to its character (None
+		# if unmapped), double maps two-byte codes as integers.
+		self.single = [None] * 256
+		self.double = { }
+		for code, char in self.bytes_to_unicode.items():
+			if len(code) == 1:
+				self.single[code[0]] = char
+			elif len(code) == 2:
+				self.double[code[0] << 8 | code[1]] = char
+
+		# Without two-byte codes decoding is a plain table lookup.
+		self.table = ["?" if char is None else char for char in self.single]
+		self.unmapped = bytes(b for b in range(256) if self.single[b] is None)
+
+		# Number of codes decoded with and without a mapping.
+		self.hits = 0
+		self.misses = 0
+
 	def dump(self):
 		for code, char in self.bytes_to_unicode.items():
 			print(repr(code), char)
 
 	def decode(self, string):
+		if not self.double:
+			misses = len(string) - len(string.translate(None, self.unmapped))
+			self.hits += len(string) - misses
+			self.misses += misses
+			return string.decode("Latin-1").translate(self.table)
+
+		single, double = self.single, self.double
 		ret = []
-		i = 0;
+		misses = 0
+		i = 0
 		while i < len(string):
-			if string[i:i+1] in self.bytes_to_unicode:
+			char = single[string[i]]
+			if char is not None:
 				# byte matches a single-byte entry
-				ret.append( self.bytes_to_unicode[string[i:i+1]] )
-				i += 1
-			elif string[i:i+2] in self.bytes_to_unicode:
-				# next two bytes matches a multi-byte entry
-				ret.append( self.bytes_to_unicode[string[i:i+2]] )
-				i += 2
-			else:
-				ret.append("?")
+				ret.append(char)
 				i += 1
+				continue
+			if i + 1 < len(string):
+				char = double.get(string[i] << 8 | string[i+1])
+				if char is not None:
+					# next two bytes matches a multi-byte entry
+					ret.append(char)
+					i += 2
+					continue
+			ret.append("?")
+			misses += 1
+			i += 1
+		self.hits += len(ret) - misses
+		self.misses += misses
 		return "".join(ret)
 
 	def encode(self, string):
@@ -633,6 +681,25 @@ class CMap(object):
 		return b"".join(ret)
 
 
+# Process-wide cache of parsed CMaps, keyed by a hash of the CMap stream.
+cmap_cache = LRUCache(int(os.getenv("PDF_CMAP_CACHE_SIZE") or 256))
+
+def cached_cmap(cmap):
+	# The stream must already be uncompressed.
+	stream = cmap.stream
+	if not isinstance(stream, bytes):
+		stream = stream.encode("utf-8", "surrogatepass")
+	return cmap_cache.get_or_create(hashlib.sha1(stream).hexdigest(), lambda: CMap(cmap))
+
+def cmap_stats():
+	# Hit/miss counts of the CMap cache, plus how many codes the cached CMaps
+	# decoded with (decode_hits) and without (decode_misses) a mapping.
+	stats = cmap_cache.stats()
+	cmaps = cmap_cache.values()
+	stats["decode_hits"] = sum(cmap.hits for cmap in cmaps)
+	stats["decode_misses"] = sum(cmap.misses for cmap in cmaps)
+	return stats
+
 def toUnicode(string, font, fontcache):
 	# This is hard!
 
@@ -645,9 +712,10 @@ def toUnicode(string, font, fontcache):
 		from pdfrw.uncompress import uncompress as uncompress_streams
 		uncompress_streams([font.ToUnicode])
 
-		# Use the CMap, which maps character codes to Unicode code points.
+		# Use the CMap, which maps character codes to Unicode code points. Parsed
+		# CMaps are shared by every page and document this process redacts.
 		if font.ToUnicode.stream not in fontcache:
-			fontcache[font.ToUnicode.stream] = CMap(font.ToUnicode)
+			fontcache[font.ToUnicode.stream] = cached_cmap(font.ToUnicode)
 		cmap = fontcache[font.ToUnicode.stream]
 
 		string = cmap.decode(string)
@@ -699,95 +767,108 @@ def fromUnicode(string, font, fontcache, options):
 	else:
 		raise ValueError("Don't know how to encode data to font %s." % font)
 
-def update_text_layer(options, text_tokens, page_tokens,document,text_layer,file_name):
-	if len(text_tokens) == 0:
-		# No text content.
-		return
-	
-
+def render_text(file_name, page_numbers=None):
+	# Render the text of a document with pdfminer in a single pass, keeping each
+	# page's text separate so that a multi-page document only has to be parsed
+	# once. page_numbers is a collection of 0-based page numbers to render, or
+	# None for every page. Returns a dict mapping page numbers to text.
 	import io
 	from pdfminer.converter import TextConverter
 	from pdfminer.pdfinterp import PDFPageInterpreter
 	from pdfminer.pdfinterp import PDFResourceManager
 	from pdfminer.pdfpage import PDFPage
-	resource_manager = PDFResourceManager()
+
+	if page_numbers is not None:
+		# pdfminer treats an empty selection as "every page".
+		page_numbers = sorted(page_numbers)
+		if not page_numbers:
+			return { }
+
+	resource_manager = PDFResourceManager(caching=True)
 	fake_file_handle = io.StringIO()
 	converter = TextConverter(resource_manager, fake_file_handle)
 	page_interpreter = PDFPageInterpreter(resource_manager, converter)
-    
-	with open(file_name, 'rb') as fh:
-		for page in PDFPage.get_pages(fh, 
-                                      caching=True,
-                                      check_extractable=True):
+
+	if hasattr(file_name, 'read'):
+		# Parse the in-memory PDF directly rather than going through the filesystem.
+		file_name.seek(0)
+		fh = file_name
+	else:
+		fh = open(file_name, 'rb')
+
+	texts = { }
+	try:
+		pages = PDFPage.get_pages(fh, pagenos=page_numbers, caching=True, check_extractable=True)
+		# get_pages yields the selected pages in document order.
+		numbers = page_numbers if page_numbers is not None else range(sys.maxsize)
+		for number, page in zip(numbers, pages):
 			page_interpreter.process_page(page)
-            
-		text = fake_file_handle.getvalue()
-    
-    # close open handles
-	converter.close()
-	fake_file_handle.close()
-    
-	if text:
-		text_content =  text
+			texts[number] = fake_file_handle.getvalue()
+			fake_file_handle.seek(0)
+			fake_file_handle.truncate(0)
+	finally:
+		if fh is not file_name:
+			fh.close()
+
+		# close open handles
+		converter.close()
+		fake_file_handle.close()
+
+	return texts
+
+def update_text_layer(options, text_tokens, page_tokens,document,text_layer,file_name,text_content=None):
+	if len(text_tokens) == 0:
+		# No text content.
+		return
+
+	# The rendered text is only parsed out of the file if the caller has not
+	# already rendered it, e.g. from the page it already holds in memory.
+	if text_content is None:
+		text = "".join(render_text(file_name).values())
+		if text:
+			text_content = text
 	text_tok = "".join(t.value for t in text_tokens)
 	return text_content,text_tok,document,text_layer
 
 def update_text_with_pii(text_tokens, page_tokens, pii):
-	for item in pii:   	
-		i1 = item.get("start_location")
-		i2 = item.get("end_location")
-		active_len = 0
-		start = 0
-		flag = 0
-		assert i1<i2
-		while start < i1 :
-			if ((start + len(text_tokens[flag].value)) < i1 ):
-				start += len(text_tokens[flag].value)
-				flag += 1
-			elif ((start + len(text_tokens[flag].value)) > i1 ):
-				start = i1 - start
-				break
-			elif ((start + len(text_tokens[flag].value)) == i1 ):
-				start = 0
-				flag = flag + 1
-				break
-		tot_len = ( i2-i1-1)
-		while(active_len <= tot_len) :
-			if ( len(text_tokens[flag].value[start:]) <  tot_len):
-				text_tokens[flag].value=list(text_tokens[flag].value)
-				text_tokens[flag].value[start:] = '-' * len(text_tokens[flag].value[start:])
-				flag += 1
-				start = 0
-				sr=''
-				active_len += len(text_tokens[flag].value[start:])
-				text_tokens[flag].value = sr.join(text_tokens[flag].value)
-			elif ( len(text_tokens[flag].value[start:]) >  tot_len):
-				text_tokens[flag].value = list(text_tokens[flag].value)
-				sr=''
-				text_tokens[flag].value[start: start+(tot_len-1)] = '-' * tot_len
-				text_tokens[flag].value = sr.join(text_tokens[flag].value)
-				break
-			else :
-				sr=''
-				text_tokens[flag].value = list(text_tokens[flag].value)
-				text_tokens[flag].value[start:] = '-' * len( text_tokens[flag].value[start:])
-				text_tokens[flag].value = sr.join(text_tokens[flag].value)
-				break
-	for t in text_tokens:
-		if(isinstance(t.value,list)):
-			demo = ''
-			for i in t.value:
-				demo = demo.join(i)
-			t.value = demo
-	flag = 0
-	from pdfrw import PdfArray
-	for a in page_tokens:
-		for b in a:
-			if isinstance(b,PdfArray):
-				if flag < len(text_tokens):
-					b = text_tokens[flag]
-					flag += 1
-		
+	# Replace every character covered by a PII marker with a dash. Marker
+	# offsets refer to the concatenated values of text_tokens, so the offset at
+	# which each token starts is computed once and the token holding an offset
+	# is found with a binary search. Overlapping markers are merged first, and
+	# every affected token is rewritten once, after all markers have been
+	# applied. Characters are replaced one for one, so the offsets of the
+	# remaining markers stay valid.
+	token_ends = list(accumulate(len(t.value) for t in text_tokens))
+	text_length = token_ends[-1] if token_ends else 0
+
+	markers = [item for item in pii if item.get("start_location") < item.get("end_location")]
+	index = MarkerIntervalIndex(markers, start_key=itemgetter("start_location"), end_key=itemgetter("end_location"))
+
+	# Token index => list of (start, end) ranges to blank out, relative to the token.
+	blanked = { }
+	for interval in index.intervals:
+		start = max(interval.start, 0)
+		end = min(interval.end, text_length)
+		flag = bisect.bisect_right(token_ends, start)
+		while flag < len(text_tokens) and start < end:
+			token_start = token_ends[flag] - len(text_tokens[flag].value)
+			token_end = min(token_ends[flag], end)
+			if start < token_end:
+				blanked.setdefault(flag, []).append((start - token_start, token_end - token_start))
+			start = token_ends[flag]
+			flag += 1
+
+	for flag, ranges in blanked.items():
+		value = text_tokens[flag].value
+		pieces = []
+		position = 0
+		for start, end in ranges:
+			pieces.append(value[position:start])
+			pieces.append('-' * (end - start))
+			position = end
+		pieces.append(value[position:])
+		text_tokens[flag].value = "".join(pieces)
+
 	return text_tokens,page_tokens
 
 
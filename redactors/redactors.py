@@ -1,138 +1,224 @@
+import io
+import multiprocessing
 import os
+import tempfile
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 from loguru import logger
 from redactors.base import FileRedactor
-from core.constants import Masks
-from core.util import one_way_hash_mask
+from core import redaction
+from core.constants import AnonymizationType
 
 from redactors.pdf_parser.map_pii import mapper
-from PyPDF2 import PdfFileReader, PdfFileWriter,PdfFileMerger
+from PyPDF2 import PdfFileReader, PdfFileWriter
 from redactors.pdf_parser import pdf_redactor
 
+PDF_REDACTION_WORKERS: int = int(os.getenv("PDF_REDACTION_WORKERS") or min(4, os.cpu_count() or 1))
+
+_page_executor: ProcessPoolExecutor = None
+_page_executor_pid: int = None
+_page_executor_lock: threading.Lock = threading.Lock()
+
+
+def get_page_executor() -> ProcessPoolExecutor:
+    """
+    Returns the process pool of the process that PDF pages are redacted in, creating it on first use. Its
+    PDF_REDACTION_WORKERS processes are shared by every request. They are started from a fork server (or spawned where
+    there is none) rather than forked from the server process, which runs request, purge and hashing threads.
+    :return: Executor
+    """
+    global _page_executor, _page_executor_pid
+
+    if _page_executor is None or _page_executor_pid != os.getpid():
+        with _page_executor_lock:
+            if _page_executor is None or _page_executor_pid != os.getpid():
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                _page_executor = ProcessPoolExecutor(max_workers=PDF_REDACTION_WORKERS, mp_context=context)
+                _page_executor_pid = os.getpid()
+
+    return _page_executor
+
+
+def reset_page_executor(executor: ProcessPoolExecutor) -> None:
+    """
+    Drops the shared pool if it is still executor, e.g. after one of its processes died, so the next request starts a
+    new one.
+    """
+    global _page_executor
+
+    with _page_executor_lock:
+        if _page_executor is executor:
+            _page_executor = None
+    executor.shutdown(wait=False)
+
+
 class TextFileRedactor(FileRedactor):
     def redact_file(self, file_name, permission_descriptions, markers, mask):
-        file = open(file_name, "r+").read()
+        policy = AnonymizationType.MASK if mask else AnonymizationType.REDACT
+        locations = redaction.redact_file(file_name, redaction.marker_spans(markers), permission_descriptions, policy)
 
-        total_diff: int = 0
-        i: int = 0
-        sorted_markers: list = sorted(
-            markers, key=lambda k: (k.start_location, -k.end_location)
-        )
+        # Return only the markers which are permitted
+        return redaction.apply_locations(markers, locations)
 
-        total_markers: int = len(sorted_markers)
+class PageSpool:
+    """
+    Page buffers of one request. Pages are kept in memory until the request holds limit bytes of them, the pages
+    stored after that are written to files in directory.
+    """
+    def __init__(self, directory: str, limit: int):
+        self.directory = directory
+        self.limit = limit
+        self.in_memory = 0
+        self.buffers = []
 
-        hash_pii_types: set = Masks.HASH_PII_TYPES
+    def store(self, data: bytes):
+        if self.in_memory + len(data) <= self.limit:
+            buffer = io.BytesIO(data)
+            self.in_memory += len(data)
+        else:
+            buffer = tempfile.TemporaryFile(dir=self.directory)
+            buffer.write(data)
+        self.buffers.append(buffer)
+        return buffer
 
-        redaction_text = (
-            "<REDACTED>"  # The PII's will be replaced with this text if not masked.
-        )
-        marker_to_be_excluded = []
-        
+    def close(self):
+        for buffer in self.buffers:
+            buffer.close()
+
+
+class PdfFileRedactor(FileRedactor):
+    def __init__(self, workers: int = None, spill_size: int = None):
         """
-        Below is the algorithm to modify the marker co-ordinates after replacing the PII values
-        with the Redaction text or a randomly generated Hash value.
+        :param workers: Pages of a request redacted at once, 1 redacts them in the request thread, defaults to
+        PDF_REDACTION_WORKERS. Pages are redacted in the shared pool of get_page_executor().
+        :param spill_size: Bytes of page buffers a request keeps in memory before spilling pages to disk, defaults to
+        PDF_SPILL_SIZE or 16 MiB
         """
-        
-        while i < len(sorted_markers):
-            marker_start = sorted_markers[i].start_location
-            marker_end = sorted_markers[i].end_location
-            j = i
-            last_end = i
-            permit = True
-            while (j < total_markers) and (
-                sorted_markers[j].start_location < marker_end
-            ):
-                if not permit:
-                    marker_to_be_excluded.append(j)
-                elif permit and (
-                    sorted_markers[j].pii_type not in permission_descriptions
-                ):
-                    permit = False
-                    for k in range(i, j + 1):
-                        marker_to_be_excluded.append(k)
-                if sorted_markers[j].end_location > marker_end:
-                    marker_end = sorted_markers[j].end_location
-                    last_end = j
-                j += 1
-            if not permit:
-                file_start, file_end = (
-                    marker_start - total_diff,
-                    marker_end - total_diff,
-                )
-                if (i == last_end) and mask:
-                    if sorted_markers[i].pii_type in hash_pii_types:
-                        masked_value = one_way_hash_mask(
-                            file[file_start:file_end], sorted_markers[i].pii_type
-                        )
-                    else:
-                        masked_value = redaction_text
+        self.workers = workers or PDF_REDACTION_WORKERS
+        self.spill_size = spill_size or int(os.getenv("PDF_SPILL_SIZE") or 16 * 1024 * 1024)
+
+    def redact_file(self, file_name, permission_descriptions, markers, mask, workers: int = None):
+        workers = workers or self.workers
+
+        # Bucket the redacted markers by page once rather than scanning every marker for every page
+        page_pii = defaultdict(list)
+        for marker in markers:
+            if marker.pii_type not in permission_descriptions:
+                page_pii[marker.page_number].append(self.format_marker(marker))
+
+        # Page buffers live in memory and only spill to this request's own directory once the request holds
+        # spill_size bytes of them
+        with open(file_name, "rb") as source, tempfile.TemporaryDirectory(prefix="pdf_redaction_") as spill_dir:
+            pdf = PdfFileReader(source)
+            total_pages = pdf.getNumPages()
+            spool = PageSpool(spill_dir, self.spill_size)
+            try:
+                # Only the pages with markers are split out and redacted, the others are copied as they are
+                marked_pages = [page for page in range(total_pages) if page_pii.get(page + 1)]
+                split_pages = []
+                for page in marked_pages:
+                    pdf_writer = PdfFileWriter()
+                    pdf_writer.addPage(pdf.getPage(page))
+                    output = io.BytesIO()
+                    pdf_writer.write(output)
+                    split_pages.append(spool.store(output.getvalue()))
+
+                # Pages are read back from their buffers only as they are handed to a worker
+                page_data = (self._read_buffer(buffer) for buffer in split_pages)
+                pii_by_page = [page_pii[page + 1] for page in marked_pages]
+
+                if workers > 1 and len(marked_pages) > 1:
+                    # Pages are independent, so they can be redacted in separate processes
+                    executor = get_page_executor()
+                    redacted = self._bounded_map(executor, self.redact_page, 2 * workers, page_data, pii_by_page)
+                    try:
+                        redacted_pages = dict(zip(marked_pages, (spool.store(data) for data in redacted)))
+                    except BrokenProcessPool:
+                        reset_page_executor(executor)
+                        raise
                 else:
-                    masked_value = redaction_text
-                marker_len = marker_end - marker_start
-                file = (masked_value).join([file[:file_start], file[file_end:]])
-                total_diff = total_diff + marker_len - len(masked_value)
-            else:
-                for k in range(i, j):
-                    sorted_markers[k].start_location -= total_diff
-                    sorted_markers[k].end_location -= total_diff
-            i = j
-        
-        """ Return only the markers which are permitted """
-       
-        modified_markers = [
-            marker
-            for i, marker in enumerate(sorted_markers)
-            if i not in marker_to_be_excluded
-        ]
+                    redacted = map(self.redact_page, page_data, pii_by_page)
+                    redacted_pages = dict(zip(marked_pages, (spool.store(data) for data in redacted)))
 
-        open(file_name, "w").write(file)
-        return modified_markers
-        
-class PdfFileRedactor(FileRedactor):
-    def redact_file(self, file_name, permission_descriptions, markers, mask):
-        pdf = PdfFileReader(file_name)
-        for page in range(pdf.getNumPages()):
-            pdf_writer = PdfFileWriter()
-            pdf_writer.addPage(pdf.getPage(page))
-            output_filename = 'page_{}.pdf'.format(
-                 page+1)
-            with open(output_filename, 'wb') as out:
-                pdf_writer.write(out)
-            dem_name = f'page_{page+1}.pdf'
-            with open(dem_name, 'r') as file:
+                # Pages are written back in page order, whichever order they finished in
+                pdf_writer = PdfFileWriter()
+                for page in range(total_pages):
+                    if page in redacted_pages:
+                        redacted_pages[page].seek(0)
+                        pdf_writer.addPage(PdfFileReader(redacted_pages[page]).getPage(0))
+                    else:
+                        pdf_writer.addPage(pdf.getPage(page))
+
+                # The output replaces the source, which is still being read from
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_name)), suffix=".pdf")
                 try:
-                    file_text,text_tok,document,text_layer = self.parse_file_to_text(file)
-                    current_page_pii = [self.format_marker(marker) for marker in markers if (marker.page_number == (page+1) and marker.pii_type not in permission_descriptions)]
-                    current_page_pii = mapper(file_text,text_tok,current_page_pii)
-                    self.parse_text_to_pdf(document, text_layer, current_page_pii, page) 
-                except Exception as e:
-                    os.system(f'mv page_{page+1}.pdf pager_{page+1}.pdf')
-                
-        mergedObject = PdfFileMerger()
-        for fileNumber in range(1, pdf.getNumPages()+1):
-            mergedObject.append(PdfFileReader('pager_' + str(fileNumber)+ '.pdf', 'rb'))
-        mergedObject.write(file_name)
-        for fileNumber in range(1,pdf.getNumPages()+1):
-            try :
-                f1 = f'page_{fileNumber}.pdf'
-                f2 = f'pager_{fileNumber}.pdf'
-                os.system(f'rm {f1}')
-                os.system(f'rm {f2}')
-            except :
-                continue
-            
+                    with os.fdopen(fd, "wb") as f:
+                        pdf_writer.write(f)
+                    os.replace(temp_path, file_name)
+                except BaseException:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    raise
+            finally:
+                spool.close()
+
         return markers
-    
+
+    def redact_page(self, page_data: bytes, current_page_pii: list) -> bytes:
+        """
+        Redacts a single page that has been split out of the document. The page is read once into memory, and both the
+        text layer and the rendered text the markers refer to are parsed from there, in the worker. Pages that cannot
+        be parsed are passed through unchanged.
+        :param page_data: Single-page PDF
+        :param current_page_pii: Formatted markers to redact on this page
+        :return: Redacted single-page PDF
+        """
+        try:
+            page = io.BytesIO(page_data)
+            page_text = "".join(pdf_redactor.render_text(page).values())
+            file_text,text_tok,document,text_layer = self.parse_file_to_text(page, page_text)
+            current_page_pii = mapper(file_text,text_tok,current_page_pii)
+            return self.parse_text_to_pdf(document, text_layer, current_page_pii)
+        except Exception as e:
+            return page_data
+
+    @staticmethod
+    def _read_buffer(buffer) -> bytes:
+        buffer.seek(0)
+        return buffer.read()
+
+    @staticmethod
+    def _bounded_map(executor: Executor, fn, window: int, *iterables):
+        """
+        Like executor.map(), but submits at most window calls ahead of the result being waited on, so the arguments
+        are consumed as results come back rather than all queued up front.
+        :return: Generator of the results, in order
+        """
+        in_flight = deque()
+        for args in zip(*iterables):
+            in_flight.append(executor.submit(fn, *args))
+            if len(in_flight) >= window:
+                yield in_flight.popleft().result()
+
+        while in_flight:
+            yield in_flight.popleft().result()
+
     def format_marker(self, marker):
         return {"pii_type": marker.pii_type, "start_location": marker.start_location,
                 "end_location": marker.end_location, "confidence": marker.confidence}
                 
-    def parse_text_to_pdf(self,document,text_layer,pii,page):
+    def parse_text_to_pdf(self,document,text_layer,pii) -> bytes:
         text_layer = pdf_redactor.update_text_with_pii(*text_layer,pii)
         document = pdf_redactor.apply_updated_text(document,*text_layer)
-        dem_name= f'pager_{page+1}.pdf'
-        pdf_redactor.write_pdf(document,dem_name) 
+        output = io.BytesIO()
+        pdf_redactor.write_pdf(document,output)
+        return output.getvalue()
         
-    def parse_file_to_text(self, file_obj) -> str:
+    def parse_file_to_text(self, file_obj, text_content: str = None) -> str:
         options = pdf_redactor.RedactorOptions()
         options.xmp_filters = [lambda xml: None]
         options.content_filters = [
@@ -141,7 +227,7 @@ class PdfFileRedactor(FileRedactor):
                 lambda m: "annotation?"
             )
         ]
-        output,text_tok,document,text_layer = pdf_redactor.redactor(options, file_obj.name)
+        output,text_tok,document,text_layer = pdf_redactor.redactor(options, file_obj, text_content)
         # logger.debug(f"Parsed text output : {output}")
         return output,text_tok,document,text_layer
 
@@ -5,7 +5,7 @@ from flask import request
 from flask_restful import Resource
 from loguru import logger
 
-from core.decorators import authenticate_token
+from core.decorators import authenticate_token, invalidate_api_key
 from db import db
 from models.auth.api_key import APIKeyModel
 from schemas.auth.api_key import APIKeySchema
@@ -30,12 +30,18 @@ class APIKeyCollection(Resource):
         # Delete the current key if it exists for the user
         current_key: APIKeyModel = APIKeyModel.query.filter_by(user_id=user_id).first()
 
+        stale_keys: list = [key_obj.api_key]
+
         if current_key:
+            stale_keys.append(current_key.api_key)
             db.session.delete(current_key)
 
         db.session.add(key_obj)
         db.session.commit()
 
+        for stale_key in stale_keys:
+            invalidate_api_key(stale_key)
+
         return api_key_schema.dump(raw_obj)
 
 
@@ -53,6 +59,7 @@ class APIKeyRevokeCollection(Resource):
         api_key.revoked = revoke_status
 
         db.session.commit()
+        invalidate_api_key(api_key.api_key)
 
         logger.info(f"User {user_id}: API token revoke status: {revoke_status}")
         return {"revoked": revoke_status}
@@ -10,6 +10,7 @@ from marshmallow import ValidationError
 from sendgrid.helpers.mail import Mail
 
 from core.errors import AuthenticationErrors
+from core.passwords import PasswordHasherBusy
 from core.errors import UserErrors
 from db import db
 from models.auth.user import UserModel
@@ -37,6 +38,11 @@ class Login(Resource):
 
             # Verify that password hashes match and update last login time to current
             if user.check_password(data.get("password")):
+                try:
+                    user.rehash_password(data.get("password"))  # Moves the hash to the configured cost
+                except PasswordHasherBusy:
+                    # The upgrade is best-effort, it is retried on the next login
+                    logger.warning(f"Password hasher busy, rehash of user {user.user_id} skipped")
                 user.last_login = datetime.datetime.now()
                 token: str = user.generate_auth_token().decode("utf-8")
                 db.session.commit()
@@ -49,6 +55,8 @@ class Login(Resource):
                 abort(400, AuthenticationErrors.INCORRECT_CREDS)
         except ValidationError as err:
             abort(422, err.messages)
+        except PasswordHasherBusy:
+            abort(429, AuthenticationErrors.PASSWORD_HASHER_BUSY)
 
 
 class ForgotPassword(Resource):
@@ -119,3 +127,5 @@ class ResetPassword(Resource):
             return
         except KeyError as err:
             abort(422, str(err))
+        except PasswordHasherBusy:
+            abort(429, AuthenticationErrors.PASSWORD_HASHER_BUSY)
@@ -4,7 +4,7 @@ from flask_restful import Resource
 
 from models.auth.util import add_invalid_token
 from models.auth.user import UserModel
-from core.decorators import authenticate_token
+from core.decorators import authenticate_token, invalidate_bearer_token
 
 from schemas.user import UserSchema
 
@@ -21,6 +21,7 @@ class Logout(Resource):
         if bearer_token:
             bearer_token = bearer_token.split(" ")[1]
             message: str = add_invalid_token(bearer_token, expiry)
+            invalidate_bearer_token(bearer_token)
         else:
             message: str = "Missing authentication header"
         
@@ -5,20 +5,18 @@ from flask_restful import Resource
 from loguru import logger
 from sqlalchemy.sql.expression import true
 
+from core import anonymized_copies
 from core import aws as aws_util
-from core.constants import AuditConstants, UserConstants
+from core.constants import AuditConstants, DatasetAccessKinds, UserConstants
 from core.decorators import authenticate_token
 from core.errors import DatasetErrors
 from db import db
-from models.associations import RoleDataset
 from models.audit.dataset_action_history import DatasetActionHistoryModel
-from models.auth.user import UserModel
+from models.datasets.access import DatasetAccessModel
 from models.datasets.base import DatasetModel
 from models.datasets.file import FileModel
 from models.job import JobModel
 from models.pii.pii import PIIModel
-from models.roles.role import RoleModel
-from models.roles.role_member import RoleMemberModel
 from resources.datasets import util as dataset_util
 from schemas.datasets.base import DatasetSchema
 from schemas.datasets.file import FileSchema
@@ -67,7 +65,7 @@ class Dataset(Resource):
     @authenticate_token
     def delete(self, user_id: int, dataset_id: int) -> tuple:
         """
-        Deletes a dataset from the system.
+        Deletes a dataset from the system. Its files and their anonymized copies are purged from S3 after the response.
         :param user_id: Currently logged in user ID.
         :param dataset_id: Dataset unique identifier to delete
         :return: None
@@ -84,11 +82,13 @@ class Dataset(Resource):
             abort(401, DatasetErrors.USER_DOES_NOT_OWN)
 
         files: list = dataset_util.retrieve_files(dataset_id)
-
-        for file_object in files:
-            aws_util.dataset_cleanup(file_object.location)
-
+        file_ids: list = [file_object.file_id for file_object in files]
+        file_locations: list = [file_object.location for file_object in files]
+        anonymized_copy_keys: list = anonymized_copies.invalidate(file_ids)
         dataset_util.delete_datasets([dataset_id])
+
+        # Objects are purged from S3 in the background, so the response does not wait on the number of files
+        aws_util.dataset_cleanup(file_locations, anonymized_copy_keys)
         return None, 202
 
 
@@ -100,42 +100,28 @@ class DatasetCollection(Resource):
     def get(self, user_id: int) -> list:
         """
         Returns a list of datasets that are owned by and shared with the currently logged in user.
-        Note: This will only return datasets that have been verified.
+        Note: Owned datasets are only returned once they have been verified.
         :param user_id: Currently logged in user ID
         :return: List of datasets
         """
-        logged_in_user: UserModel = UserModel.query.filter_by(user_id=user_id).first()
-        
-        all_datasets: list = []
-        
-        # Retrieve all datasets that the user owns
-        owned_datasets: list = DatasetModel.query.filter(
-            DatasetModel.verified == true(),
-            DatasetModel.owners.contains(logged_in_user),
-        ).all()
-        
-        owned_datasets_json: list = dataset_schema.dump(owned_datasets, many=True)
-        owned_dataset_ids: list = [
-            dataset.get("dataset_id") for dataset in owned_datasets_json
-        ]
-        for dataset in owned_datasets_json:
-            dataset["permission"] = "owned"
-        all_datasets.extend(owned_datasets_json)
-        
-        # Retrieve datasets the user may access via role permissions
-        shared: list = (
-            DatasetModel.query.join(RoleDataset)
-            .join(RoleModel)
-            .join(RoleMemberModel)
-            .filter(RoleMemberModel.user_id == user_id)
+        # Owned datasets first, shared datasets are listed whether verified or not
+        rows: list = (
+            db.session.query(DatasetModel, DatasetAccessModel.access_kind)
+            .join(DatasetAccessModel, DatasetAccessModel.dataset_id == DatasetModel.dataset_id)
+            .filter(
+                DatasetAccessModel.user_id == user_id,
+                (DatasetAccessModel.access_kind == DatasetAccessKinds.SHARED) | (DatasetModel.verified == true()),
+            )
+            .order_by(DatasetAccessModel.access_kind != DatasetAccessKinds.OWNED)
+            .all()
         )
-        
-        shared_json = dataset_schema.dump(shared, many=True)
-        for dataset in shared_json:
-            if dataset.get("dataset_id") not in owned_dataset_ids:
-                dataset["permission"] = "shared"
-                all_datasets.append(dataset)
-        
+
+        all_datasets: list = []
+        for dataset, access_kind in rows:
+            dataset_json: dict = dataset_schema.dump(dataset)
+            dataset_json["permission"] = access_kind
+            all_datasets.append(dataset_json)
+
         return all_datasets
 
 
@@ -166,6 +152,9 @@ class DatasetVerification(Resource):
             if not dataset.verified:
                 dataset.verified = True
 
+                # Copies indexed before the upload was verified may have been made from an older object
+                aws_util.invalidate_anonymized_copies([file.file_id for file in dataset.files])
+
                 job: JobModel = JobModel(dataset.dataset_id)
                 db.session.add(job)
                 db.session.commit()
@@ -8,26 +8,29 @@ from loguru import logger
 from marshmallow import ValidationError
 from sqlalchemy.exc import IntegrityError
 
+from core import anonymized_copies
 from core.aws import generate_presigned_download_link, generate_presigned_link
-from core.constants import AuditConstants
+from core.constants import AuditConstants, DatasetAccessKinds
 from core.decorators import authenticate_token
 from core.errors import FileErrors
 from db import db
 from models.audit.dataset_action_history import DatasetActionHistoryModel
 from models.auth.user import UserModel
-from models.datasets.base import DatasetModel
+from models.datasets.access import DatasetAccessModel
 from models.datasets.file import FileModel
 from resources.datasets import util as dataset_util
 from models.pii.marker_character import PIIMarkerCharacterModel
 from models.pii.marker_image import PIIMarkerImageModel
 from schemas.datasets.base import DatasetSchema
 from schemas.datasets.file import FileSchema
+from schemas.pii.marker_base import PIIMarkerSchema
 from schemas.pii.marker_image import PIIMarkerImageSchema
 from schemas.pii.marker_character import PIIMarkerCharacterSchema
 from core.constants import SupportedFiles
 
 file_schema = FileSchema()
 dataset_schema = DatasetSchema()
+marker_schema = PIIMarkerSchema()
 
 
 class FlatFileCollection(Resource):
@@ -117,38 +120,31 @@ class File(Resource):
         :param user_id: User ID requesting the file object
         :param dataset_id: Dataset ID that the file belongs to
         :param file_id: Unique file identifier
-        :return: File object
+        :return: File object, or a pending message with status 202 if its anonymized copy is still being generated
         """
         file: typing.Optional[FileModel] = None
-        dataset: typing.Optional[DatasetModel] = None
 
         try:
             file: FileModel = dataset_util.retrieve_file(file_id, dataset_id)
-            dataset: DatasetModel = dataset_util.retrieve_dataset(dataset_id)
+            dataset_util.retrieve_dataset(dataset_id)  # Only for its 404
         except ValueError as e:
             logger.error(e.args)
             abort(404, e.args[0])
         
-        # Determine if the user requesting is an owner
-        is_owner: bool = dataset_util.check_dataset_ownership(dataset, user_id)
+        # One lookup in the access index tells whether the user owns the dataset or which PII types they may see
+        access: typing.Optional[DatasetAccessModel] = dataset_util.retrieve_access(dataset_id, user_id)
+
+        if access is None:
+            abort(401, FileErrors.DOES_NOT_HAVE_PERMISSION)
 
         markers: list = file.markers
         filepath: str = urlparse(file.location).path[1:]
         _, ext = os.path.splitext(filepath)
-        
-        if is_owner:
+
+        if access.access_kind == DatasetAccessKinds.OWNED:
             permissions: list = [marker.pii_type for marker in markers]
         else:
-            is_shared, roles = dataset_util.check_dataset_role_permissions(dataset_id, user_id)
-
-            if not is_shared:
-                abort(401, FileErrors.DOES_NOT_HAVE_PERMISSION)
-
-            perm_list: list = []
-            for role in roles:
-                perm_list.extend(role.permissions)
-
-            permissions: list = [{x.description for x in perm_list}]
+            permissions: list = access.permissions
 
         if ext in SupportedFiles.CHARACTER_BASED:
             markers = PIIMarkerCharacterModel.query.filter_by(file_id=file_id).all()
@@ -160,10 +156,18 @@ class File(Resource):
         logger.debug(markers)
         logger.debug(permissions)
 
-        file.location, file.markers = generate_presigned_download_link(filepath=filepath, markers=markers,
-                                                                       permissions=permissions)
-
-        logger.debug(file.markers)
-
-        return file_schema.dump(file)
+        try:
+            location, permitted_markers = generate_presigned_download_link(file_id=file_id, filepath=filepath,
+                                                                           markers=markers, permissions=permissions)
+        except anonymized_copies.CopyPending:
+            # Another request is still generating the same anonymized copy
+            return {"message": FileErrors.ANONYMIZATION_PENDING}, 202, {"Retry-After": "1"}
+
+        logger.debug(permitted_markers)
+
+        # The file row is left untouched, the link and the moved markers only go into the response
+        response: dict = file_schema.dump(file)
+        response["location"] = location
+        response["markers"] = marker_schema.dump(permitted_markers, many=True)
+        return response
 
@@ -6,13 +6,12 @@ import requests
 from sqlalchemy import orm
 from sqlalchemy.sql import true
 
+from core.constants import DatasetAccessKinds
 from core.errors import DatasetErrors, FileErrors
 from db import db
-from models.associations import RoleDataset
+from models.datasets.access import DatasetAccessModel
 from models.datasets.base import DatasetModel
 from models.datasets.file import FileModel
-from models.roles.role import RoleModel
-from models.roles.role_member import RoleMemberModel
 
 JOB_URL = f'http://{os.getenv("MODEL_HOST")}:{os.getenv("MODEL_PORT")}/predict/file'
 
@@ -23,20 +22,43 @@ def check_dataset_ownership(dataset: DatasetModel, user_id: int) -> bool:
     return user_id in {x.user_id for x in dataset.owners}
 
 
+def retrieve_access(dataset_id: int, user_id: int) -> typing.Optional[DatasetAccessModel]:
+    """
+    Looks up the access a user has to a dataset in the dataset access index.
+    :param dataset_id: Dataset identifier to be accessed
+    :param user_id: User ID requesting access
+    :return: Access row, None if the user neither owns the dataset nor has it shared through a role
+    """
+    return DatasetAccessModel.query.filter_by(user_id=user_id, dataset_id=dataset_id).first()
+
+
 def check_dataset_role_permissions(dataset_id: int, user_id: int) -> tuple:
     """
-    Check if the user is a member of a role that has access to a dataset.
+    Check if the user is a member of a role that has access to a dataset. Owners are reported as not shared, ownership
+    should be checked first.
     :param dataset_id: Dataset identifier to be accessed
     :param user_id: User ID requesting permission
-    :return: Boolean representing authorization
+    :return: Boolean representing authorization, and the sorted PII types the user's roles permit on the dataset
     """
     logger.info(f"Checking permissions on dataset {dataset_id} for user {user_id}...")
 
-    # Generate a list of roles that the user is a member of and that have access to the requested dataset
-    roles: list = RoleModel.query.join(RoleMemberModel).join(RoleDataset)\
-        .filter((user_id == user_id) & (dataset_id == dataset_id)).all()
+    access: typing.Optional[DatasetAccessModel] = retrieve_access(dataset_id, user_id)
 
-    return len(roles) > 0, roles
+    if access is None or access.access_kind != DatasetAccessKinds.SHARED:
+        return False, []
+
+    return True, access.permissions
+
+
+def owned_dataset_ids(user_id: int) -> list:
+    """
+    :param user_id: User ID to list the datasets of
+    :return: IDs of the datasets the user owns
+    """
+    rows: list = db.session.query(DatasetAccessModel.dataset_id).filter_by(
+        user_id=user_id, access_kind=DatasetAccessKinds.OWNED
+    ).all()
+    return [dataset_id for dataset_id, in rows]
 
 
 def delete_datasets(dataset_ids: list) -> None:
@@ -46,6 +68,8 @@ def delete_datasets(dataset_ids: list) -> None:
     :return: None
     """
     logger.info(f"Deleting datasets: {dataset_ids}")
+    # The bulk delete skips the flush, so the access rows are dropped here rather than left to the foreign key cascade
+    DatasetAccessModel.query.filter(DatasetAccessModel.dataset_id.in_(dataset_ids)).delete(synchronize_session=False)
     DatasetModel.query.filter(DatasetModel.dataset_id.in_(dataset_ids)).delete(synchronize_session=False)
     db.session.commit()
 
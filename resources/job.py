@@ -9,10 +9,10 @@ from sqlalchemy.orm.exc import UnmappedInstanceError
 from core.constants import UserConstants
 from core.decorators import authenticate_token
 from db import db
-from models.associations import DatasetOwner
 from models.auth.user import UserModel
 from models.datasets.base import DatasetModel
 from models.job import JobModel
+from resources.datasets import util as dataset_util
 from schemas.job import JobSchema
 
 job_schema = JobSchema()
@@ -26,13 +26,7 @@ class JobCollection(Resource):
         :param user_id: Currently logged in user.
         :return: List of jobs.
         """
-        datasets_owned = [
-            dataset.dataset_id
-            for dataset in DatasetModel.query.join(DatasetOwner)
-                .join(UserModel)
-                .filter((UserModel.user_id == user_id))
-                .all()
-        ]
+        datasets_owned = dataset_util.owned_dataset_ids(user_id)
         user = UserModel.query.filter_by(user_id=user_id).first()
         
         job_status = request.args.get("status")
@@ -70,13 +64,7 @@ class JobCollection(Resource):
         try:
             data = request.get_json(force=True)
             
-            datasets_owned = [
-                dataset.dataset_id
-                for dataset in DatasetModel.query.join(DatasetOwner)
-                    .join(UserModel)
-                    .filter((UserModel.user_id == user_id))
-                    .all()
-            ]
+            datasets_owned = dataset_util.owned_dataset_ids(user_id)
             
             job = job_schema.load(data)
             
@@ -118,13 +106,7 @@ class Job(Resource):
             abort(404, "Job not found.")
         
         if user_id != UserConstants.MODEL:
-            datasets_owned = [
-                dataset.dataset_id
-                for dataset in DatasetModel.query.join(DatasetOwner)
-                    .join(UserModel)
-                    .filter((UserModel.user_id == user_id))
-                    .all()
-            ]
+            datasets_owned = dataset_util.owned_dataset_ids(user_id)
             
             user = UserModel.query.filter_by(user_id=user_id).first()
             
@@ -147,13 +129,7 @@ class Job(Resource):
             abort(404, "Job not found.")
         
         if user_id != UserConstants.MODEL:
-            datasets_owned = [
-                dataset.dataset_id
-                for dataset in DatasetModel.query.join(DatasetOwner)
-                    .join(UserModel)
-                    .filter((UserModel.user_id == user_id))
-                    .all()
-            ]
+            datasets_owned = dataset_util.owned_dataset_ids(user_id)
             
             user = UserModel.query.filter_by(user_id=user_id).first()
             
@@ -178,13 +154,7 @@ class Job(Resource):
         try:
             job = job_schema.load(request.get_json(force=True))
             
-            datasets_owned = [
-                dataset.dataset_id
-                for dataset in DatasetModel.query.join(DatasetOwner)
-                    .join(UserModel)
-                    .filter((UserModel.user_id == user_id))
-                    .all()
-            ]
+            datasets_owned = dataset_util.owned_dataset_ids(user_id)
             user = UserModel.query.filter_by(user_id=user_id).first()
             
             if not job:
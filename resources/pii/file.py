@@ -7,6 +7,7 @@ from marshmallow import ValidationError
 from sqlalchemy.exc import IntegrityError
 from urllib.parse import urlparse
 
+from core import aws as aws_util
 from core.constants import SupportedFiles
 from core.decorators import authenticate_token
 from core.errors import DatasetErrors
@@ -58,6 +59,7 @@ class FilePIICollection(Resource):
                 db.session.add(pii)
 
             db.session.commit()
+            aws_util.invalidate_anonymized_copies([file_id])
         except ValidationError as err:
             abort(422, err.messages)
         except IntegrityError as err:
@@ -120,6 +122,7 @@ class FilePII(Resource):
                 elif ext in SupportedFiles.IMAGE_BASED:
                     PIIMarkerImageModel.query.filter_by(pii_id=marker_id).delete()
                 db.session.commit()
+                aws_util.invalidate_anonymized_copies([file_id])
                 return None, 200
         except ValidationError as err:
             abort(422, err.messages)
@@ -154,6 +157,7 @@ class FilePII(Resource):
                 pii.confidence = data.get("confidence", pii.confidence)
                 
                 db.session.commit()
+                aws_util.invalidate_anonymized_copies([file_id])
             
             return file_pii_schema.dump(pii)
         except ValidationError as err:
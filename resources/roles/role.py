@@ -5,6 +5,7 @@ from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import UnmappedInstanceError
 from sqlalchemy.sql.expression import true
 
+from core import dataset_access
 from core.decorators import authenticate_token
 from core.errors import RoleErrors
 from db import db
@@ -117,6 +118,11 @@ class Role(Resource):
                 )
 
         db.session.commit()
+
+        if "owners" in data:
+            # The previous owners were removed by a bulk delete, which the access index does not see
+            dataset_access.refresh(dataset_ids=[dataset.dataset_id for dataset in role.datasets])
+
         return role_schema.dump(role)
 
     @authenticate_token
@@ -128,11 +134,13 @@ class Role(Resource):
         :return: None
         """
         try:
-            self.retrieve_role(role_id=role_id, user_id=user_id)
+            role = self.retrieve_role(role_id=role_id, user_id=user_id)
+            dataset_ids = [dataset.dataset_id for dataset in role.datasets]
 
             RoleModel.query.filter_by(role_id=role_id).delete()
 
             db.session.commit()
+            dataset_access.refresh(dataset_ids=dataset_ids)
             return
         except UnmappedInstanceError as err:
             db.session.rollback()
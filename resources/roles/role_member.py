@@ -5,6 +5,7 @@ from flask_restful import Resource
 from marshmallow import ValidationError
 from sqlalchemy.exc import IntegrityError
 
+from core import dataset_access
 from core.decorators import authenticate_token
 from core.errors import RoleErrors
 from db import db
@@ -105,6 +106,9 @@ class RoleMemberCollection(Resource):
             role.updated_ts = datetime.datetime.now()
             
             db.session.commit()
+
+            # The previous members were removed by a bulk delete, which the access index does not see
+            dataset_access.refresh(dataset_ids=[dataset.dataset_id for dataset in role.datasets])
             
             role_datasets = flat_file_schema.dump(role.datasets, many=True)
             
@@ -138,6 +142,7 @@ class RoleMemberCollection(Resource):
         ).delete(synchronize_session="fetch")
         role.updated_ts = datetime.datetime.now()
         db.session.commit()
+        dataset_access.refresh(user_ids=all_members)
         return
     
     @staticmethod
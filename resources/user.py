@@ -5,7 +5,8 @@ from sqlalchemy import or_
 
 from core.constants import UserConstants
 from core.decorators import authenticate_token
-from core.errors import UserErrors
+from core.errors import AuthenticationErrors, UserErrors
+from core.passwords import PasswordHasherBusy
 from db import db
 from models.auth.user import UserModel
 from schemas.user import UserSchema
@@ -66,6 +67,8 @@ class UserCollection(Resource):
             return None, 201
         except ValidationError as err:
             abort(422, err.messages)
+        except PasswordHasherBusy:
+            abort(429, AuthenticationErrors.PASSWORD_HASHER_BUSY)
 
 
 class User(Resource):
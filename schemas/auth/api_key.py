@@ -6,4 +6,5 @@ class APIKeySchema(ma.SQLAlchemyAutoSchema):
     class Meta:
         model = APIKeyModel
         include_fk = True
+        load_instance = True
         ordered = True
@@ -0,0 +1,161 @@
+"""
+Latency of authorizing a user on a dataset by joining role_member, role_dataset and role_permissions, as
+check_dataset_role_permissions used to do, against one lookup in the dataset_access index, for a user who is a member of
+a growing number of roles. Also times listing the user's datasets both ways, and the incremental maintenance of the
+index when the user joins one more role. Runs against a throwaway SQLite database.
+
+Run from the repository root:
+    python -m scripts.benchmarks.dataset_access
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from flask import Flask
+
+from core import dataset_access
+from db import db
+from models.associations import DatasetOwner, RoleDataset, RolePermission
+from models.auth.user import UserModel
+from models.datasets.access import DatasetAccessModel
+from models.datasets.base import DatasetModel
+from models.pii.pii import PIIModel
+from models.roles.role import RoleModel
+from models.roles.role_member import RoleMemberModel
+
+DATASET_COUNT: int = 2000
+PII_TYPES: list = ["ssn", "name", "address", "phone", "email"]
+USER_ID: int = 1  # Member of every role
+CREATOR_ID: int = 2  # Creates the roles and owns the datasets
+
+
+def create_app(path: str) -> Flask:
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    return app
+
+
+def populate(role_count: int) -> None:
+    db.drop_all()
+    db.create_all()
+
+    connection = db.session.connection()
+    connection.execute(UserModel.__table__.insert(), [
+        {"user_id": user_id, "first_name": "Bench", "last_name": str(user_id), "email": f"{user_id}@example.com",
+         "password": "-", "admin": False}
+        for user_id in (USER_ID, CREATOR_ID)
+    ])
+    connection.execute(PIIModel.__table__.insert(), [
+        {"pii_id": pii_id, "description": description, "long_description": description, "category": "Identity"}
+        for pii_id, description in enumerate(PII_TYPES, 1)
+    ])
+    connection.execute(DatasetModel.__table__.insert(), [
+        {"dataset_id": dataset_id, "dataset_name": f"dataset {dataset_id}", "dataset_type": "FLAT_FILE",
+         "uploader": CREATOR_ID, "verified": True}
+        for dataset_id in range(1, DATASET_COUNT + 1)
+    ])
+    connection.execute(DatasetOwner.insert(), [
+        {"dataset_id": dataset_id, "owner_id": CREATOR_ID} for dataset_id in range(1, DATASET_COUNT + 1)
+    ])
+    connection.execute(RoleModel.__table__.insert(), [
+        {"role_id": role_id, "creator_id": CREATOR_ID, "role_name": f"role {role_id}", "individual_role": False}
+        for role_id in range(1, role_count + 1)
+    ])
+    connection.execute(RoleMemberModel.__table__.insert(), [
+        {"role_id": role_id, "user_id": user_id, "is_owner": user_id == CREATOR_ID}
+        for role_id in range(1, role_count + 1) for user_id in (USER_ID, CREATOR_ID)
+    ])
+    # Each role is shared on two datasets and permits one PII type
+    connection.execute(RoleDataset.insert(), [
+        {"role_id": role_id, "dataset_id": (role_id + offset) % DATASET_COUNT + 1}
+        for role_id in range(1, role_count + 1) for offset in (0, DATASET_COUNT // 2)
+    ])
+    connection.execute(RolePermission.insert(), [
+        {"role_id": role_id, "pii_id": role_id % len(PII_TYPES) + 1} for role_id in range(1, role_count + 1)
+    ])
+    db.session.commit()
+
+    dataset_access.rebuild()
+
+
+def join_check(dataset_id: int) -> tuple:
+    owned: bool = db.session.query(DatasetOwner.c.id).filter(
+        DatasetOwner.c.owner_id == USER_ID, DatasetOwner.c.dataset_id == dataset_id
+    ).first() is not None
+    rows: list = db.session.query(PIIModel.description).select_from(RoleMemberModel).join(
+        RoleDataset, RoleDataset.c.role_id == RoleMemberModel.role_id
+    ).outerjoin(RolePermission, RolePermission.c.role_id == RoleMemberModel.role_id).outerjoin(
+        PIIModel, PIIModel.pii_id == RolePermission.c.pii_id
+    ).filter(RoleMemberModel.user_id == USER_ID, RoleDataset.c.dataset_id == dataset_id).all()
+    return owned, sorted({description for description, in rows if description is not None})
+
+
+def index_check(dataset_id: int) -> tuple:
+    access: DatasetAccessModel = DatasetAccessModel.query.filter_by(user_id=USER_ID, dataset_id=dataset_id).first()
+    return access.access_kind, access.permissions
+
+
+def join_list() -> list:
+    return db.session.query(DatasetModel).join(RoleDataset).join(
+        RoleMemberModel, RoleMemberModel.role_id == RoleDataset.c.role_id
+    ).filter(RoleMemberModel.user_id == USER_ID).all()
+
+
+def index_list() -> list:
+    return db.session.query(DatasetModel).join(
+        DatasetAccessModel, DatasetAccessModel.dataset_id == DatasetModel.dataset_id
+    ).filter(DatasetAccessModel.user_id == USER_ID).all()
+
+
+def join_role(role_count: int) -> None:
+    # One more role for the user, maintained in the index by the flush listener
+    role = RoleModel(CREATOR_ID, f"role {role_count + 1}")
+    role.datasets = [DatasetModel.query.get(1)]
+    db.session.add(role)
+    db.session.flush()
+    db.session.add(RoleMemberModel(role.role_id, USER_ID))
+    db.session.flush()
+    db.session.rollback()
+
+
+def measure(func, iterations: int, *args) -> tuple:
+    timings: list = []
+    for _ in range(iterations):
+        db.session.expunge_all()
+        start: float = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.mean(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+def run(role_counts: list, iterations: int) -> None:
+    print(f"{'roles':>6} {'operation':>10} {'mode':>6} {'mean (ms)':>10} {'p99 (ms)':>10}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(os.path.join(directory, "access.db"))
+
+        with app.app_context():
+            for role_count in role_counts:
+                populate(role_count)
+                dataset_id: int = role_count % DATASET_COUNT + 1  # Shared with the user by at least one role
+                assert set(join_check(dataset_id)[1]) == set(index_check(dataset_id)[1])
+
+                rows: list = [
+                    ("check", "join", measure(join_check, iterations, dataset_id)),
+                    ("check", "index", measure(index_check, iterations, dataset_id)),
+                    ("list", "join", measure(join_list, max(1, iterations // 10))),
+                    ("list", "index", measure(index_list, max(1, iterations // 10))),
+                    ("join role", "index", measure(join_role, max(1, iterations // 10), role_count)),
+                ]
+                for operation, mode, (mean, p99) in rows:
+                    print(f"{role_count:>6} {operation:>10} {mode:>6} {mean:>10.3f} {p99:>10.3f}")
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.getcwd())
+    run(role_counts=[10, 100, 1000, 5000], iterations=200)
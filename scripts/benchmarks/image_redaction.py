@@ -0,0 +1,72 @@
+"""
+Peak memory of ImageRedactor on PDFs of growing page count, rasterizing one page at a time against rasterizing every
+page up front. Each run happens in a fresh process so that its peak RSS is measured in isolation. pdf2image needs
+poppler (pdftoppm) on the PATH.
+
+Run from the repository root:
+    python -m scripts.benchmarks.image_redaction
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from PIL import Image
+
+PAGE_SIZE: tuple = (1275, 1650)  # Letter at 150 dpi
+
+
+def generate_pdf(path: str, page_count: int) -> None:
+    pages = [Image.new("RGB", PAGE_SIZE, "white") for _ in range(page_count)]
+    pages[0].save(path, save_all=True, append_images=pages[1:], resolution=150)
+
+
+def rss_mb(usage) -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def redact(pdf_path: str, window: int, results) -> None:
+    from core.anon import ImageRedactor
+
+    start: float = time.perf_counter()
+    redactor = ImageRedactor(pdf_path, window=window)
+    # One marker per page, so that every page is rasterized
+    markers = [SimpleNamespace(x1=100, y1=100, x2=800, y2=200, page_number=page + 1)
+               for page in range(redactor.page_count)]
+    redactor.redact(pdf_path + ".out.pdf", markers)
+    elapsed: float = time.perf_counter() - start
+
+    results.put((elapsed, rss_mb(resource.getrusage(resource.RUSAGE_SELF)),
+                 rss_mb(resource.getrusage(resource.RUSAGE_CHILDREN))))
+
+
+def measure(pdf_path: str, window: int) -> tuple:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=redact, args=(pdf_path, window, results))
+    process.start()
+    result: tuple = results.get()
+    process.join()
+    return result
+
+
+def run(page_counts: list) -> None:
+    print(f"{'pages':>6} {'mode':>10} {'time (s)':>10} {'peak RSS (MB)':>14} {'poppler RSS (MB)':>17}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for page_count in page_counts:
+            pdf_path: str = os.path.join(directory, f"pages_{page_count}.pdf")
+            generate_pdf(pdf_path, page_count)
+
+            for mode, window in (("streaming", 1), ("eager", page_count)):
+                elapsed, peak, children = measure(pdf_path, window)
+                print(f"{page_count:>6} {mode:>10} {elapsed:>10.2f} {peak:>14.1f} {children:>17.1f}")
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.getcwd())
+    run(page_counts=[1, 5, 20, 50])
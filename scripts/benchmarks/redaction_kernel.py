@@ -0,0 +1,67 @@
+"""
+Micro-benchmarks for the redaction kernel at 1k, 100k and 1M markers.
+
+Run from the repository root:
+    python -m scripts.benchmarks.redaction_kernel
+"""
+import io
+import random
+import time
+
+from core import redaction
+from core.constants import AnonymizationType
+
+PII_TYPES: list = ["ssn", "name", "email", "address", "city", "usa_phone"]
+PERMISSIONS: frozenset = frozenset({"name", "city"})
+CHARACTERS_PER_MARKER: int = 40
+
+
+def generate_case(marker_count: int, overlap_ratio: float = 0.1, seed: int = 0) -> tuple:
+    """
+    Generates a text with roughly CHARACTERS_PER_MARKER characters per marker, where a share of the markers overlaps
+    the previous one.
+    :param marker_count: Number of markers to generate
+    :param overlap_ratio: Share of markers that overlap their predecessor
+    :param seed: Random seed
+    :return: Tuple of text and list of (start, end, pii_type) spans
+    """
+    rng = random.Random(seed)
+    text: str = "".join(rng.choices("abcdefghij0123456789 \n", k=marker_count * CHARACTERS_PER_MARKER))
+
+    spans: list = []
+    start: int = 0
+    for _ in range(marker_count):
+        if spans and rng.random() < overlap_ratio:
+            start = spans[-1][0] + rng.randint(0, 4)
+        else:
+            start += rng.randint(10, CHARACTERS_PER_MARKER)
+        spans.append((start, start + rng.randint(4, 16), rng.choice(PII_TYPES)))
+
+    rng.shuffle(spans)
+    return text, spans
+
+
+def time_call(func, *args, **kwargs) -> float:
+    start: float = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def run(marker_counts: list) -> None:
+    print(f"{'markers':>10} {'redact (s)':>12} {'mask (s)':>12} {'stream (s)':>12} {'per marker (us)':>16}")
+
+    for marker_count in marker_counts:
+        text, spans = generate_case(marker_count)
+
+        redact_time: float = time_call(redaction.redact_text, text, spans, PERMISSIONS, AnonymizationType.REDACT)
+        mask_time: float = time_call(redaction.redact_text, text, spans, PERMISSIONS, AnonymizationType.MASK)
+        stream_time: float = time_call(
+            redaction.redact_stream, io.StringIO(text), io.StringIO(), spans, PERMISSIONS, AnonymizationType.REDACT
+        )
+
+        per_marker: float = redact_time / marker_count * 1e6
+        print(f"{marker_count:>10} {redact_time:>12.4f} {mask_time:>12.4f} {stream_time:>12.4f} {per_marker:>16.2f}")
+
+
+if __name__ == "__main__":
+    run(marker_counts=[1_000, 100_000, 1_000_000])
@@ -0,0 +1,71 @@
+"""
+Latency of S3 calls through a client created per call, as core.aws used to do, against the shared client returned by
+core.aws.get_s3_client(), and of presigning through the URL cache of core.aws. S3 is stood in for by moto
+(pip install moto), so the numbers measure client-side overhead rather than network time.
+
+Run from the repository root:
+    python -m scripts.benchmarks.s3_client
+"""
+import os
+import statistics
+import time
+
+import boto3
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
+
+from core import aws
+
+BUCKET: str = "benchmark-bucket"
+KEY: str = "datasets/file.csv"
+
+
+def per_call_client():
+    return boto3.client("s3", aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"))
+
+
+def head(get_client) -> None:
+    get_client().head_object(Bucket=BUCKET, Key=KEY)
+
+
+def presign(get_client) -> None:
+    get_client().generate_presigned_url("get_object", Params={"Bucket": BUCKET, "Key": KEY}, ExpiresIn=3600)
+
+
+def cached_presign(get_client) -> None:
+    aws.cached_presigned_url(BUCKET, KEY, "get_object", 3600, lambda: presign(get_client))
+
+
+def measure(func, get_client, iterations: int) -> tuple:
+    timings: list = []
+    for _ in range(iterations):
+        start: float = time.perf_counter()
+        func(get_client)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.mean(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+def run(iterations: int) -> None:
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    with mock_aws():
+        aws.reset_s3_client()
+        aws.get_s3_client().create_bucket(Bucket=BUCKET)
+        aws.get_s3_client().put_object(Bucket=BUCKET, Key=KEY, Body=b"id,name\n1,Jane Doe\n")
+
+        print(f"{'call':>10} {'client':>10} {'mean (ms)':>10} {'p99 (ms)':>10}")
+        for name, func in (("head", head), ("presign", presign), ("cached", cached_presign)):
+            for client_name, get_client in (("per call", per_call_client), ("shared", aws.get_s3_client)):
+                mean, p99 = measure(func, get_client, iterations)
+                print(f"{name:>10} {client_name:>10} {mean:>10.2f} {p99:>10.2f}")
+
+
+if __name__ == "__main__":
+    run(iterations=200)
@@ -0,0 +1,79 @@
+"""
+Benchmarks text redaction against marker count and file size.
+
+Run from the repository root:
+    python -m scripts.benchmarks.text_redaction
+"""
+import random
+import time
+from types import SimpleNamespace
+
+from core import redaction
+from core.intervals import MarkerIntervalIndex
+
+PII_TYPES: list = ["ssn", "name", "email", "address", "city"]
+PERMISSIONS: list = ["name", "city"]
+
+
+def generate_case(file_size: int, marker_count: int, seed: int = 0) -> tuple:
+    """
+    Generates a random text and non-overlapping markers spread evenly through it.
+    :param file_size: Number of characters in the text
+    :param marker_count: Number of markers to generate
+    :param seed: Random seed
+    :return: Tuple of text and list of markers
+    """
+    rng = random.Random(seed)
+    text: str = "".join(rng.choices("abcdefghij0123456789 \n", k=file_size))
+
+    stride: int = max(file_size // max(marker_count, 1), 2)
+    markers: list = []
+    for start in range(0, file_size - 1, stride)[:marker_count]:
+        end: int = min(start + rng.randint(1, max(stride - 1, 1)), file_size)
+        markers.append(SimpleNamespace(start_location=start, end_location=end, pii_type=rng.choice(PII_TYPES)))
+
+    return text, markers
+
+
+def legacy_redact_text(text: str, markers: list, permission_descriptions) -> str:
+    """
+    Previous implementation, which rebuilt the whole string once per redacted interval.
+    """
+    index: MarkerIntervalIndex = MarkerIntervalIndex(markers)
+    total_diff: int = 0
+
+    for interval in index.intervals:
+        if all(marker.pii_type in permission_descriptions for marker in index.members(interval)):
+            continue
+        file_start, file_end = interval.start - total_diff, interval.end - total_diff
+        text = redaction.REDACTION_TEXT.join([text[:file_start], text[file_end:]])
+        total_diff += (interval.end - interval.start) - len(redaction.REDACTION_TEXT)
+
+    return text
+
+
+def time_call(func, *args) -> float:
+    start: float = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def run(file_sizes: list, marker_counts: list, include_legacy: bool = True) -> None:
+    print(f"{'file size':>12} {'markers':>10} {'span builder (s)':>18} {'legacy (s)':>12}")
+
+    for file_size in file_sizes:
+        for marker_count in marker_counts:
+            text, markers = generate_case(file_size, marker_count)
+
+            new_time: float = time_call(redaction.redact_text, text, redaction.marker_spans(markers), PERMISSIONS)
+
+            legacy_time: str = "-"
+            if include_legacy:
+                text, markers = generate_case(file_size, marker_count)
+                legacy_time = f"{time_call(legacy_redact_text, text, markers, PERMISSIONS):.4f}"
+
+            print(f"{file_size:>12} {marker_count:>10} {new_time:>18.4f} {legacy_time:>12}")
+
+
+if __name__ == "__main__":
+    run(file_sizes=[100_000, 1_000_000, 5_000_000], marker_counts=[100, 1_000, 10_000])
@@ -0,0 +1,74 @@
+import datetime
+import json
+
+import pytest
+
+from core import decorators
+from models.auth import util as auth_util
+from models.auth.user import UserModel
+from tests.conftest import dataset_route, generate_auth_headers
+
+
+@pytest.fixture(autouse=True)
+def auth_cache():
+    decorators.auth_cache.clear()
+    yield decorators.auth_cache
+    decorators.auth_cache.clear()
+
+
+def test_bearer_token_verified_once(client, db_session, mocker):
+    """Verifies that a repeat caller's bearer token is served from the cache instead of being verified again."""
+    headers = generate_auth_headers(client, user_id=3)
+    verify = mocker.spy(UserModel, "verify_auth_token_signature")
+    before = decorators.auth_cache_stats()
+
+    assert 200 == client.get(f"{dataset_route}/1", headers=headers).status_code
+    assert 200 == client.get(f"{dataset_route}/1", headers=headers).status_code
+
+    assert 1 == verify.call_count
+    assert 1 == decorators.auth_cache_stats()["hits"] - before["hits"]
+
+
+def test_logout_invalidates_cache(client, db_session):
+    """Verifies that a cached bearer token is rejected right after logout."""
+    headers = generate_auth_headers(client, user_id=3)
+    assert 200 == client.get(f"{dataset_route}/1", headers=headers).status_code
+
+    client.get("/logout", headers=headers)
+
+    assert 401 == client.get(f"{dataset_route}/1", headers=headers).status_code
+
+
+def test_revocation_by_other_worker_honoured(client, db_session):
+    """Verifies that a cached bearer token is rejected once it is revoked without its cache entry being dropped."""
+    headers = generate_auth_headers(client, user_id=3)
+    assert 200 == client.get(f"{dataset_route}/1", headers=headers).status_code
+
+    # As a logout handled by another worker would, the revocation only reaches the revoked token store
+    auth_util.revoked_tokens.revoke(
+        headers["Authorization"].split(" ")[1], datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    )
+
+    assert 401 == client.get(f"{dataset_route}/1", headers=headers).status_code
+
+
+def test_failures_not_cached(client, db_session, mocker):
+    """Verifies that a rejected bearer token is not cached."""
+    verify = mocker.spy(UserModel, "verify_auth_token_signature")
+
+    for _ in range(2):
+        assert 401 == client.get(f"{dataset_route}/1", headers={"Authorization": "Bearer not-a-token"}).status_code
+
+    assert 2 == verify.call_count
+    assert 0 == len(decorators.auth_cache)
+
+
+def test_api_key_revoke_invalidates_cache(client, db_session):
+    """Verifies that a cached API key is rejected right after it is revoked."""
+    headers = generate_auth_headers(client, user_id=3)
+    api_key = json.loads(client.get("/auth/api_key?revoke_status=false", headers=headers).data)["api_key"]
+    assert 200 == client.get(f"{dataset_route}/1", headers={"x-api-key": api_key}).status_code
+
+    client.get("/auth/api_key/revoke?revoke_status=true", headers=headers)
+
+    assert 401 == client.get(f"{dataset_route}/1", headers={"x-api-key": api_key}).status_code
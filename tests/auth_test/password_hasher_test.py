@@ -0,0 +1,77 @@
+import threading
+
+import bcrypt
+import pytest
+
+from core import passwords
+from core.passwords import PasswordHasher, PasswordHasherBusy
+from models.auth.user import UserModel
+from tests.conftest import login_route
+
+
+def test_hasher_rejects_when_saturated():
+    """Verifies that work beyond the queue limit is turned away instead of queued."""
+    hasher = PasswordHasher(workers=1, max_pending=1, rounds=4)
+    started, release = threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        release.wait()
+
+    holder = threading.Thread(target=hasher.run, args=(hold,))
+    holder.start()
+    started.wait()
+
+    with pytest.raises(PasswordHasherBusy):
+        hasher.hash("password")
+
+    release.set()
+    holder.join()
+    assert hasher.check("password", hasher.hash("password"))
+
+
+def test_needs_rehash():
+    """Verifies that hashes made at another cost are flagged for rehashing."""
+    hasher = PasswordHasher(rounds=5)
+
+    assert hasher.needs_rehash(bcrypt.hashpw(b"password", bcrypt.gensalt(4)).decode())
+    assert not hasher.needs_rehash(hasher.hash("password"))
+
+
+def test_login_rehashes_password(client, db_session, monkeypatch):
+    """Verifies that logging in moves the password hash to the configured cost."""
+    monkeypatch.setattr(passwords.password_hasher, "rounds", 5)
+    user = UserModel.query.filter_by(user_id=1).first()
+    email = user.email
+    user.password = bcrypt.hashpw(b"spotlight", bcrypt.gensalt(4)).decode()
+    db_session.commit()
+
+    res = client.post(login_route, json={"email": email, "password": "spotlight"})
+
+    assert 200 == res.status_code
+    assert "$2b$05$" == UserModel.query.filter_by(email=email).first().password[:7]
+
+
+def test_login_rehash_skipped_when_busy(client, db_session, mocker):
+    """Verifies that a login succeeds with the old hash when the password hashing pool is saturated on the rehash."""
+    mocker.patch.object(passwords.password_hasher, "rounds", 5)
+    user = UserModel.query.filter_by(user_id=1).first()
+    email = user.email
+    user.password = bcrypt.hashpw(b"spotlight", bcrypt.gensalt(4)).decode()
+    db_session.commit()
+    mocker.patch.object(passwords.password_hasher, "hash", side_effect=PasswordHasherBusy())
+
+    res = client.post(login_route, json={"email": email, "password": "spotlight"})
+
+    assert 200 == res.status_code
+    assert "$2b$04$" == UserModel.query.filter_by(email=email).first().password[:7]
+
+
+def test_login_busy(client, db_session, mocker):
+    """Verifies that a login is answered with 429 when the password hashing pool is saturated."""
+    mocker.patch.object(passwords.password_hasher, "run", side_effect=PasswordHasherBusy())
+    email = UserModel.query.filter_by(user_id=1).first().email
+
+    res = client.post(login_route, json={"email": email, "password": "spotlight"})
+
+    assert 429 == res.status_code
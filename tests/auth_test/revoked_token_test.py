@@ -0,0 +1,96 @@
+import datetime
+
+from models.auth.revoked_token import RevokedTokenModel
+from models.auth.util import RevokedTokenStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime.datetime(2021, 1, 1)
+
+    def __call__(self):
+        return self.now
+
+
+def test_revoked_token_rejected(db_session):
+    """Verifies that a revoked token is reported as revoked and other tokens are not."""
+    store = RevokedTokenStore(capacity=100)
+
+    store.revoke("revoked-token", datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+
+    assert store.is_revoked("revoked-token")
+    assert not store.is_revoked("other-token")
+
+
+def test_revocation_shared_between_workers(db_session):
+    """Verifies that a revocation made by one worker is seen by another after it syncs."""
+    worker, other_worker = RevokedTokenStore(capacity=100), RevokedTokenStore(capacity=100)
+    other_worker.sync()
+
+    worker.revoke("revoked-token", datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+    other_worker.sync(force=True)
+
+    assert other_worker.is_revoked("revoked-token")
+
+
+def test_expired_revocations_purged(db_session):
+    """Verifies that revocations are deleted once their tokens expire and the filter is rebuilt without them."""
+    clock = FakeClock()
+    store = RevokedTokenStore(capacity=100, clock=clock)
+    store.revoke("short-lived", clock.now + datetime.timedelta(minutes=1))
+    store.revoke("long-lived", clock.now + datetime.timedelta(days=1))
+    store.revoke("short-lived-2", clock.now + datetime.timedelta(minutes=2))
+
+    clock.now += datetime.timedelta(minutes=5)
+
+    assert 2 == store.purge_expired()
+    assert 1 == RevokedTokenModel.query.count()
+    assert 1 == len(store._filter)
+    assert store.is_revoked("long-lived")
+    assert not store.is_revoked("short-lived")
+
+
+def test_filter_rebuilt_aside(db_session, mocker):
+    """Verifies that the old filter keeps answering while the new one is built and revocations made meanwhile are kept."""
+    clock = FakeClock()
+    store = RevokedTokenStore(capacity=100, clock=clock)
+    store.revoke("short-lived", clock.now + datetime.timedelta(minutes=1))
+    store.revoke("short-lived-2", clock.now + datetime.timedelta(minutes=2))
+    store.revoke("long-lived", clock.now + datetime.timedelta(days=1))
+    clock.now += datetime.timedelta(minutes=5)
+
+    live_revocations = store._live_revocations
+    seen_during_rebuild = []
+
+    def read_during_revocation(now):
+        rows = live_revocations(now)
+        seen_during_rebuild.append(store.is_revoked("long-lived"))
+        store.revoke("revoked-during-rebuild", clock.now + datetime.timedelta(days=1))
+        return rows
+
+    mocker.patch.object(store, "_live_revocations", side_effect=read_during_revocation)
+
+    assert 2 == store.purge_expired()
+    assert [True] == seen_during_rebuild
+    assert 2 == len(store._filter)
+    assert store.is_revoked("long-lived")
+    assert store.is_revoked("revoked-during-rebuild")
+
+
+def test_sync_prunes_expired_tokens(db_session):
+    """Verifies that a worker that never handles a logout drops expired tokens from its filter as it syncs."""
+    clock = FakeClock()
+    worker, other_worker = RevokedTokenStore(capacity=100, clock=clock), RevokedTokenStore(capacity=100, clock=clock)
+    other_worker.revoke("short-lived", clock.now + datetime.timedelta(minutes=1))
+    other_worker.revoke("short-lived-2", clock.now + datetime.timedelta(minutes=2))
+    other_worker.revoke("long-lived", clock.now + datetime.timedelta(days=1))
+    worker.sync(force=True)
+    assert 3 == len(worker._filter)
+
+    clock.now += datetime.timedelta(minutes=5)
+    worker.sync(force=True)
+
+    assert 1 == len(worker._filter)
+    assert 1 == len(worker._expiries)
+    assert worker.is_revoked("long-lived")
+
@@ -0,0 +1,237 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from core import anonymized_copies, aws, redaction
+from core.constants import AnonymizationType
+from models.datasets.anonymized_copy import AnonymizedCopyModel
+from models.datasets.file import FileModel
+from models.pii.marker_character import PIIMarkerCharacterModel
+from tests.conftest import dataset_route, generate_auth_headers
+
+moto = pytest.importorskip("moto")
+mock_aws = getattr(moto, "mock_aws", None) or getattr(moto, "mock_s3")
+
+RAW_BUCKET = "temp-test-datasets"
+COPY_BUCKET = "spotlight-anonymized-copies"
+
+
+@pytest.fixture
+def s3(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    with mock_aws():
+        aws.reset_s3_client()
+        client = aws.get_s3_client()
+        client.create_bucket(Bucket=RAW_BUCKET)
+        client.create_bucket(Bucket=COPY_BUCKET)
+        client.put_object(Bucket=RAW_BUCKET, Key="dataset.txt", Body=b"Caller SSN: 123-45-678 thanks")
+        yield client
+
+    aws.reset_s3_client()
+    anonymized_copies.index_cache.clear()
+
+
+def load_markers(file_id):
+    return PIIMarkerCharacterModel.query.filter_by(file_id=file_id).all()
+
+
+def copy_location(file_id):
+    return AnonymizedCopyModel.query.filter_by(file_id=file_id).one().location
+
+
+def test_anonymized_copy_indexed(db_session, s3, mocker):
+    """Verifies that an anonymized copy is indexed once and then served without calling S3."""
+    markers = load_markers(1)
+
+    _, permitted = aws.generate_presigned_download_link(1, "dataset.txt", markers, ["ssn", "name", "ssn"])
+    copy = AnonymizedCopyModel.query.filter_by(file_id=1).one()
+
+    assert "name,ssn" == copy.permissions
+    assert [m.pii_id for m in markers] == [m.pii_id for m in permitted]
+
+    api_call = mocker.patch("botocore.client.BaseClient._make_api_call")
+    url, _ = aws.generate_presigned_download_link(1, "dataset.txt", markers, ["name", "ssn"])
+
+    assert copy.location in url
+    assert not api_call.called
+
+
+def test_markers_left_untouched(client, db_session, s3):
+    """Verifies that serving a file through a redacted copy does not move the markers stored for it."""
+    db_session.add(PIIMarkerCharacterModel(file_id=1, pii_type="name", confidence=0.9, start_location=0,
+                                           end_location=6))
+    db_session.commit()
+    stored = [(m.pii_id, m.start_location, m.end_location) for m in load_markers(1)]
+
+    # User 1 may only see the SSN, so the name before it is redacted and the SSN moves in the copy
+    res = client.get(f"{dataset_route}/1/file/1", headers=generate_auth_headers(client, user_id=1))
+    # Anything the request left changed in the session would be written by the next commit
+    db_session.commit()
+    db_session.expire_all()
+
+    assert 200 == res.status_code
+    assert ["ssn"] == [marker["pii_type"] for marker in res.json["markers"]]
+    assert stored[0][1] != res.json["markers"][0]["start_location"]
+    assert stored == [(m.pii_id, m.start_location, m.end_location) for m in load_markers(1)]
+    assert copy_location(1) in res.json["location"]
+    assert "s3://" in FileModel.query.get(1).location
+
+
+def test_anonymized_copy_invalidated(db_session, s3):
+    """Verifies that the copies of a file are dropped from the index and purged from S3 when its markers change."""
+    markers = load_markers(1)
+    aws.generate_presigned_download_link(1, "dataset.txt", markers, [])
+
+    aws.invalidate_anonymized_copies([1]).result(timeout=10)
+
+    assert 0 == AnonymizedCopyModel.query.filter_by(file_id=1).count()
+    assert 0 == len(anonymized_copies.index_cache)
+    assert "Contents" not in s3.list_objects_v2(Bucket=COPY_BUCKET)
+
+
+def test_invalidate_leaves_session_uncommitted(db_session, s3):
+    """Verifies that invalidating copies leaves the changes staged in the request session to the caller."""
+    aws.generate_presigned_download_link(1, "dataset.txt", load_markers(1), [])
+    file = FileModel.query.get(1)
+    file.location = "s3://elsewhere/dataset.txt"
+
+    anonymized_copies.invalidate([1])
+
+    assert file in db_session.dirty
+    assert 0 == AnonymizedCopyModel.query.filter_by(file_id=1).count()
+
+
+def test_source_check_failure_is_a_miss(db_session, s3, mocker):
+    """Verifies that a raw file that cannot be checked makes the copy a miss and a missing one makes it stale."""
+    aws.generate_presigned_download_link(1, "dataset.txt", load_markers(1), [])
+    copy = anonymized_copies.lookup(1, anonymized_copies.markers_digest(load_markers(1)), "", AnonymizationType.REDACT)
+    head_object = mocker.patch.object(
+        s3, "head_object", side_effect=ClientError({"Error": {"Code": "SlowDown"}}, "HeadObject")
+    )
+
+    assert not aws.check_source_version(1, "dataset.txt", copy)
+    assert 1 == AnonymizedCopyModel.query.filter_by(file_id=1).count()
+
+    head_object.side_effect = ClientError({"Error": {"Code": "404"}}, "HeadObject")
+
+    assert not aws.check_source_version(1, "dataset.txt", copy)
+    assert 0 == AnonymizedCopyModel.query.filter_by(file_id=1).count()
+
+
+def test_anonymized_copy_source_replaced(db_session, s3):
+    """Verifies that a copy read from the index is not served once its raw file has been replaced."""
+    markers = load_markers(1)
+    aws.generate_presigned_download_link(1, "dataset.txt", markers, [])
+    stale = copy_location(1)
+
+    s3.put_object(Bucket=RAW_BUCKET, Key="dataset.txt", Body=b"Replaced: no PII in here")
+    anonymized_copies.index_cache.clear()
+    url, _ = aws.generate_presigned_download_link(1, "dataset.txt", markers, [])
+    aws.get_purge_executor().submit(lambda: None).result(timeout=10)  # Waits for the purge queued before it
+
+    assert stale != copy_location(1)
+    assert copy_location(1) in url
+    assert [copy_location(1)] == [o["Key"] for o in s3.list_objects_v2(Bucket=COPY_BUCKET)["Contents"]]
+
+
+def test_character_file_streamed(db_session, s3, tmp_path):
+    """Verifies that a character-based file is anonymized from the S3 object body without writing local files."""
+    markers = load_markers(1)
+    expected, _ = redaction.redact_text("Caller SSN: 123-45-678 thanks", redaction.marker_spans(markers))
+
+    aws.generate_presigned_download_link(1, "dataset.txt", markers, [])
+    copy = AnonymizedCopyModel.query.filter_by(file_id=1).one()
+
+    assert expected.encode() == s3.get_object(Bucket=COPY_BUCKET, Key=copy.location)["Body"].read()
+    assert [] == list(tmp_path.iterdir())
+
+
+def test_image_build_cleaned_up(db_session, s3, tmp_path, mocker):
+    """Verifies that an image-based file is downloaded to a directory of its own, removed when anonymization fails."""
+    s3.put_object(Bucket=RAW_BUCKET, Key="scans/page.pdf", Body=b"%PDF-1.4")
+    mocker.patch.object(aws.tempfile, "tempdir", str(tmp_path))
+    downloads = []
+
+    def anonymize_file(path, markers, permissions, anon_method):
+        downloads.append(path)
+        raise RuntimeError("rasterization failed")
+
+    mocker.patch.object(aws, "anonymize_file", side_effect=anonymize_file)
+
+    with pytest.raises(RuntimeError):
+        aws.build_anonymized_copy(2, "scans/page.pdf", [], [], "digest", AnonymizationType.REDACT)
+
+    assert "page.pdf" == downloads[0].rsplit("/", 1)[1]
+    assert str(tmp_path) == downloads[0].rsplit("/", 2)[0]
+    assert [] == [path.name for path in tmp_path.iterdir()]
+
+
+def test_multipart_upload_writer(s3):
+    """Verifies that output larger than a part is uploaded in parts and reassembled in order."""
+    text = "0123456789" * (aws.MIN_PART_SIZE // 10) + "tail"
+
+    with aws.MultipartUploadWriter(s3, COPY_BUCKET, "large.txt", part_size=aws.MIN_PART_SIZE) as writer:
+        for i in range(0, len(text), 100000):
+            writer.write(text[i:i + 100000])
+
+    assert 2 == len(writer.parts)
+    assert text.encode() == s3.get_object(Bucket=COPY_BUCKET, Key="large.txt")["Body"].read()
+
+
+def test_multipart_upload_aborted(s3):
+    """Verifies that a failed upload is aborted rather than completed."""
+    with pytest.raises(RuntimeError):
+        with aws.MultipartUploadWriter(s3, COPY_BUCKET, "failed.txt", part_size=aws.MIN_PART_SIZE) as writer:
+            writer.write("x" * aws.MIN_PART_SIZE)
+            raise RuntimeError()
+
+    assert [] == s3.list_multipart_uploads(Bucket=COPY_BUCKET).get("Uploads", [])
+    assert "Contents" not in s3.list_objects_v2(Bucket=COPY_BUCKET)
+
+
+def test_copy_built_while_waiting(db_session, s3, mocker):
+    """Verifies that a request which waited on the build lock serves the copy indexed meanwhile instead of building."""
+    build = mocker.spy(aws, "build_anonymized_copy")
+    built_elsewhere = {"location": "built-elsewhere", "marker_locations": []}
+    mocker.patch.object(anonymized_copies, "lookup", side_effect=[None, built_elsewhere])
+
+    url, permitted = aws.generate_presigned_download_link(1, "dataset.txt", load_markers(1), [])
+
+    assert "built-elsewhere" in url
+    assert [] == permitted
+    assert not build.called
+
+
+def test_copy_pending(db_session, s3, monkeypatch):
+    """Verifies that a request gives up as pending while another request holds the build lock for the same copy."""
+    monkeypatch.setattr(anonymized_copies, "BUILD_WAIT", 0)
+    markers = load_markers(1)
+    flight_key = aws.generate_anonymized_filepath("dataset.txt", AnonymizationType.REDACT, [],
+                                                  markers_digest=anonymized_copies.markers_digest(markers))
+
+    with anonymized_copies.build_lock(flight_key):
+        with pytest.raises(anonymized_copies.CopyPending):
+            aws.generate_presigned_download_link(1, "dataset.txt", markers, [])
+
+    assert 0 == AnonymizedCopyModel.query.filter_by(file_id=1).count()
+    assert {} == anonymized_copies._local_locks
+
+
+def test_advisory_lock_waiters_release_connections(mocker):
+    """Verifies that a request waiting on the build lock holds no pooled connection between its attempts."""
+    db = mocker.patch.object(anonymized_copies, "db")
+    mocker.patch.object(anonymized_copies, "BUILD_POLL_INTERVAL", 0)
+    connections = [mocker.MagicMock() for _ in range(3)]
+    for connection, acquired in zip(connections, (False, False, True)):
+        connection.execute.return_value.scalar.return_value = acquired
+    db.engine.connect.side_effect = connections
+    db.engine.dialect.name = "postgresql"
+
+    with anonymized_copies.build_lock("copy-key"):
+        assert [True, True, False] == [connection.close.called for connection in connections]
+
+    assert connections[2].close.called
+
@@ -0,0 +1,57 @@
+from core import aws
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_presigned_url_reused(monkeypatch):
+    """Verifies that a presigned URL is reused until the reuse fraction of its lifetime is spent."""
+    clock = FakeClock()
+    monkeypatch.setattr(aws.url_cache, "clock", clock)
+    aws.url_cache.clear()
+    before = aws.presigned_url_stats()
+    signed = []
+
+    def sign():
+        signed.append(clock.now)
+        return f"https://example.com/key?signed={clock.now}"
+
+    first = aws.cached_presigned_url("bucket", "key", "get_object", 3600, sign)
+    clock.now = 1799
+    assert first == aws.cached_presigned_url("bucket", "key", "get_object", 3600, sign)
+
+    clock.now = 1800
+    assert first != aws.cached_presigned_url("bucket", "key", "get_object", 3600, sign)
+    assert [0, 1800] == signed
+    stats = aws.presigned_url_stats()
+    assert (1, 2) == (stats["hits"] - before["hits"], stats["misses"] - before["misses"])
+    aws.url_cache.clear()
+
+
+def test_presigned_url_keyed_by_operation(monkeypatch):
+    """Verifies that URLs for other objects, operations or lifetimes are signed separately."""
+    aws.url_cache.clear()
+
+    aws.cached_presigned_url("bucket", "key", "get_object", 3600, lambda: "get")
+    assert "put" == aws.cached_presigned_url("bucket", "key", "put_object", 3600, lambda: "put")
+    assert "other" == aws.cached_presigned_url("bucket", "other", "get_object", 3600, lambda: "other")
+    assert "short" == aws.cached_presigned_url("bucket", "key", "get_object", 60, lambda: "short")
+    aws.url_cache.clear()
+
+
+def test_presigned_post_response_copied(mocker):
+    """Verifies that callers adding keys to a presigned post do not change the cached response."""
+    aws.url_cache.clear()
+    mocker.patch.object(aws.get_s3_client(), "generate_presigned_post", return_value={"url": "u", "fields": {}})
+
+    response = aws.generate_presigned_link("bucket", "key")
+    response["dataset_id"] = 1
+    response["fields"]["key"] = "changed"
+
+    assert {"url": "u", "fields": {}} == aws.generate_presigned_link("bucket", "key")
+    aws.url_cache.clear()
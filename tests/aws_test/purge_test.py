@@ -0,0 +1,65 @@
+import pytest
+from botocore.exceptions import EndpointConnectionError
+
+from core import aws
+
+moto = pytest.importorskip("moto")
+mock_aws = getattr(moto, "mock_aws", None) or getattr(moto, "mock_s3")
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    with mock_aws():
+        aws.reset_s3_client()
+        client = aws.get_s3_client()
+        client.create_bucket(Bucket=aws.RAW_FILE_BUCKET)
+        client.create_bucket(Bucket=aws.ANONYMIZED_COPY_BUCKET)
+        yield client
+
+    aws.reset_s3_client()
+
+
+def test_delete_objects_batched(s3, mocker):
+    """Verifies that keys are deleted DELETE_BATCH_SIZE at a time."""
+    mocker.patch.object(aws, "DELETE_BATCH_SIZE", 2)
+    keys = [f"file_{i}.txt" for i in range(5)]
+    for key in keys:
+        s3.put_object(Bucket=aws.RAW_FILE_BUCKET, Key=key, Body=b"")
+    delete = mocker.spy(s3, "delete_objects")
+
+    assert [] == aws.delete_objects(aws.RAW_FILE_BUCKET, keys)
+    assert 3 == delete.call_count
+    assert "Contents" not in s3.list_objects_v2(Bucket=aws.RAW_FILE_BUCKET)
+
+
+def test_dataset_cleanup(s3):
+    """Verifies that raw files and their anonymized copies are purged in the background."""
+    s3.put_object(Bucket=aws.RAW_FILE_BUCKET, Key="data/a.txt", Body=b"")
+    s3.put_object(Bucket=aws.ANONYMIZED_COPY_BUCKET, Key="copy-of-a", Body=b"")
+    s3.put_object(Bucket=aws.ANONYMIZED_COPY_BUCKET, Key="unrelated", Body=b"")
+
+    aws.dataset_cleanup(["s3://temp-test-datasets.s3.amazonaws.com/data/a.txt"], ["copy-of-a"]).result(timeout=10)
+
+    assert "Contents" not in s3.list_objects_v2(Bucket=aws.RAW_FILE_BUCKET)
+    assert ["unrelated"] == [o["Key"] for o in s3.list_objects_v2(Bucket=aws.ANONYMIZED_COPY_BUCKET)["Contents"]]
+
+
+def test_purge_continues_after_connection_error(s3, mocker):
+    """Verifies that a bucket that cannot be reached is logged and the other buckets are still purged."""
+    s3.put_object(Bucket=aws.ANONYMIZED_COPY_BUCKET, Key="copy-of-a", Body=b"")
+    delete_objects = aws.delete_objects
+
+    def unreachable_raw_bucket(bucket, keys):
+        if bucket == aws.RAW_FILE_BUCKET:
+            raise EndpointConnectionError(endpoint_url="https://s3.amazonaws.com")
+        return delete_objects(bucket, keys)
+
+    mocker.patch.object(aws, "delete_objects", side_effect=unreachable_raw_bucket)
+
+    aws.purge_objects({aws.RAW_FILE_BUCKET: ["data/a.txt"], aws.ANONYMIZED_COPY_BUCKET: ["copy-of-a"]})
+
+    assert "Contents" not in s3.list_objects_v2(Bucket=aws.ANONYMIZED_COPY_BUCKET)
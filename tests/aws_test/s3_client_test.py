@@ -0,0 +1,20 @@
+from core import aws
+
+
+def test_s3_client_shared():
+    """Verifies that every call site gets the same lazily created S3 client."""
+    aws.reset_s3_client()
+
+    client = aws.get_s3_client()
+
+    assert client is aws.get_s3_client()
+    assert aws.S3_MAX_POOL_CONNECTIONS == client.meta.config.max_pool_connections
+
+
+def test_s3_client_reset():
+    """Verifies that a new client is created after a reset."""
+    client = aws.get_s3_client()
+
+    aws.reset_s3_client()
+
+    assert client is not aws.get_s3_client()
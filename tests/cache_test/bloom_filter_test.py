@@ -0,0 +1,23 @@
+from core.bloom import BloomFilter
+
+
+def test_no_false_negatives():
+    """Verifies that every added item is reported as present."""
+    bloom = BloomFilter(1000)
+    items = [f"token-{i}" for i in range(1000)]
+    for item in items:
+        bloom.add(item)
+
+    assert all(item in bloom for item in items)
+    assert 1000 == len(bloom)
+
+
+def test_false_positive_rate():
+    """Verifies that the false positive rate at capacity stays close to the configured error rate."""
+    bloom = BloomFilter(10000, error_rate=0.01)
+    for i in range(10000):
+        bloom.add(f"token-{i}")
+
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+
+    assert false_positives < 200
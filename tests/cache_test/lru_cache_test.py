@@ -0,0 +1,47 @@
+from core.cache import LRUCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_evicts_least_recently_used():
+    """Verifies that the least recently used entry is evicted once the cache is full."""
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert 1 == cache.get("a")
+    assert cache.get("b") is None
+    assert 1 == cache.stats()["evictions"]
+
+
+def test_entries_expire():
+    """Verifies that an entry is a miss once its ttl has passed."""
+    clock = FakeClock()
+    cache = LRUCache(10, ttl=5, clock=clock)
+    cache.put("a", 1)
+    cache.put("b", 2, ttl=20)
+
+    clock.now = 10
+
+    assert cache.get("a") is None
+    assert 2 == cache.get("b")
+
+
+def test_stats():
+    """Verifies that hits and misses are counted."""
+    cache = LRUCache(10)
+    calls = []
+
+    for _ in range(3):
+        cache.get_or_create("a", lambda: calls.append(1) or "value")
+
+    assert 1 == len(calls)
+    assert {"hits": 2, "misses": 1} == {k: cache.stats()[k] for k in ("hits", "misses")}
@@ -0,0 +1,158 @@
+from sqlalchemy import inspect
+from sqlalchemy.dialects import postgresql
+
+from core import dataset_access
+from core.constants import DatasetAccessKinds
+from db import db
+from models.auth.user import UserModel
+from models.datasets.access import DatasetAccessModel
+from models.datasets.base import DatasetModel
+from models.pii.pii import PIIModel
+from models.roles.role import RoleModel
+from models.roles.role_member import RoleMemberModel
+from resources.datasets import util as dataset_util
+from tests.conftest import dataset_route, generate_auth_headers
+
+
+def access_rows(user_id: int) -> dict:
+    return {
+        row.dataset_id: (row.access_kind, row.permissions)
+        for row in DatasetAccessModel.query.filter_by(user_id=user_id).all()
+    }
+
+
+def test_access_derived_from_fixtures(db_session):
+    """Verifies that the access index holds the owned datasets and the datasets shared through roles."""
+    assert {
+        1: (DatasetAccessKinds.OWNED, ["ssn"]),
+        2: (DatasetAccessKinds.OWNED, []),
+        3: (DatasetAccessKinds.OWNED, []),
+    } == access_rows(3)
+    assert {1: (DatasetAccessKinds.SHARED, ["ssn"])} == access_rows(1)
+    assert {} == access_rows(2)
+
+
+def test_access_follows_role_datasets(db_session):
+    """Verifies that sharing a dataset with a role gives its members access with the role's permissions."""
+    role: RoleModel = RoleModel.query.get(2)
+    role.datasets.append(DatasetModel.query.get(4))
+    db_session.flush()
+
+    assert {4: (DatasetAccessKinds.SHARED, ["address", "name"])} == access_rows(2)
+
+    role.datasets.remove(DatasetModel.query.get(4))
+    db_session.flush()
+
+    assert {} == access_rows(2)
+
+
+def test_access_follows_role_members(db_session):
+    """Verifies that removing a member from a role removes their access to the role's datasets."""
+    db_session.delete(RoleMemberModel.query.filter_by(role_id=1, user_id=1).first())
+    db_session.flush()
+
+    assert {} == access_rows(1)
+
+    db_session.add(RoleMemberModel(role_id=1, user_id=2))
+    db_session.flush()
+
+    assert {1: (DatasetAccessKinds.SHARED, ["ssn"])} == access_rows(2)
+
+
+def test_access_follows_role_permissions(db_session):
+    """Verifies that the permissions of the access rows follow the permissions of the roles."""
+    role: RoleModel = RoleModel.query.get(1)
+    role.permissions.append(PIIModel.query.filter_by(description="name").first())
+    db_session.flush()
+
+    assert {1: (DatasetAccessKinds.SHARED, ["name", "ssn"])} == access_rows(1)
+
+
+def test_access_follows_dataset_owners(db_session):
+    """Verifies that owners take precedence over roles and lose access when they are removed."""
+    dataset: DatasetModel = DatasetModel.query.get(1)
+    dataset.owners.append(UserModel.query.get(1))
+    db_session.flush()
+
+    assert {1: (DatasetAccessKinds.OWNED, ["ssn"])} == access_rows(1)
+
+    dataset.owners.remove(UserModel.query.get(3))
+    db_session.flush()
+
+    assert (DatasetAccessKinds.SHARED, ["ssn"]) == access_rows(3)[1]
+
+
+def test_rebuild_matches_incremental_rows(db_session):
+    """Verifies that rebuilding the index from scratch gives the rows maintained incrementally."""
+    before: set = {
+        (row.user_id, row.dataset_id, row.access_kind, tuple(row.permissions))
+        for row in DatasetAccessModel.query.all()
+    }
+
+    assert len(before) == dataset_access.rebuild()
+    assert before == {
+        (row.user_id, row.dataset_id, row.access_kind, tuple(row.permissions))
+        for row in DatasetAccessModel.query.all()
+    }
+
+
+def test_rebuild_command(app, db_session):
+    """Verifies that the rebuild-dataset-access command backfills the index."""
+    db_session.execute(DatasetAccessModel.__table__.delete())
+
+    result = app.test_cli_runner().invoke(args=["rebuild-dataset-access"])
+
+    assert 0 == result.exit_code
+    assert f"Rebuilt dataset_access with {DatasetAccessModel.query.count()} rows\n" == result.output
+    assert {1: (DatasetAccessKinds.SHARED, ["ssn"])} == access_rows(1)
+
+
+def test_refresh_upserts_on_postgresql():
+    """Verifies that on PostgreSQL, refreshed rows overwrite rows committed concurrently rather than conflicting."""
+    statement = str(dataset_access._insert("postgresql").compile(dialect=postgresql.dialect()))
+
+    assert "ON CONFLICT ON CONSTRAINT _dataset_access_uc DO UPDATE SET" in statement
+    assert "ON CONFLICT" not in str(dataset_access._insert("sqlite"))
+
+
+def test_role_permissions_scoped_to_user_and_dataset(db_session):
+    """Verifies that role permissions are only granted to the members of the roles the dataset is shared with."""
+    assert (True, ["ssn"]) == dataset_util.check_dataset_role_permissions(1, 1)
+    assert (False, []) == dataset_util.check_dataset_role_permissions(1, 2)
+    assert (False, []) == dataset_util.check_dataset_role_permissions(4, 1)
+
+
+def test_list_shared_datasets(client, db_session):
+    """Verifies that the dataset list includes the datasets shared with the user through roles."""
+    headers = generate_auth_headers(client, user_id=1)
+
+    res = client.get(dataset_route, headers=headers)
+
+    assert 200 == res.status_code
+    assert [(1, DatasetAccessKinds.SHARED)] == [
+        (dataset["dataset_id"], dataset["permission"]) for dataset in res.json
+    ]
+
+
+def test_permissions_distinct_across_roles(db_session):
+    """Verifies that a PII type permitted by several of the user's roles is queried and listed once."""
+    role = RoleModel(creator_id=4, role_name="Identity Developers")
+    role.datasets = [DatasetModel.query.get(1)]
+    role.permissions = PIIModel.query.filter(PIIModel.description.in_(["ssn", "name"])).all()
+    db_session.add(role)
+    db_session.flush()
+    db_session.add(RoleMemberModel(role_id=role.role_id, user_id=1))
+    db_session.flush()
+
+    assert [(1, 1, "name"), (1, 1, "ssn")] == sorted(
+        db_session.execute(dataset_access._shared(user_ids={1})).fetchall()
+    )
+    assert (True, ["name", "ssn"]) == dataset_util.check_dataset_role_permissions(1, 1)
+
+
+def test_role_lookup_indexes(db_session):
+    """Verifies that role members are indexed by user and role datasets by dataset."""
+    inspector = inspect(db.engine)
+
+    assert ["user_id", "role_id"] in [index["column_names"] for index in inspector.get_indexes("role_member")]
+    assert ["dataset_id", "role_id"] in [index["column_names"] for index in inspector.get_indexes("role_dataset")]
@@ -11,13 +11,15 @@ import pytest
 def mock_api_call(mocker):
     return mocker.patch("botocore.client.BaseClient._make_api_call")
 
-def test_delete_dataset(client, db_session, mock_api_call):
-    """Verifies that datasets can be deleted."""
+def test_delete_dataset(client, db_session, mocker):
+    """Verifies that datasets can be deleted and their files are purged from S3 in the background."""
+    cleanup = mocker.patch("core.aws.dataset_cleanup")
     headers = generate_auth_headers(client, user_id=3)
 
     res = client.delete(f"{dataset_route}/1", headers=headers)
 
     assert 202 == res.status_code
+    assert 1 == cleanup.call_count
 
 def test_delete_missing_dataset(client, db_session):
     """Verifies that an error is thrown when a non-existent dataset is deleted."""
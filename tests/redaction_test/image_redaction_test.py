@@ -0,0 +1,126 @@
+import io
+import shutil
+from contextlib import ExitStack
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+from PyPDF2 import PdfFileReader, PdfFileWriter
+
+from core import anon
+from core.anon import ImageRedactor, plan_dpi
+
+requires_poppler = pytest.mark.skipif(shutil.which("pdftoppm") is None, reason="pdf2image needs poppler")
+
+
+def make_marker(x1, y1, x2, y2, page_number=1):
+    return SimpleNamespace(x1=x1, y1=y1, x2=x2, y2=y2, page_number=page_number)
+
+
+def test_redact_image(tmp_path):
+    """Verifies that a marker box is painted black on an image."""
+    path = str(tmp_path / "scan.png")
+    Image.new("RGB", (100, 100), "white").save(path)
+
+    ImageRedactor(path).redact(path, [make_marker(10, 60, 30, 80)])
+
+    redacted = Image.open(path)
+    assert (0, 0, 0) == redacted.getpixel((20, 30))
+    assert (255, 255, 255) == redacted.getpixel((50, 50))
+
+
+def test_window_independent_of_workers(tmp_path):
+    """Verifies that PDF pages are rasterized one at a time by default, whatever the number of threads."""
+    path = str(tmp_path / "scan.png")
+    Image.new("RGB", (100, 100), "white").save(path)
+
+    assert 1 == ImageRedactor(path, workers=8).window
+    assert 3 == ImageRedactor(path, window=3, workers=8).window
+
+
+def test_markers_bucketed_by_page(tmp_path):
+    """Verifies that markers are only painted on their own page."""
+    path = str(tmp_path / "scan.png")
+    Image.new("RGB", (100, 100), "white").save(path)
+    redactor = ImageRedactor(path, workers=2)
+    redactor.imgs = [Image.new("RGB", (100, 100), "white") for _ in range(3)]
+
+    pages = list(redactor._redact_images([make_marker(0, 0, 10, 10, page_number=2)]))
+
+    assert [(255, 255, 255), (0, 0, 0), (255, 255, 255)] == [page.getpixel((5, 95)) for page in pages]
+
+
+def test_convert_masked_to_pdf_in_memory(tmp_path, monkeypatch):
+    """Verifies that encoded pages are assembled into PDF pages without writing intermediate files."""
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "scan.png")
+    Image.new("RGB", (100, 100), "white").save(path)
+
+    for page_format in ("PNG", "JPEG"):
+        redactor = ImageRedactor(path, page_format=page_format, quality=50)
+        pages = [redactor.encode_page(Image.new("RGB", (100, 100), "white"), dpi=150) for _ in range(2)]
+
+        with ExitStack() as outputs:
+            assert 2 == len(redactor.convert_masked_to_pdf(pages, outputs))
+    assert ["scan.png"] == [p.name for p in tmp_path.iterdir()]
+
+
+def test_convert_masked_to_pdf_spilled(tmp_path, monkeypatch, mocker):
+    """Verifies that windows of pages past the spool size are written to temporary files."""
+    monkeypatch.setattr(anon, "RASTER_SPOOL_SIZE", 1)
+    temporary_file = mocker.spy(anon.tempfile, "TemporaryFile")
+    path = str(tmp_path / "scan.png")
+    Image.new("RGB", (100, 100), "white").save(path)
+    redactor = ImageRedactor(path, window=1)
+    pages = (redactor.encode_page(Image.new("RGB", (100, 100), "white"), dpi=150) for _ in range(3))
+
+    with ExitStack() as outputs:
+        raster_pages = redactor.convert_masked_to_pdf(pages, outputs)
+
+        writer = PdfFileWriter()
+        for page in raster_pages:
+            writer.addPage(page)
+        output = io.BytesIO()
+        writer.write(output)
+
+    assert 3 == temporary_file.call_count  # The first window rolls over, the others go to disk directly
+    assert 3 == PdfFileReader(output).getNumPages()
+
+
+def test_plan_dpi(tmp_path):
+    """Verifies that pages are planned at the resolution of their scans, raised for small markers."""
+    path = str(tmp_path / "scan.pdf")
+    Image.new("RGB", (1275, 1650), "white").save(path, resolution=150)
+    page = PdfFileReader(path).getPage(0)
+
+    assert 150 == plan_dpi(page, [make_marker(0, 0, 400, 200)])
+    assert 300 == plan_dpi(page, [make_marker(0, 0, 400, 16)])
+    assert 600 == plan_dpi(page, [make_marker(0, 0, 400, 2)])
+
+
+def test_pages_without_markers_are_copied(tmp_path):
+    """Verifies that pages without markers are copied into the output without being rasterized."""
+    path = str(tmp_path / "scan.pdf")
+    pages = [Image.new("RGB", (200, 200), "white") for _ in range(3)]
+    pages[0].save(path, save_all=True, append_images=pages[1:])
+
+    ImageRedactor(path).redact(path, [])
+
+    assert 3 == PdfFileReader(path).getNumPages()
+    assert ["scan.pdf"] == [p.name for p in tmp_path.iterdir()]
+
+
+@requires_poppler
+def test_redact_pdf_page_by_page(tmp_path, monkeypatch):
+    """Verifies that every page of a PDF ends up in the output when pages are rasterized one at a time."""
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "scan.pdf")
+    pages = [Image.new("RGB", (200, 200), "white") for _ in range(3)]
+    pages[0].save(path, save_all=True, append_images=pages[1:])
+
+    redactor = ImageRedactor(path, window=1)
+    redactor.redact(path, [make_marker(10, 10, 50, 50)])
+
+    assert 3 == redactor.page_count
+    assert 3 == ImageRedactor(path).page_count
+    assert ["scan.pdf"] == [p.name for p in tmp_path.iterdir()]
@@ -0,0 +1,45 @@
+from operator import itemgetter
+from types import SimpleNamespace
+
+from core.intervals import MarkerIntervalIndex
+
+
+def make_marker(start_location, end_location):
+    return SimpleNamespace(start_location=start_location, end_location=end_location)
+
+
+def test_merge_overlapping_markers():
+    """Verifies that overlapping markers are merged into disjoint intervals."""
+    index = MarkerIntervalIndex([make_marker(10, 14), make_marker(0, 4), make_marker(2, 8), make_marker(8, 9)])
+
+    assert [(0, 8), (8, 9), (10, 14)] == [(i.start, i.end) for i in index.intervals]
+    assert not index.intervals[0].covered
+    assert index.intervals[1].covered
+
+
+def test_overlapping_query():
+    """Verifies that only markers sharing a character with the span are returned."""
+    markers = [make_marker(0, 4), make_marker(2, 8), make_marker(10, 14), make_marker(20, 25)]
+    index = MarkerIntervalIndex(markers)
+
+    assert [markers[1], markers[2]] == index.overlapping(5, 11)
+    assert [] == index.overlapping(14, 20)
+
+
+def test_covering_query():
+    """Verifies that only markers containing the whole span are returned."""
+    markers = [make_marker(0, 10), make_marker(2, 5), make_marker(4, 12)]
+    index = MarkerIntervalIndex(markers)
+
+    assert [markers[0], markers[1]] == index.covering(3, 5)
+    assert [markers[2]] == index.covering(10, 12)
+    assert [] == index.covering(12, 13)
+
+
+def test_dictionary_markers():
+    """Verifies that markers can be indexed through custom keys."""
+    markers = [{"start_location": 5, "end_location": 9}, {"start_location": 0, "end_location": 3}]
+    index = MarkerIntervalIndex(markers, start_key=itemgetter("start_location"), end_key=itemgetter("end_location"))
+
+    assert [markers[1], markers[0]] == index.markers
+    assert [markers[0]] == index.overlapping(8, 20)
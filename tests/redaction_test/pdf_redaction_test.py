@@ -0,0 +1,160 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from pdfrw import PdfDict
+
+from redactors.pdf_parser import pdf_redactor
+from redactors.pdf_parser.map_pii import mapper
+from redactors.redactors import PageSpool, PdfFileRedactor
+
+
+def make_pdf(pages: list) -> io.BytesIO:
+    """Builds an uncompressed PDF with one line of Helvetica text per entry of each page."""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{4 + 2 * i} 0 R' for i in range(len(pages)))}] /Count {len(pages)} >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    for i, lines in enumerate(pages):
+        content = "BT /F1 12 Tf 72 720 Td 14 TL\n" + "\n".join(f"({line}) Tj T*" for line in lines) + "\nET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+
+    output, offsets = "%PDF-1.4\n", []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{obj}\nendobj\n"
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n" + "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return io.BytesIO(output.encode("latin-1"))
+
+
+def test_render_text_per_page():
+    """Verifies that a single pass over a document renders every page separately."""
+    pdf = make_pdf([["Page one"], ["Page two"], ["Page three"]])
+
+    assert {0: "Page one\x0c", 1: "Page two\x0c", 2: "Page three\x0c"} == pdf_redactor.render_text(pdf)
+    assert {2: "Page three\x0c"} == pdf_redactor.render_text(pdf, [2])
+    assert {} == pdf_redactor.render_text(pdf, [])
+
+
+def test_mapper_repeated_value():
+    """Verifies that a marker on a repeated value is mapped to its own occurrence rather than the first one."""
+    text_content = "John Smith\nmet John Smith\n\x0c"
+    text_tok = "John Smithmet John Smith"
+
+    pii = mapper(text_content, text_tok, [{"start_location": 15, "end_location": 25}])
+
+    assert (14, 24) == (pii[0]["start_location"], pii[0]["end_location"])
+
+
+def test_mapper_decoding_difference():
+    """Verifies that the alignment recovers after a character the two parsers decode differently."""
+    text_content = "ab\ufb01cd 123-45-6789 xyz"
+    text_tok = "abficd 123-45-6789 xyz"
+
+    pii = mapper(text_content, text_tok, [{"start_location": 6, "end_location": 17}])
+
+    assert "123-45-6789" == text_tok[pii[0]["start_location"]:pii[0]["end_location"]]
+
+
+def test_update_text_with_pii_across_tokens():
+    """Verifies that markers are blanked character for character, including markers spanning several tokens."""
+    text_tokens = [SimpleNamespace(value=value) for value in ["SSN 123-", "45-6789", " and ", "Jane Doe"]]
+    pii = [{"start_location": 4, "end_location": 15}, {"start_location": 20, "end_location": 24},
+           {"start_location": 22, "end_location": 28}]
+
+    pdf_redactor.update_text_with_pii(text_tokens, [], pii)
+
+    assert ["SSN ----", "-------", " and ", "--------"] == [t.value for t in text_tokens]
+
+
+def make_cmap(stream: str) -> PdfDict:
+    cmap = PdfDict()
+    cmap.stream = f"begincmap 1 begincodespacerange <0000> <FFFF> endcodespacerange {stream} endcmap"
+    return cmap
+
+
+def test_cmap_decode():
+    """Verifies that two-byte codes are decoded and unmapped bytes become question marks."""
+    cmap = pdf_redactor.CMap(make_cmap("1 beginbfchar <0001> <0041> endbfchar 1 beginbfrange <0010> <0012> <0061> endbfrange"))
+
+    assert "Ab?c" == cmap.decode(b"\x00\x01\x00\x11\x05\x00\x12")
+    assert (3, 1) == (cmap.hits, cmap.misses)
+
+
+def test_cmap_cache_shared():
+    """Verifies that CMaps with the same stream are parsed once."""
+    stream = "1 beginbfchar <0002> <0042> endbfchar"
+    misses = pdf_redactor.cmap_cache.misses
+
+    first = pdf_redactor.cached_cmap(make_cmap(stream))
+    second = pdf_redactor.cached_cmap(make_cmap(stream))
+
+    assert first is second
+    assert misses + 1 == pdf_redactor.cmap_cache.misses
+
+
+def test_page_spool_limit(tmp_path):
+    """Verifies that pages stay in memory until the request holds the limit, and later pages spill to disk."""
+    spool = PageSpool(str(tmp_path), 10)
+
+    buffers = [spool.store(data) for data in (b"123456", b"1234", b"1", b"")]
+
+    assert [True, True, False, True] == [isinstance(buffer, io.BytesIO) for buffer in buffers]
+    assert 10 == spool.in_memory
+    spool.close()
+    assert all(buffer.closed for buffer in buffers)
+
+
+def test_bounded_map_window():
+    """Verifies that at most a window of pages is taken from the input before the first result is returned."""
+    consumed = []
+
+    def pages():
+        for page in range(10):
+            consumed.append(page)
+            yield page
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = PdfFileRedactor._bounded_map(executor, lambda page, offset: page + offset, 3, pages(), [1] * 10)
+        first = next(results)
+
+        assert 1 == first
+        assert 3 == len(consumed)
+        assert list(range(2, 11)) == list(results)
+
+
+def ssn_marker(page_number: int) -> SimpleNamespace:
+    return SimpleNamespace(pii_type="ssn", page_number=page_number, start_location=5, end_location=16, confidence=1.0)
+
+
+def test_redact_file_spilled(tmp_path):
+    """Verifies that a document whose pages spill to disk is written back with every page in order."""
+    path = tmp_path / "document.pdf"
+    path.write_bytes(make_pdf([["SSN: 123-45-6789"], ["Page two"], ["SSN: 123-45-6789"]]).getvalue())
+
+    PdfFileRedactor(workers=1, spill_size=1).redact_file(str(path), [], [ssn_marker(1), ssn_marker(3)], None)
+
+    assert {0: "SSN: -----------\x0c", 1: "Page two\x0c", 2: "SSN: -----------\x0c"} == pdf_redactor.render_text(
+        str(path)
+    )
+
+
+def test_redact_file_parallel_matches_serial(tmp_path):
+    """Verifies that redacting pages in the process pool gives the same bytes as redacting them one by one."""
+    pages = [["SSN: 123-45-6789"] if page % 2 else [f"Page {page}"] for page in range(6)]
+    markers = [ssn_marker(page + 1) for page in range(6) if page % 2]
+    outputs = []
+
+    for workers in (1, 4):
+        path = tmp_path / f"document_{workers}.pdf"
+        path.write_bytes(make_pdf(pages).getvalue())
+        PdfFileRedactor(workers=workers).redact_file(str(path), [], markers, None)
+        outputs.append(path.read_bytes())
+
+    assert outputs[0] == outputs[1]
+    assert "SSN: -----------\x0c" == pdf_redactor.render_text(str(tmp_path / "document_4.pdf"), [1])[1]
@@ -0,0 +1,103 @@
+import io
+from types import SimpleNamespace
+
+from core import redaction
+from core.constants import AnonymizationType
+
+
+def make_marker(start_location, end_location, pii_type):
+    return SimpleNamespace(start_location=start_location, end_location=end_location, pii_type=pii_type)
+
+
+def test_redact_unpermitted_span():
+    """Verifies that unpermitted PII is replaced and later spans are shifted."""
+    text = "SSN 123-45-6789 belongs to Jane"
+    spans = [(4, 15, "ssn"), (27, 31, "name")]
+
+    redacted, locations = redaction.redact_text(text, spans, {"name"})
+
+    assert "SSN <REDACTED> belongs to Jane" == redacted
+    assert (4, 14, False) == locations[0]
+    assert "Jane" == redacted[locations[1][0]:locations[1][1]]
+    assert locations[1][2]
+
+
+def test_redact_overlapping_interval():
+    """Verifies that an interval is redacted as one unit when any of its spans is unpermitted."""
+    text = "Jane Doe lives here"
+    spans = [(0, 4, "name"), (2, 8, "address")]
+
+    redacted, locations = redaction.redact_text(text, spans, {"name"})
+
+    assert "<REDACTED> lives here" == redacted
+    assert not any(permitted for _, _, permitted in locations)
+
+
+def test_mask_policy():
+    """Verifies that a hashable PII type is masked under the mask policy."""
+    text = "Call 555-123-4567 now"
+
+    redacted, _ = redaction.redact_text(text, [(5, 17, "usa_phone")], policy=AnonymizationType.MASK)
+
+    assert redacted.startswith("Call +1 ")
+    assert redacted.endswith(" now")
+    assert "<REDACTED>" not in redacted
+
+
+def test_redact_without_spans():
+    """Verifies that text without spans is returned untouched."""
+    redacted, locations = redaction.redact_text("nothing to see", [])
+
+    assert "nothing to see" == redacted
+    assert [] == locations
+
+
+def test_redact_stream_across_chunk_boundaries():
+    """Verifies that streaming redaction matches in-memory redaction when spans straddle chunk boundaries."""
+    text = "SSN 123-45-6789 belongs to Jane, SSN 987-65-4321 to John"
+    spans = [(37, 48, "ssn"), (4, 15, "ssn"), (27, 31, "name")]
+
+    expected, expected_locations = redaction.redact_text(text, spans, {"name"})
+
+    output = io.StringIO()
+    locations = redaction.redact_stream(io.StringIO(text), output, spans, {"name"}, chunk_size=5)
+
+    assert expected == output.getvalue()
+    assert expected_locations == locations
+
+
+def test_redact_file_streaming(tmp_path):
+    """Verifies that a file is redacted in place when streaming is forced."""
+    path = tmp_path / "data.csv"
+    path.write_text("id,name\n1,Jane Doe\n")
+
+    locations = redaction.redact_file(str(path), [(10, 18, "name")], streaming=True, chunk_size=4)
+
+    assert "id,name\n1,<REDACTED>\n" == path.read_text()
+    assert [(10, 20, False)] == locations
+    assert ["data.csv"] == [p.name for p in tmp_path.iterdir()]
+
+
+def test_redact_binary_stream():
+    """Verifies that a binary stream is redacted at the character offsets of the file read in text mode."""
+    text = "Zoë Smith\r\nSSN 123-45-6789\r\n"
+    spans = [(14, 25, "ssn")]
+
+    output = io.StringIO()
+    reader = redaction.DecodingReader(io.BytesIO(text.encode()))
+    locations = redaction.redact_stream(reader, output, spans, chunk_size=3)
+
+    assert "Zoë Smith\nSSN <REDACTED>\n" == output.getvalue()
+    assert [(14, 24, False)] == locations
+
+
+def test_apply_locations():
+    """Verifies that only permitted markers are kept and moved to their new location."""
+    markers = [make_marker(27, 31, "name"), make_marker(4, 15, "ssn")]
+    text = "SSN 123-45-6789 belongs to Jane"
+
+    _, locations = redaction.redact_text(text, redaction.marker_spans(markers), ["name"])
+    permitted = redaction.apply_locations(markers, locations)
+
+    assert [markers[0]] == permitted
+    assert (26, 30) == (permitted[0].start_location, permitted[0].end_location)